@@ -3,7 +3,6 @@ from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_socketio import SocketIO
 from sqlalchemy.orm import DeclarativeBase
-from flask_session import Session
 
 class Base(DeclarativeBase):
     pass
@@ -16,7 +15,6 @@ def create_app():
     
     # Basic config
     app.secret_key = os.environ.get("FLASK_SECRET_KEY", os.urandom(24))
-    app.config["SESSION_TYPE"] = "filesystem"
     
     # Database config
     app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL")
@@ -24,11 +22,22 @@ def create_app():
         "pool_recycle": 300,
         "pool_pre_ping": True,
     }
+    app.config["DEBUG_ENDPOINTS"] = os.environ.get("DEBUG_ENDPOINTS") == "1"
     
     # Initialize extensions
-    Session(app)
     db.init_app(app)
-    socketio.init_app(app)
+    
+    # Query count, DB time and N+1 detection per request and Socket.IO
+    # event, reported at /api/debug/queries; QUERY_PROFILER=0 turns it off
+    # and QUERY_PROFILER_LOG_ALL=1 logs every profile, not just flagged ones
+    if os.environ.get("QUERY_PROFILER", "1") == "1":
+        from services.profiler import query_profiler
+        query_profiler.init_app(app, log_all=os.environ.get("QUERY_PROFILER_LOG_ALL") == "1")
+    
+    # Room broadcasts go through a shared message queue when several
+    # workers serve the same rooms (redis://..., or local:///path.sock)
+    from services.broadcast import broadcast_options
+    socketio.init_app(app, **broadcast_options(os.environ.get("SOCKETIO_MESSAGE_QUEUE")))
     
     with app.app_context():
         # Import models here to ensure they're registered with SQLAlchemy
@@ -36,6 +45,12 @@ def create_app():
         # Create all database tables
         db.create_all()
     
+    # Sessions live in the database behind an in-process cache; with
+    # SESSION_BACKEND=cookie they stay in Flask's signed cookie instead
+    if os.environ.get("SESSION_BACKEND", "database") == "database":
+        from services.sessions import DatabaseSessionInterface
+        app.session_interface = DatabaseSessionInterface()
+    
     # Register blueprints
     from routes.auth import auth_bp
     from routes.products import products_bp
@@ -44,6 +59,7 @@ def create_app():
     from routes.social import social_bp
     from routes.rewards import rewards_bp
     from routes.analytics import analytics_bp
+    from routes.debug import debug_bp
     
     app.register_blueprint(auth_bp)
     app.register_blueprint(products_bp)
@@ -52,6 +68,7 @@ def create_app():
     app.register_blueprint(social_bp)
     app.register_blueprint(rewards_bp)
     app.register_blueprint(analytics_bp)
+    app.register_blueprint(debug_bp)
     
     # Add custom template filters
     @app.template_filter('sum')
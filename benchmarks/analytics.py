@@ -0,0 +1,62 @@
+# Join-storm cost of stream analytics: per-event recompute and broadcast
+# (the old handlers) against incremental metrics pushed by the ticker.
+#
+#   python -m benchmarks.analytics --viewers 1000 2000 5000
+import argparse
+import time
+from datetime import datetime, timedelta
+
+from routes.analytics import AnalyticsManager
+
+
+def legacy_join_storm(viewers):
+    # Mirrors the previous handlers: a list rebuild and an O(n) average per
+    # event, then one analytics_update to every viewer in the room
+    view_durations = {}
+    engagement_data = []
+    packets = 0
+    start = time.perf_counter()
+    for user_id in range(viewers):
+        now = datetime.utcnow()
+        view_durations[user_id] = now
+        engagement_data.append({'timestamp': now, 'viewers': len(view_durations)})
+        cutoff = now - timedelta(hours=1)
+        engagement_data = [data for data in engagement_data if data['timestamp'] > cutoff]
+        durations = [(now - joined).total_seconds() for joined in view_durations.values()]
+        sum(durations) / len(durations)
+        packets += len(view_durations)
+    return time.perf_counter() - start, packets
+
+
+def ticker_join_storm(viewers, storm_seconds):
+    # Joins spread over storm_seconds, at most one push per tick
+    manager = AnalyticsManager()
+    manager.ticker_started = True  # ticks are driven by hand below
+    packets = 0
+    start = time.perf_counter()
+    per_tick = max(1, viewers // max(1, storm_seconds))
+    for user_id in range(viewers):
+        manager.update_viewer_metrics('1', user_id, 'join')
+        if (user_id + 1) % per_tick == 0 or user_id == viewers - 1:
+            rooms, manager.dirty_rooms = manager.dirty_rooms, set()
+            for room in rooms:
+                manager.calculate_metrics(room)
+                packets += len(manager.get_stream_analytics(room)['viewers'])
+    return time.perf_counter() - start, packets
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--viewers', type=int, nargs='+', default=[1000, 2000, 5000])
+    parser.add_argument('--storm-seconds', type=int, default=10)
+    args = parser.parse_args()
+
+    print(f"{'viewers':>8} {'before s':>10} {'before packets':>15} {'after s':>10} {'after packets':>14}")
+    for viewers in args.viewers:
+        before, before_packets = legacy_join_storm(viewers)
+        after, after_packets = ticker_join_storm(viewers, args.storm_seconds)
+        print(f'{viewers:>8} {before:>10.3f} {before_packets:>15,} {after:>10.3f} {after_packets:>14,}')
+
+
+if __name__ == '__main__':
+    main()
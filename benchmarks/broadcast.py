@@ -0,0 +1,132 @@
+# Room broadcast throughput through the local broker, by worker count.
+# Every worker publishes and also listens like a real worker does; delivered
+# counts the emits the workers' listeners and one extra observer actually
+# received from the broker.
+#
+#   python -m benchmarks.broadcast --workers 1 2 4 --messages 20000
+import argparse
+import json
+import multiprocessing
+import os
+import socket
+import tempfile
+import threading
+import time
+
+import socketio
+
+from services.broadcast import BroadcastBroker, LocalBrokerManager, connect, read_frames
+
+
+class CountingManager(LocalBrokerManager):
+    # Counts the emits of other workers that reach this worker's listener
+
+    def __init__(self, url, expected):
+        super().__init__(url)
+        self.expected = expected
+        self.received = 0
+        self.subscribed = threading.Event()
+        self.done = threading.Event()
+        if not expected:
+            self.done.set()
+
+    def _listen(self):
+        sock = connect(self.path, 'sub', self.channel)
+        self.subscribed.set()
+        try:
+            yield from read_frames(sock)
+        finally:
+            sock.close()
+
+    def _handle_emit(self, message):
+        super()._handle_emit(message)
+        if message.get('host_id') == self.host_id:
+            return  # this worker's own emit, handled locally
+        self.received += 1
+        if self.received >= self.expected:
+            self.done.set()
+
+
+def run_worker(url, workers, messages, barrier, results, timeout):
+    # A real Socket.IO server per worker, listening for the other workers
+    manager = CountingManager(url, (workers - 1) * messages)
+    server = socketio.Server(client_manager=manager)
+    server.manager_initialized = True
+    server.manager.initialize()
+    manager.subscribed.wait(timeout)
+    payload = {'username': 'bench', 'message': 'x' * 64}
+    barrier.wait()
+    for _ in range(messages):
+        server.emit('chat_message', payload, room='1')
+    manager.done.wait(timeout)
+    results.put(manager.received)
+
+
+def observe(path, expected, timeout):
+    observer = connect(path, 'sub', 'flask-socketio')
+    observer.settimeout(timeout)
+    received = 0
+    try:
+        for payload in read_frames(observer):
+            if json.loads(payload).get('method') == 'emit':
+                received += 1
+                if received == expected:
+                    break
+    except socket.timeout:
+        pass
+    finally:
+        observer.close()
+    return received
+
+
+def measure(url, path, workers, messages, timeout=60.0):
+    barrier = multiprocessing.Barrier(workers + 1)
+    results = multiprocessing.Queue()
+    processes = [
+        multiprocessing.Process(target=run_worker, args=(url, workers, messages, barrier, results, timeout))
+        for _ in range(workers)
+    ]
+    for process in processes:
+        process.start()
+
+    expected = workers * messages
+    observed = []
+    observer = threading.Thread(target=lambda: observed.append(observe(path, expected, timeout)))
+    observer.start()
+    barrier.wait()
+    start = time.perf_counter()
+    observer.join()
+    published_elapsed = time.perf_counter() - start
+    received = sum(results.get() for _ in processes)
+    elapsed = time.perf_counter() - start
+
+    for process in processes:
+        process.join()
+    delivered = observed[0] + received
+    lost = expected * workers - delivered
+    return observed[0] / published_elapsed, delivered / elapsed, lost
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--messages', type=int, default=20000)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), 'broadcast.sock')
+    url = f'local://{path}'
+    broker = multiprocessing.Process(target=BroadcastBroker(path).serve_forever, daemon=True)
+    broker.start()
+    while not os.path.exists(path):
+        time.sleep(0.01)
+
+    print(f"{'workers':>8} {'published msg/s':>16} {'delivered msg/s':>16} {'lost':>8}")
+    for workers in args.workers:
+        published, delivered, lost = measure(url, path, workers, args.messages)
+        print(f'{workers:>8} {published:>16,.0f} {delivered:>16,.0f} {lost:>8,}')
+
+    broker.terminate()
+
+
+if __name__ == '__main__':
+    main()
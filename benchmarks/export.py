@@ -0,0 +1,122 @@
+# Stream event export at scale: writes a synthetic event history (analytics
+# log plus chat and order rows), exports it as CSV and Parquet and reports
+# throughput, time per chunk / row group and how much the peak RSS grew.
+# Fails when memory grows past the budget, i.e. when the export stops
+# streaming: the growth is one chunk or row group whatever the event count.
+# Runs against DATABASE_URL (use a scratch database) or SQLite.
+#
+#   python -m benchmarks.export --events 10000000
+import argparse
+import os
+import random
+import resource
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from sqlalchemy import insert
+
+if not os.environ.get('DATABASE_URL'):
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'export.db')}"
+
+from app import create_app, db
+from models import ChatMessage, Order, Product, StreamSession, User
+from services.stream_export import export_chunks
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+def setup(app, log_directory, events, workers=2):
+    # ~98% viewer events in the log, the rest chat messages and orders
+    with app.app_context():
+        seller = User(username=f'export-bench-{time.time_ns()}', email=f'{time.time_ns()}@example.com',
+                      is_seller=True)
+        seller.set_password('export-bench')
+        db.session.add(seller)
+        db.session.flush()
+        product = Product(name='Export bench', price=5.0, stock=0, seller_id=seller.id)
+        stream = StreamSession(seller_id=seller.id, title='Export bench')
+        db.session.add_all([product, stream])
+        db.session.commit()
+        stream_id, product_id, user_id = stream.id, product.id, seller.id
+
+        start = time.time() - events / 1000
+        rows = events // 50
+        for model, values in [
+            (ChatMessage, lambda i: {'stream_id': stream_id, 'user_id': user_id, 'message': f'message {i}',
+                                     'created_at': datetime.utcfromtimestamp(start + i * 50 / 1000)}),
+            (Order, lambda i: {'stream_id': stream_id, 'user_id': user_id, 'product_id': product_id,
+                               'quantity': 1, 'total_amount': 5.0, 'status': 'completed',
+                               'created_at': datetime.utcfromtimestamp(start + i * 50 / 1000)}),
+        ]:
+            for offset in range(0, rows, 10000):
+                db.session.execute(insert(model), [values(i) for i in range(offset, min(offset + 10000, rows))])
+            db.session.commit()
+
+    stream_dir = os.path.join(log_directory, str(stream_id))
+    os.makedirs(stream_dir)
+    logs = [open(os.path.join(stream_dir, f'worker-{n}.log'), 'w') for n in range(workers)]
+    kinds = ['join', 'leave', 'active', 'inactive', 'view']
+    for i in range(events - 2 * rows):
+        t = start + i / 1000
+        kind = random.choice(kinds)
+        if kind == 'view':
+            line = f'{{"t":{t},"type":"action","user":{i % 5000},"action":"view","product":{product_id}}}\n'
+        else:
+            line = f'{{"t":{t},"type":"{kind}","user":{i % 5000}}}\n'
+        logs[i % workers].write(line)
+    for log in logs:
+        log.close()
+    return stream_id
+
+
+def measure(app, stream_id, log_directory, format):
+    with app.app_context():
+        gaps = []
+        size = 0
+        start = last = time.perf_counter()
+        with open(os.devnull, 'wb') as out:
+            for chunk in export_chunks(stream_id, log_directory, format):
+                out.write(chunk)
+                size += len(chunk)
+                now = time.perf_counter()
+                gaps.append(now - last)
+                last = now
+        return time.perf_counter() - start, gaps, size
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--events', type=int, default=1000000)
+    parser.add_argument('--formats', nargs='+', default=['csv', 'parquet'])
+    parser.add_argument('--max-rss-growth-mb', type=float, default=150.0)
+    args = parser.parse_args()
+
+    app = create_app()
+    log_directory = tempfile.mkdtemp()
+    stream_id = setup(app, log_directory, args.events)
+    print(f'{args.events:,} events written')
+
+    failed = False
+    print(f"{'format':>8} {'events/s':>10} {'MB':>8} {'chunks':>7} {'median chunk ms':>16} "
+          f"{'max chunk ms':>13} {'RSS growth MB':>14}")
+    for format in args.formats:
+        if format == 'parquet':
+            import pyarrow.parquet  # only the export itself counts towards the growth
+        before = peak_rss_mb()
+        elapsed, gaps, size = measure(app, stream_id, log_directory, format)
+        growth = peak_rss_mb() - before
+        print(f'{format:>8} {args.events / elapsed:>10,.0f} {size / 1e6:>8.1f} {len(gaps):>7} '
+              f'{statistics.median(gaps) * 1000:>16.1f} {max(gaps) * 1000:>13.1f} {growth:>14.1f}')
+        if growth > args.max_rss_growth_mb:
+            print(f'FAIL  {format} export grew RSS by {growth:.1f} MB')
+            failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+# Oversell check for the inventory service: many threads race to reserve one
+# product and the stock sold plus the stock left must equal the stock we
+# started with. Runs against DATABASE_URL (use a scratch database).
+#
+#   DATABASE_URL=postgresql://.../scratch python -m benchmarks.inventory --threads 32 --shards 0 8
+import argparse
+import random
+import sys
+import threading
+import time
+
+from app import create_app, db
+from models import Product, User
+from services.inventory import inventory
+
+
+def setup(app, stock, shards):
+    with app.app_context():
+        buyer = User.query.filter_by(username='inventory-bench').first()
+        if buyer is None:
+            buyer = User(username='inventory-bench', email='inventory-bench@example.com', is_seller=True)
+            buyer.set_password('inventory-bench')
+            db.session.add(buyer)
+            db.session.flush()
+        product = Product(name='Inventory bench', price=1.0, stock=stock, seller_id=buyer.id)
+        db.session.add(product)
+        db.session.flush()
+        if shards:
+            inventory.shard(product.id, shards)
+        db.session.commit()
+        return product.id, buyer.id
+
+
+def race(app, product_id, user_id, threads, attempts):
+    sold = []
+    failures = []
+    barrier = threading.Barrier(threads)
+
+    def buyer():
+        with app.app_context():
+            barrier.wait()
+            for _ in range(attempts):
+                quantity = random.randint(1, 3)
+                try:
+                    reservation = inventory.reserve(product_id, user_id, quantity, hold_seconds=60)
+                    if reservation is None:
+                        db.session.rollback()
+                        continue
+                    reservation.status = 'committed'
+                    db.session.commit()
+                    sold.append(quantity)
+                except Exception as exc:
+                    db.session.rollback()
+                    failures.append(exc)
+
+    workers = [threading.Thread(target=buyer) for _ in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return time.perf_counter() - start, sum(sold), len(sold), failures
+
+
+def check_expiry(app, product_id, user_id):
+    # Holds that run out go back into stock exactly once
+    with app.app_context():
+        before = inventory.available([product_id])[product_id]
+        holds = [inventory.reserve(product_id, user_id, 1, hold_seconds=0) for _ in range(min(before, 5))]
+        db.session.commit()
+        first = inventory.expire_stale()
+        second = inventory.expire_stale()
+        db.session.commit()
+        after = inventory.available([product_id])[product_id]
+        return len([hold for hold in holds if hold]), first, second, before == after
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--stock', type=int, default=500)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--attempts', type=int, default=50)
+    parser.add_argument('--shards', type=int, nargs='+', default=[0, 8])
+    args = parser.parse_args()
+
+    app = create_app()
+    ok = True
+    print(f"{'shards':>6} {'seconds':>8} {'orders':>7} {'sold':>6} {'left':>6} {'errors':>7}  result")
+    for shards in args.shards:
+        product_id, user_id = setup(app, args.stock, shards)
+        # Leave some stock unsold when there are not enough attempts to drain it
+        elapsed, sold, orders, failures = race(app, product_id, user_id, args.threads, args.attempts)
+        with app.app_context():
+            left = inventory.available([product_id])[product_id]
+        passed = sold + left == args.stock and left >= 0
+        ok = ok and passed
+        print(f'{shards:>6} {elapsed:>8.3f} {orders:>7} {sold:>6} {left:>6} {len(failures):>7}  '
+              f"{'ok' if passed else 'OVERSOLD'}")
+
+        if left:
+            holds, expired, again, restored = check_expiry(app, product_id, user_id)
+            ok = ok and restored and expired == holds and again == 0
+            print(f"{'':>6} expiry: {holds} holds, {expired} expired, {again} on second sweep, "
+                  f"stock {'restored' if restored else 'NOT restored'}")
+
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
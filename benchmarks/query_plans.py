@@ -0,0 +1,176 @@
+# Query-plan check for the hot routes: every statement those routes and
+# background jobs issue must be answered from an index, a full table scan is
+# reported and fails the run. The statements are not copied here: each hot
+# path is driven through the app (test client requests, service calls) and
+# whatever SQL it sends is captured and explained. Runs the migrations
+# first, against DATABASE_URL or a scratch SQLite file.
+#
+#   python -m benchmarks.query_plans
+#   DATABASE_URL=postgresql://.../scratch python -m benchmarks.query_plans
+import os
+import re
+import sys
+import tempfile
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from sqlalchemy import event
+
+if not os.environ.get('DATABASE_URL'):
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'plans.db')}"
+os.environ.setdefault('ANALYTICS_LOG_DIR', tempfile.mkdtemp())
+
+from app import create_app, db
+from migrations import run_migrations
+from models import (ChatMessage, FlashSale, GroupBuying, Order, Poll, Product, Question,
+                    StockReservation, StreamSession, User, follow_graph)
+from services.flash_sales import flash_sales
+from services.group_buys import group_buys
+from services.inventory import inventory
+from services.profiler import statement_shape
+
+# Tables that only ever hold a handful of configuration rows
+SMALL_TABLES = {'badge_rule'}
+CHECKED = ('SELECT', 'UPDATE', 'DELETE', 'WITH')
+
+
+def seed():
+    # One seller with a live stream, one buyer following them, and a row in
+    # every table the hot paths read, so no path returns before its queries
+    now = datetime.utcnow()
+    seller = User(username='plans-seller', email='plans-seller@example.com', is_seller=True)
+    buyer = User(username='plans-buyer', email='plans-buyer@example.com')
+    for user in (seller, buyer):
+        user.set_password('query-plans')
+    db.session.add_all([seller, buyer])
+    db.session.flush()
+    buyer.follow(seller)
+    product = Product(name='Plans', price=5.0, stock=10, seller_id=seller.id)
+    stream = StreamSession(seller_id=seller.id, title='Plans')
+    db.session.add_all([product, stream])
+    db.session.flush()
+    db.session.add_all([
+        ChatMessage(stream_id=stream.id, user_id=buyer.id, message='hello'),
+        Question(stream_id=stream.id, user_id=buyer.id, question='size?'),
+        Poll(stream_id=stream.id, question='colour?', options=['red', 'blue']),
+        Order(user_id=buyer.id, product_id=product.id, stream_id=stream.id, quantity=1,
+              total_amount=5.0, status='completed'),
+        FlashSale(stream_id=stream.id, product_id=product.id, discount_percentage=10,
+                  start_time=now - timedelta(minutes=5), end_time=now + timedelta(hours=1)),
+        GroupBuying(product_id=product.id, target_price=4.0, min_buyers=5,
+                    expires_at=now + timedelta(hours=1)),
+        StockReservation(product_id=product.id, user_id=buyer.id, quantity=1,
+                         expires_at=now + timedelta(minutes=10)),
+    ])
+    db.session.commit()
+    return {'seller': seller.id, 'buyer': buyer.id, 'product': product.id, 'stream': stream.id,
+            'cursor': f'{now.isoformat()}|{product.id}'}
+
+
+def hot_paths(ids):
+    # (route or job, callable(client for buyer, client for seller))
+    stream, seller = ids['stream'], ids['seller']
+    return [
+        ('products.list', lambda buyer, _: buyer.get('/products')),
+        ('products.list next page', lambda buyer, _: buyer.get('/products', query_string={'after': ids['cursor']})),
+        ('products.manage', lambda _, seller_client: seller_client.get('/products/manage')),
+        ('social.seller_profile', lambda buyer, _: buyer.get(f'/seller/{seller}')),
+        ('social.activity_feed', lambda buyer, _: buyer.get('/feed')),
+        ('stream.room', lambda buyer, _: buyer.get(f'/stream/{stream}')),
+        ('stream.chat_history', lambda buyer, _: buyer.get(f'/stream/{stream}/chat')),
+        ('orders.list', lambda buyer, _: buyer.get('/orders')),
+        ('rewards.badges', lambda buyer, _: buyer.get('/badges')),
+        ('analytics.stream_dashboard', lambda _, seller_client: seller_client.get(f'/analytics/dashboard/{stream}')),
+        ('follow graph follower ids', lambda *_: follow_graph.follower_ids(seller)),
+        ('checkout price', lambda *_: flash_sales.checkout_price(Product.query.get(ids['product']))),
+        ('flash sale reload', lambda *_: flash_sales.refresh()),
+        ('inventory expiry sweep', lambda *_: inventory.expire_stale()),
+        ('group buy expiry sweep', lambda *_: group_buys.sweep()),
+    ]
+
+
+@contextmanager
+def captured(engine):
+    # Collects (statement, parameters) of everything the engine sends
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if not executemany and statement.lstrip().upper().startswith(CHECKED):
+            statements.append((statement, parameters))
+
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+
+
+def full_scans(conn, sql, params):
+    # Returns (plan lines, tables read without an index)
+    if conn.dialect.name == 'sqlite':
+        plan = [row[-1] for row in conn.exec_driver_sql(f'EXPLAIN QUERY PLAN {sql}', params)]
+        scans = [re.match(r'SCAN (\w+)', line).group(1) for line in plan
+                 if re.match(r'SCAN \w+$', line)]
+    elif conn.dialect.name == 'postgresql':
+        # Empty tables are cheapest to scan, so only let the planner scan
+        # when no index can answer the query at all
+        conn.exec_driver_sql('SET LOCAL enable_seqscan = off')
+        plan = [row[0] for row in conn.exec_driver_sql(f'EXPLAIN {sql}', params)]
+        scans = [match.group(1) for line in plan
+                 for match in [re.search(r'Seq Scan on "?(\w+)"?', line)] if match]
+    else:
+        raise SystemExit(f'No plan check for {conn.dialect.name}')
+    return plan, [table for table in scans if table not in SMALL_TABLES]
+
+
+def login(app, user_id, is_seller):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = user_id
+        session['is_seller'] = is_seller
+    return client
+
+
+def main():
+    app = create_app()
+    failed = 0
+    with app.app_context():
+        run_migrations(db.engine)
+        ids = seed()
+        buyer, seller = login(app, ids['buyer'], False), login(app, ids['seller'], True)
+        paths = hot_paths(ids)
+        for name, run in paths:
+            with captured(db.engine) as statements:
+                result = run(buyer, seller)
+                db.session.rollback()
+            if getattr(result, 'status_code', 200) >= 400:
+                failed += 1
+                print(f'ERROR      {name}: HTTP {result.status_code}')
+                continue
+
+            problems = []
+            seen = set()
+            with db.engine.begin() as conn:
+                for sql, params in statements:
+                    shape = statement_shape(sql)
+                    if shape in seen:
+                        continue
+                    seen.add(shape)
+                    plan, scans = full_scans(conn, sql, params)
+                    if scans:
+                        problems.append((shape, scans, plan))
+            if problems:
+                failed += 1
+                for shape, scans, plan in problems:
+                    print(f"FULL SCAN  {name}: {', '.join(scans)}")
+                    print(f'           {shape}')
+                    for line in plan:
+                        print(f'           {line}')
+            else:
+                print(f'ok         {name} ({len(seen)} statements)')
+    print(f'{len(paths) - failed} of {len(paths)} hot paths use an index for every statement')
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+# Per-request session overhead of the previous filesystem store
+# (Flask-Session), the database store with its LRU cache, and Flask's signed
+# cookies. Each store backs a bare app whose views only touch the session, so
+# the timings are the session cost plus Flask's own request handling.
+#
+#   python -m benchmarks.sessions --requests 2000
+import argparse
+import os
+import tempfile
+import time
+
+if not os.environ.get('DATABASE_URL'):
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'sessions.db')}"
+
+from flask import Flask, session
+
+from app import db, socketio
+from services.sessions import DatabaseSessionInterface
+
+
+def make_app(store):
+    app = Flask(__name__)
+    app.secret_key = 'session-bench'
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.environ['DATABASE_URL']
+    db.init_app(app)
+    socketio.init_app(app)
+    with app.app_context():
+        import models
+        db.create_all()
+
+    if store == 'filesystem':
+        from flask_session import Session
+        app.config['SESSION_TYPE'] = 'filesystem'
+        app.config['SESSION_FILE_DIR'] = tempfile.mkdtemp()
+        Session(app)
+    elif store == 'database':
+        app.session_interface = DatabaseSessionInterface()
+    elif store == 'database-uncached':
+        app.session_interface = DatabaseSessionInterface(cache_ttl=0)
+
+    @app.route('/login')
+    def login():
+        session['user_id'] = 1
+        session['username'] = 'bench'
+        session['is_seller'] = False
+        return ''
+
+    @app.route('/read')
+    def read():
+        return str(session.get('user_id'))
+
+    @app.route('/write')
+    def write():
+        session['visits'] = session.get('visits', 0) + 1
+        return ''
+
+    return app
+
+
+def measure(app, path, requests):
+    client = app.test_client()
+    client.get('/login')
+    for _ in range(50):
+        client.get(path)
+    start = time.perf_counter()
+    for _ in range(requests):
+        client.get(path)
+    return (time.perf_counter() - start) / requests * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--stores', nargs='+',
+                        default=['filesystem', 'database', 'database-uncached', 'cookie'])
+    args = parser.parse_args()
+
+    print(f"{'store':>18} {'read us/req':>12} {'write us/req':>13}")
+    for store in args.stores:
+        app = make_app(store)
+        read = measure(app, '/read', args.requests)
+        write = measure(app, '/write', args.requests)
+        print(f'{store:>18} {read:>12,.0f} {write:>13,.0f}')
+
+
+if __name__ == '__main__':
+    main()
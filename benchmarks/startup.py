@@ -0,0 +1,76 @@
+# Worker startup cost: import time, create_app() time and peak RSS of a
+# fresh interpreter, median of several runs. Fails when a heavy numeric
+# module is loaded at startup or a budget is exceeded, so the analytics
+# stack stays lazy.
+#
+#   python -m benchmarks.startup --runs 5 --max-seconds 2 --max-rss-mb 120
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+# Only to be imported on first use, never by create_app()
+HEAVY_MODULES = ('numpy', 'pandas', 'sklearn', 'scipy')
+
+CHILD = """
+import json, resource, sys, time
+start = time.perf_counter()
+from app import create_app
+imported = time.perf_counter()
+create_app()
+created = time.perf_counter()
+rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({
+    'import_s': imported - start,
+    'create_app_s': created - imported,
+    'rss_mb': rss / (1024 * 1024 if sys.platform == 'darwin' else 1024),
+    'heavy': [name for name in %r if name in sys.modules],
+}))
+""" % (HEAVY_MODULES,)
+
+
+def measure(root, database_url):
+    env = dict(os.environ, DATABASE_URL=database_url)
+    output = subprocess.run([sys.executable, '-c', CHILD], cwd=root, env=env,
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--max-seconds', type=float, default=2.0,
+                        help='budget for import plus create_app()')
+    parser.add_argument('--max-rss-mb', type=float, default=120.0)
+    args = parser.parse_args()
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    database_url = os.environ.get('DATABASE_URL') or \
+        f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'startup.db')}"
+    runs = [measure(root, database_url) for _ in range(args.runs)]
+
+    import_s = statistics.median(run['import_s'] for run in runs)
+    create_app_s = statistics.median(run['create_app_s'] for run in runs)
+    rss_mb = statistics.median(run['rss_mb'] for run in runs)
+    heavy = sorted({name for run in runs for name in run['heavy']})
+    print(f'import      {import_s * 1000:8.0f} ms')
+    print(f'create_app  {create_app_s * 1000:8.0f} ms')
+    print(f'peak RSS    {rss_mb:8.1f} MB')
+
+    failures = []
+    if heavy:
+        failures.append(f"loaded at startup: {', '.join(heavy)}")
+    if import_s + create_app_s > args.max_seconds:
+        failures.append(f'startup {import_s + create_app_s:.2f} s over {args.max_seconds:.2f} s')
+    if rss_mb > args.max_rss_mb:
+        failures.append(f'RSS {rss_mb:.1f} MB over {args.max_rss_mb:.1f} MB')
+    for failure in failures:
+        print(f'FAIL  {failure}')
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
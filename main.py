@@ -1,6 +1,40 @@
+import os
+import subprocess
+import sys
 from app import create_app, socketio
 
 app = create_app()
 
+def run_workers(count, port):
+    # One process per port, put a sticky load balancer (e.g. nginx ip_hash)
+    # in front. Room broadcasts are shared through SOCKETIO_MESSAGE_QUEUE.
+    from services.broadcast import BroadcastBroker, LOCAL_SCHEMES
+    from urllib.parse import urlparse
+    
+    queue = os.environ.get("SOCKETIO_MESSAGE_QUEUE") or "local:///tmp/liveshop-broadcast.sock"
+    broker = None
+    if urlparse(queue).scheme in LOCAL_SCHEMES:
+        broker = BroadcastBroker(urlparse(queue).path)
+        broker.start()
+    
+    workers = []
+    for i in range(count):
+        env = dict(os.environ, WORKERS="1", PORT=str(port + i), SOCKETIO_MESSAGE_QUEUE=queue)
+        workers.append(subprocess.Popen([sys.executable, __file__], env=env))
+    try:
+        for worker in workers:
+            worker.wait()
+    except KeyboardInterrupt:
+        for worker in workers:
+            worker.terminate()
+    finally:
+        if broker:
+            broker.stop()
+
 if __name__ == "__main__":
-    socketio.run(app, host="0.0.0.0", port=5000, allow_unsafe_werkzeug=True)
+    port = int(os.environ.get("PORT", 5000))
+    workers = int(os.environ.get("WORKERS", 1))
+    if workers > 1:
+        run_workers(workers, port)
+    else:
+        socketio.run(app, host="0.0.0.0", port=port, allow_unsafe_werkzeug=True)
@@ -1,100 +1,240 @@
+import argparse
+from datetime import datetime
+
+from sqlalchemy import inspect, text
+
 from app import create_app, db
-from models import StreamSession, Product, User, ViewHistory, PriceAlert
-from sqlalchemy import text
 
-def add_missing_columns():
-    app = create_app()
-    with app.app_context():
-        # Add columns if they don't exist
-        with db.engine.connect() as conn:
-            # Add loyalty points and last daily reward to user table
-            conn.execute(text("""
-                ALTER TABLE "user"
-                ADD COLUMN IF NOT EXISTS loyalty_points INTEGER DEFAULT 0,
-                ADD COLUMN IF NOT EXISTS last_daily_reward TIMESTAMP;
-            """))
-            
-            # Add AR model URL and category to product table
-            conn.execute(text("""
-                ALTER TABLE product 
-                ADD COLUMN IF NOT EXISTS ar_model_url VARCHAR(200),
-                ADD COLUMN IF NOT EXISTS category VARCHAR(50),
-                ADD COLUMN IF NOT EXISTS view_count INTEGER DEFAULT 0,
-                ADD COLUMN IF NOT EXISTS previous_price FLOAT,
-                ADD COLUMN IF NOT EXISTS last_price_change TIMESTAMP;
-            """))
-
-            # Add category and recording_url to stream_session table
-            conn.execute(text("""
-                ALTER TABLE stream_session
-                ADD COLUMN IF NOT EXISTS category VARCHAR(50),
-                ADD COLUMN IF NOT EXISTS recording_url VARCHAR(200);
-            """))
-            
-            # Create badge table if not exists
-            conn.execute(text("""
-                CREATE TABLE IF NOT EXISTS badge (
-                    id SERIAL PRIMARY KEY,
-                    user_id INTEGER REFERENCES "user"(id),
-                    name VARCHAR(50) NOT NULL,
-                    description VARCHAR(200),
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                );
-            """))
-            
-            # Create flash sale table if not exists
-            conn.execute(text("""
-                CREATE TABLE IF NOT EXISTS flash_sale (
-                    id SERIAL PRIMARY KEY,
-                    stream_id INTEGER REFERENCES stream_session(id),
-                    product_id INTEGER REFERENCES product(id),
-                    discount_percentage INTEGER NOT NULL,
-                    start_time TIMESTAMP NOT NULL,
-                    end_time TIMESTAMP NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                );
-            """))
-            
-            # Create wishlist table if not exists
-            conn.execute(text("""
-                CREATE TABLE IF NOT EXISTS wishlist (
-                    id SERIAL PRIMARY KEY,
-                    user_id INTEGER REFERENCES "user"(id),
-                    product_id INTEGER REFERENCES product(id),
-                    added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    UNIQUE(user_id, product_id)
-                );
-            """))
-            
-            # Create group buying tables if not exists
-            conn.execute(text("""
-                CREATE TABLE IF NOT EXISTS group_buying (
-                    id SERIAL PRIMARY KEY,
-                    product_id INTEGER REFERENCES product(id),
-                    target_price FLOAT NOT NULL,
-                    min_buyers INTEGER NOT NULL,
-                    current_buyers INTEGER DEFAULT 0,
-                    status VARCHAR(20) DEFAULT 'active',
-                    expires_at TIMESTAMP NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                );
-                
-                CREATE TABLE IF NOT EXISTS group_buying_participant (
-                    id SERIAL PRIMARY KEY,
-                    group_buying_id INTEGER REFERENCES group_buying(id),
-                    user_id INTEGER REFERENCES "user"(id),
-                    joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    UNIQUE(group_buying_id, user_id)
-                );
-            """))
-            
-            # Add status column to poll table
-            conn.execute(text("""
-                ALTER TABLE poll
-                ADD COLUMN IF NOT EXISTS status VARCHAR(20) DEFAULT 'active';
-            """))
-
-            conn.commit()
+# Ordered schema migrations, applied once each and recorded in
+# schema_migrations. New databases get their tables from db.create_all(), so
+# every step must also be a no-op against a schema that is already current.
+MIGRATIONS = []
+
+def migration(version, name, transactional=True):
+    def register(func):
+        MIGRATIONS.append((version, name, func, transactional))
+        return func
+    return register
+
+def quote(conn, name):
+    return conn.dialect.identifier_preparer.quote(name)
+
+def add_columns(conn, table, columns):
+    existing = {column['name'] for column in inspect(conn).get_columns(table)}
+    for name, ddl in columns:
+        if name not in existing:
+            conn.execute(text(f'ALTER TABLE {quote(conn, table)} ADD COLUMN {quote(conn, name)} {ddl}'))
+
+def create_tables(conn, *names):
+    # Missing tables are created from their model definitions
+    db.metadata.create_all(conn, tables=[db.metadata.tables[name] for name in names], checkfirst=True)
+
+def create_index(conn, name, table, columns, unique=False, concurrently=False):
+    # With concurrently=True PostgreSQL builds the index without blocking
+    # writers; that needs an autocommit connection (transactional=False).
+    # Other backends build it in place.
+    unique = 'UNIQUE ' if unique else ''
+    column_list = ', '.join(quote(conn, column) for column in columns)
+    if concurrently and conn.dialect.name == 'postgresql':
+        # A failed concurrent build leaves an invalid index behind, rebuild it
+        invalid = conn.execute(text("""
+            SELECT 1 FROM pg_class c JOIN pg_index i ON i.indexrelid = c.oid
+            WHERE c.relname = :name AND NOT i.indisvalid
+        """), {'name': name}).first()
+        if invalid:
+            conn.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS {quote(conn, name)}'))
+        conn.execute(text(f'CREATE {unique}INDEX CONCURRENTLY IF NOT EXISTS {quote(conn, name)} '
+                          f'ON {quote(conn, table)} ({column_list})'))
+    else:
+        conn.execute(text(f'CREATE {unique}INDEX IF NOT EXISTS {quote(conn, name)} '
+                          f'ON {quote(conn, table)} ({column_list})'))
+
+@migration(1, 'rewards, flash sales, wishlist and group buying')
+def rewards_tables(conn):
+    add_columns(conn, 'user', [
+        ('loyalty_points', 'INTEGER DEFAULT 0'),
+        ('last_daily_reward', 'TIMESTAMP'),
+    ])
+    add_columns(conn, 'product', [
+        ('ar_model_url', 'VARCHAR(200)'),
+        ('category', 'VARCHAR(50)'),
+        ('view_count', 'INTEGER DEFAULT 0'),
+        ('previous_price', 'FLOAT'),
+        ('last_price_change', 'TIMESTAMP'),
+    ])
+    add_columns(conn, 'stream_session', [
+        ('category', 'VARCHAR(50)'),
+        ('recording_url', 'VARCHAR(200)'),
+    ])
+    add_columns(conn, 'poll', [('status', "VARCHAR(20) DEFAULT 'active'")])
+    create_tables(conn, 'badge', 'flash_sale', 'wishlist', 'group_buying', 'group_buying_participant')
+
+@migration(2, 'one poll vote per user')
+def poll_voters(conn):
+    add_columns(conn, 'poll', [('voters', "JSON DEFAULT '{}'")])
+
+@migration(3, 'question votes')
+def question_votes(conn):
+    create_tables(conn, 'question_vote')
+
+@migration(4, 'attribute orders to streams')
+def order_stream(conn):
+    add_columns(conn, 'order', [('stream_id', 'INTEGER REFERENCES stream_session(id)')])
+    create_index(conn, 'ix_order_stream_id', 'order', ['stream_id'])
+
+@migration(5, 'chat history')
+def chat_messages(conn):
+    create_tables(conn, 'chat_message')
+    create_index(conn, 'ix_chat_message_stream_created', 'chat_message', ['stream_id', 'created_at', 'id'])
+
+@migration(6, 'catalogue keyset index')
+def catalogue_index(conn):
+    create_index(conn, 'ix_product_created_at_id', 'product', ['created_at', 'id'])
+
+@migration(7, 'activity timelines')
+def activity_timelines(conn):
+    create_tables(conn, 'timeline_entry')
+    create_index(conn, 'ix_timeline_entry_owner_created', 'timeline_entry', ['owner_id', 'created_at', 'id'])
+
+@migration(8, 'stock reservations and sharded stock')
+def stock_reservations(conn):
+    add_columns(conn, 'product', [('stock_shards', 'INTEGER DEFAULT 0')])
+    create_tables(conn, 'product_stock_shard', 'stock_reservation')
+    create_index(conn, 'ix_stock_reservation_status_expires', 'stock_reservation', ['status', 'expires_at'])
+
+@migration(9, 'flash sale expiry index')
+def flash_sale_index(conn):
+    create_index(conn, 'ix_flash_sale_end_time', 'flash_sale', ['end_time'])
+
+@migration(10, 'group buy sweep index')
+def group_buy_index(conn):
+    create_index(conn, 'ix_group_buying_status_expires', 'group_buying', ['status', 'expires_at'])
+
+@migration(11, 'loyalty ledger and badge rules')
+def loyalty_ledger(conn):
+    create_tables(conn, 'points_ledger_entry', 'badge_rule')
+    create_index(conn, 'ix_points_ledger_entry_user_created', 'points_ledger_entry', ['user_id', 'created_at'])
+    create_index(conn, 'ix_badge_user_name', 'badge', ['user_id', 'name'])
+
+    # Existing balances become the opening entry of each ledger
+    conn.execute(text("""
+        INSERT INTO points_ledger_entry (user_id, points, reason, created_at)
+        SELECT id, loyalty_points, 'opening_balance', CURRENT_TIMESTAMP FROM "user"
+        WHERE loyalty_points > 0
+        AND NOT EXISTS (SELECT 1 FROM points_ledger_entry WHERE points_ledger_entry.user_id = "user".id);
+    """))
+
+@migration(12, 'hot path indexes', transactional=False)
+def hot_path_indexes(conn):
+    # Foreign keys and filters used on every request, see benchmarks/query_plans.py
+    for name, table, columns in [
+        ('ix_order_user_id', 'order', ['user_id']),
+        ('ix_product_seller_id', 'product', ['seller_id']),
+        ('ix_question_stream_id', 'question', ['stream_id']),
+        ('ix_poll_stream_status', 'poll', ['stream_id', 'status']),
+        ('ix_activity_feed_user_created', 'activity_feed', ['user_id', 'created_at']),
+        ('ix_stream_session_status_created', 'stream_session', ['status', 'created_at']),
+        ('ix_stream_session_seller_id', 'stream_session', ['seller_id']),
+        ('ix_view_history_user_viewed', 'view_history', ['user_id', 'viewed_at']),
+        ('ix_followers_followed_id', 'followers', ['followed_id']),
+    ]:
+        create_index(conn, name, table, columns, concurrently=True)
+
+@migration(13, 'database sessions')
+def user_sessions(conn):
+    create_tables(conn, 'user_session')
+    create_index(conn, 'ix_user_session_expires_at', 'user_session', ['expires_at'])
+
+@migration(14, 'hourly sales rollup')
+def sales_rollup_table(conn):
+    from services.sales_rollup import sales_rollup
+    create_tables(conn, 'sales_rollup')
+    create_index(conn, 'ix_sales_rollup_stream_hour', 'sales_rollup', ['stream_id', 'hour'])
+    # Backfill from the orders placed so far
+    sales_rollup.rebuild(executor=conn)
+
+@migration(15, 'follower counts and timeline backfill')
+def timeline_backfill(conn):
+    from services.timeline import timeline
+    add_columns(conn, 'user', [('follower_count', 'INTEGER DEFAULT 0')])
+    create_index(conn, 'ix_user_follower_count', 'user', ['follower_count'])
+    timeline.count_followers(executor=conn)
+    # Timelines only filled for activity published since version 7
+    timeline.backfill_all(executor=conn)
+
+@migration(16, 'flash sale end announcements')
+def flash_sale_ended(conn):
+    add_columns(conn, 'flash_sale', [('ended', 'BOOLEAN DEFAULT FALSE NOT NULL')])
+
+@migration(17, 'default badge rules')
+def default_badge_rules(conn):
+    from models import seed_badge_rules
+    seed_badge_rules(conn)
+
+@migration(18, 'one group buy join per user')
+def group_buy_participant_unique(conn):
+    # Databases created before the model's unique constraint never got it;
+    # drop repeat joins, and the buyers they counted, before adding it
+    repeats = """FROM group_buying_participant WHERE id NOT IN (
+        SELECT MIN(id) FROM group_buying_participant GROUP BY group_buying_id, user_id)"""
+    conn.execute(text(f"""
+        UPDATE group_buying SET current_buyers = current_buyers - (
+            SELECT COUNT(*) {repeats} AND group_buying_participant.group_buying_id = group_buying.id)
+        WHERE id IN (SELECT group_buying_id {repeats});
+    """))
+    conn.execute(text(f'DELETE {repeats}'))
+    create_index(conn, 'uq_group_buying_participant', 'group_buying_participant',
+                 ['group_buying_id', 'user_id'], unique=True)
+
+def ensure_version_table(engine):
+    with engine.begin() as conn:
+        conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER PRIMARY KEY,
+                name VARCHAR(200) NOT NULL,
+                applied_at TIMESTAMP NOT NULL
+            );
+        """))
+
+def applied_versions(engine):
+    ensure_version_table(engine)
+    with engine.connect() as conn:
+        return {version for (version,) in conn.execute(text('SELECT version FROM schema_migrations'))}
+
+def run_migrations(engine, target=None):
+    applied = applied_versions(engine)
+    ran = []
+    for version, name, func, transactional in sorted(MIGRATIONS, key=lambda m: m[0]):
+        if version in applied or (target is not None and version > target):
+            continue
+        if transactional:
+            with engine.begin() as conn:
+                func(conn)
+                record_version(conn, version, name)
+        else:
+            with engine.connect() as conn:
+                func(conn.execution_options(isolation_level='AUTOCOMMIT'))
+            with engine.begin() as conn:
+                record_version(conn, version, name)
+        ran.append((version, name))
+    return ran
+
+def record_version(conn, version, name):
+    conn.execute(text('INSERT INTO schema_migrations (version, name, applied_at) VALUES (:version, :name, :applied_at)'),
+                 {'version': version, 'name': name, 'applied_at': datetime.utcnow()})
 
 if __name__ == "__main__":
-    add_missing_columns()
+    parser = argparse.ArgumentParser(description='Apply pending schema migrations to DATABASE_URL')
+    parser.add_argument('--status', action='store_true', help='list applied and pending migrations')
+    parser.add_argument('--target', type=int, help='stop after this version')
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        if args.status:
+            applied = applied_versions(db.engine)
+            for version, name, _, _ in sorted(MIGRATIONS, key=lambda m: m[0]):
+                print(f"{version:>4}  {'applied' if version in applied else 'pending':<8} {name}")
+        else:
+            for version, name in run_migrations(db.engine, args.target):
+                print(f'Applied {version:>4}  {name}')
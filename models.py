@@ -1,13 +1,29 @@
 from datetime import datetime
+from sqlalchemy import delete, event, func, insert, select, update
+from sqlalchemy.dialects import postgresql, sqlite
 from app import db
 from werkzeug.security import generate_password_hash, check_password_hash
+from services.follow_cache import FollowGraphCache
 
 # Followers association table
 followers = db.Table('followers',
     db.Column('follower_id', db.Integer, db.ForeignKey('user.id'), primary_key=True),
-    db.Column('followed_id', db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    db.Column('followed_id', db.Integer, db.ForeignKey('user.id'), primary_key=True),
+    # The primary key covers follower_id lookups, follower counts need this
+    db.Index('ix_followers_followed_id', 'followed_id')
 )
 
+def load_followed_ids(user_id):
+    return [row[0] for row in db.session.query(followers.c.followed_id)
+            .filter(followers.c.follower_id == user_id)]
+
+def load_follower_ids(user_id):
+    return [row[0] for row in db.session.query(followers.c.follower_id)
+            .filter(followers.c.followed_id == user_id)]
+
+# In-process follow graph, updated write-through by the social routes
+follow_graph = FollowGraphCache(load_followed_ids, load_follower_ids)
+
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(64), unique=True, nullable=False)
@@ -19,6 +35,8 @@ class User(db.Model):
     language_preference = db.Column(db.String(10), default='en')
     loyalty_points = db.Column(db.Integer, default=0)
     last_daily_reward = db.Column(db.DateTime)
+    # Maintained by follow/unfollow, finds the sellers timelines pull from
+    follower_count = db.Column(db.Integer, default=0, index=True)
     
     # Followers relationship
     followed = db.relationship(
@@ -41,39 +59,47 @@ class User(db.Model):
         return check_password_hash(self.password_hash, password)
     
     def follow(self, user):
-        if not self.is_following(user):
-            self.followed.append(user)
+        # Written against the database, not the follow graph cache, which may
+        # be stale; returns whether a new follow was created
+        values = {'follower_id': self.id, 'followed_id': user.id}
+        dialect = db.session.get_bind().dialect
+        if dialect.name in ('postgresql', 'sqlite'):
+            dialect_insert = postgresql.insert if dialect.name == 'postgresql' else sqlite.insert
+            created = db.session.execute(dialect_insert(followers).values(**values).on_conflict_do_nothing()).rowcount > 0
+        elif self.followed.filter(followers.c.followed_id == user.id).first() is not None:
+            created = False
+        else:
+            db.session.execute(insert(followers).values(**values))
+            created = True
+        if created:
+            user.add_followers(1)
+        return created
     
     def unfollow(self, user):
-        if self.is_following(user):
-            self.followed.remove(user)
+        # Returns whether a follow was removed
+        removed = db.session.execute(
+            delete(followers).where(followers.c.follower_id == self.id,
+                                    followers.c.followed_id == user.id)
+        ).rowcount > 0
+        if removed:
+            user.add_followers(-1)
+        return removed
+    
+    def add_followers(self, delta):
+        db.session.execute(
+            update(User).where(User.id == self.id)
+            .values(follower_count=func.coalesce(User.follower_count, 0) + delta)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.expire(self, ['follower_count'])
     
     def is_following(self, user):
-        return self.followed.filter(followers.c.followed_id == user.id).count() > 0
-
-    def add_loyalty_points(self, points):
-        self.loyalty_points += points
-        # Check for new badge achievements
-        earned_badges = []
-        if self.loyalty_points >= 1000 and not self.has_badge("Gold Member"):
-            badge = Badge(user_id=self.id, name="Gold Member", 
-                        description="Earned 1000 loyalty points")
-            db.session.add(badge)
-            earned_badges.append(badge)
-        elif self.loyalty_points >= 500 and not self.has_badge("Silver Member"):
-            badge = Badge(user_id=self.id, name="Silver Member", 
-                        description="Earned 500 loyalty points")
-            db.session.add(badge)
-            earned_badges.append(badge)
-        elif self.loyalty_points >= 100 and not self.has_badge("Bronze Member"):
-            badge = Badge(user_id=self.id, name="Bronze Member", 
-                        description="Earned 100 loyalty points")
-            db.session.add(badge)
-            earned_badges.append(badge)
-        return earned_badges
-
-    def has_badge(self, badge_name):
-        return Badge.query.filter_by(user_id=self.id, name=badge_name).first() is not None
+        return follow_graph.is_following(self.id, user.id)
+
+    def add_loyalty_points(self, points, reason='bonus'):
+        # Appends to the points ledger and returns any badges newly earned
+        from services.loyalty import loyalty
+        return loyalty.award(self, points, reason)
 
     def claim_daily_reward(self):
         now = datetime.utcnow()
@@ -81,7 +107,7 @@ class User(db.Model):
             self.last_daily_reward = now
             points = 50  # Base daily reward
             # Bonus for consecutive days (implement later)
-            self.add_loyalty_points(points)
+            self.add_loyalty_points(points, 'daily_reward')
             return points
         return 0
 
@@ -92,6 +118,42 @@ class Badge(db.Model):
     description = db.Column(db.String(200))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     user = db.relationship('User', backref='badges')
+    __table_args__ = (db.Index('ix_badge_user_name', 'user_id', 'name'),)
+
+class BadgeRule(db.Model):
+    # Declarative badge tiers, evaluated in memory against point balances
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(50), unique=True, nullable=False)
+    description = db.Column(db.String(200))
+    min_points = db.Column(db.Integer, nullable=False)
+    active = db.Column(db.Boolean, default=True)
+
+DEFAULT_BADGE_RULES = [
+    ('Bronze Member', 'Earned 100 loyalty points', 100),
+    ('Silver Member', 'Earned 500 loyalty points', 500),
+    ('Gold Member', 'Earned 1000 loyalty points', 1000),
+]
+
+def seed_badge_rules(conn):
+    # Only into an empty table, rules edited since are left alone
+    if conn.execute(select(BadgeRule.id).limit(1)).first() is None:
+        conn.execute(insert(BadgeRule), [
+            {'name': name, 'description': description, 'min_points': min_points, 'active': True}
+            for name, description, min_points in DEFAULT_BADGE_RULES
+        ])
+
+# New databases get the default rules with the table, older ones from migration 17
+event.listen(BadgeRule.__table__, 'after_create', lambda table, conn, **kw: seed_badge_rules(conn))
+
+class PointsLedgerEntry(db.Model):
+    # Append-only history of loyalty points, User.loyalty_points caches the sum
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    points = db.Column(db.Integer, nullable=False)
+    reason = db.Column(db.String(50), nullable=False)  # 'daily_reward', 'stream_watch', ...
+    reference_id = db.Column(db.Integer)  # ID of the related item (stream, order, etc.)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    __table_args__ = (db.Index('ix_points_ledger_entry_user_created', 'user_id', 'created_at'),)
 
 class FlashSale(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -99,7 +161,9 @@ class FlashSale(db.Model):
     product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
     discount_percentage = db.Column(db.Integer, nullable=False)
     start_time = db.Column(db.DateTime, nullable=False)
-    end_time = db.Column(db.DateTime, nullable=False)
+    end_time = db.Column(db.DateTime, nullable=False, index=True)
+    # Set by the one worker that announces the end of the sale
+    ended = db.Column(db.Boolean, default=False, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     stream = db.relationship('StreamSession', backref='flash_sales')
     product = db.relationship('Product', backref='flash_sales')
@@ -111,7 +175,7 @@ class Product(db.Model):
     price = db.Column(db.Float, nullable=False)
     image_url = db.Column(db.String(200))
     stock = db.Column(db.Integer, default=0)
-    seller_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    seller_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     reviews = db.relationship('Review', backref='product', lazy=True)
     comments = db.relationship('Comment', backref='product', lazy=True)
@@ -120,6 +184,25 @@ class Product(db.Model):
     last_price_change = db.Column(db.DateTime)
     category = db.Column(db.String(50))
     ar_model_url = db.Column(db.String(200))
+    stock_shards = db.Column(db.Integer, default=0)  # >0 while stock is split into ProductStockShard rows
+    __table_args__ = (db.Index('ix_product_created_at_id', 'created_at', 'id'),)
+
+class ProductStockShard(db.Model):
+    # Sub-counters of a hot product's stock, so checkouts don't all lock one row
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), primary_key=True)
+    shard = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    stock = db.Column(db.Integer, nullable=False, default=0)
+
+class StockReservation(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    quantity = db.Column(db.Integer, nullable=False)
+    shard = db.Column(db.Integer)  # shard the stock was taken from, if any
+    status = db.Column(db.String(20), default='held')  # held, committed, released, expired
+    expires_at = db.Column(db.DateTime, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    __table_args__ = (db.Index('ix_stock_reservation_status_expires', 'status', 'expires_at'),)
 
 class Wishlist(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -139,6 +222,7 @@ class GroupBuying(db.Model):
     expires_at = db.Column(db.DateTime, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     product = db.relationship('Product', backref='group_buys')
+    __table_args__ = (db.Index('ix_group_buying_status_expires', 'status', 'expires_at'),)
 
 class GroupBuyingParticipant(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -147,6 +231,7 @@ class GroupBuyingParticipant(db.Model):
     joined_at = db.Column(db.DateTime, default=datetime.utcnow)
     group_buying = db.relationship('GroupBuying', backref='participants')
     user = db.relationship('User', backref='group_buying_participations')
+    __table_args__ = (db.UniqueConstraint('group_buying_id', 'user_id'),)
 
 # Import other required models
-from models_other import Order, StreamSession, ActivityFeed, Review, Question, Poll, Message, Comment, PriceAlert, ViewHistory
+from models_other import Order, SalesRollup, StreamSession, ActivityFeed, TimelineEntry, Review, Question, QuestionVote, Poll, Message, ChatMessage, Comment, PriceAlert, ViewHistory, UserSession
@@ -3,8 +3,9 @@ from app import db
 
 class Order(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
     product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
+    stream_id = db.Column(db.Integer, db.ForeignKey('stream_session.id'), index=True)  # set when bought from a stream room
     quantity = db.Column(db.Integer, nullable=False)
     total_amount = db.Column(db.Float, nullable=False)
     status = db.Column(db.String(20), default='pending')
@@ -12,9 +13,21 @@ class Order(db.Model):
     product = db.relationship('Product', backref='orders', lazy=True)
     user = db.relationship('User', backref='orders', lazy=True)
 
+class SalesRollup(db.Model):
+    # Orders per (seller, stream, product, hour), kept in step with order placement.
+    # stream_id is 0 for orders placed outside a stream so it can be part of the key
+    seller_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    stream_id = db.Column(db.Integer, primary_key=True, autoincrement=False, default=0)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), primary_key=True)
+    hour = db.Column(db.DateTime, primary_key=True)
+    orders = db.Column(db.Integer, nullable=False, default=0)
+    quantity = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Float, nullable=False, default=0.0)
+    __table_args__ = (db.Index('ix_sales_rollup_stream_hour', 'stream_id', 'hour'),)
+
 class StreamSession(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    seller_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    seller_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
     title = db.Column(db.String(100), nullable=False)
     status = db.Column(db.String(20), default='active')
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -23,6 +36,7 @@ class StreamSession(db.Model):
     polls = db.relationship('Poll', backref='stream', lazy=True)
     questions = db.relationship('Question', backref='stream', lazy=True)
     category = db.Column(db.String(50))  # Added for stream categorization
+    __table_args__ = (db.Index('ix_stream_session_status_created', 'status', 'created_at'),)
     
     def __init__(self, seller_id, title, scheduled_for=None):
         self.seller_id = seller_id
@@ -36,6 +50,17 @@ class ActivityFeed(db.Model):
     target_id = db.Column(db.Integer)  # ID of the related item (stream, product, etc.)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     user = db.relationship('User', backref='activities', lazy=True)
+    __table_args__ = (db.Index('ix_activity_feed_user_created', 'user_id', 'created_at'),)
+
+class TimelineEntry(db.Model):
+    # One row per (follower, activity), written when the activity is published
+    id = db.Column(db.Integer, primary_key=True)
+    owner_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    activity_id = db.Column(db.Integer, db.ForeignKey('activity_feed.id'), nullable=False)
+    author_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False)
+    activity = db.relationship('ActivityFeed', lazy=True)
+    __table_args__ = (db.Index('ix_timeline_entry_owner_created', 'owner_id', 'created_at', 'id'),)
 
 class Review(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -49,7 +74,7 @@ class Review(db.Model):
 
 class Question(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    stream_id = db.Column(db.Integer, db.ForeignKey('stream_session.id'), nullable=False)
+    stream_id = db.Column(db.Integer, db.ForeignKey('stream_session.id'), nullable=False, index=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     question = db.Column(db.Text, nullable=False)
     answer = db.Column(db.Text)
@@ -63,14 +88,23 @@ class Question(db.Model):
         self.user_id = user_id
         self.question = question
 
+class QuestionVote(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    question_id = db.Column(db.Integer, db.ForeignKey('question.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    __table_args__ = (db.UniqueConstraint('question_id', 'user_id'),)
+
 class Poll(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     stream_id = db.Column(db.Integer, db.ForeignKey('stream_session.id'), nullable=False)
     question = db.Column(db.String(200), nullable=False)
     options = db.Column(db.JSON, nullable=False)
     votes = db.Column(db.JSON, default={})
+    voters = db.Column(db.JSON, default={})  # user_id -> option, for one vote per user
     status = db.Column(db.String(20), default='active')
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    __table_args__ = (db.Index('ix_poll_stream_status', 'stream_id', 'status'),)
     
     def __init__(self, stream_id, question, options, votes=None):
         self.stream_id = stream_id
@@ -88,6 +122,14 @@ class Message(db.Model):
     sender = db.relationship('User', foreign_keys=[sender_id], backref='sent_messages')
     receiver = db.relationship('User', foreign_keys=[receiver_id], backref='received_messages')
 
+class ChatMessage(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    stream_id = db.Column(db.Integer, db.ForeignKey('stream_session.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    message = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    __table_args__ = (db.Index('ix_chat_message_stream_created', 'stream_id', 'created_at', 'id'),)
+
 class Comment(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -115,3 +157,10 @@ class ViewHistory(db.Model):
     viewed_at = db.Column(db.DateTime, default=datetime.utcnow)
     user = db.relationship('User', backref='view_history')
     product = db.relationship('Product', backref='views')
+    __table_args__ = (db.Index('ix_view_history_user_viewed', 'user_id', 'viewed_at'),)
+
+class UserSession(db.Model):
+    # Server-side session, the cookie only holds the id
+    id = db.Column(db.String(64), primary_key=True)
+    data = db.Column(db.Text, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
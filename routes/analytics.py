@@ -1,71 +1,264 @@
-from flask import Blueprint, render_template, jsonify, session, redirect, url_for, request
+from flask import Blueprint, render_template, jsonify, session, redirect, url_for, request, Response, stream_with_context, current_app
 from app import db, socketio
 from models import StreamSession, Order, Product, User, ViewHistory
 from sqlalchemy import func, desc, text
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from flask_socketio import join_room, leave_room
-import pandas as pd
-import numpy as np
-from sklearn.linear_model import LinearRegression
+import importlib.util
 import json
+import os
+import threading
+import time
+from services.timeseries import RollingSeries
+from services.analytics_store import AnalyticsStore, log_directory
+from services.presence import PresenceTracker
+from services.heatmap import MAX_PRODUCT_ID, ActionLog, valid_action
+from services.stream_export import export_chunks
+from services.sales_rollup import sales_rollup
+from services.forecasting import forecasting
+from services.chat import chat_broadcaster
 
 analytics_bp = Blueprint('analytics', __name__)
 
 class AnalyticsManager:
-    def __init__(self):
+    def __init__(self, tick_interval=1.0, store=None, snapshot_interval=60.0,
+                 sync_idle=300.0, evict_after=900.0, compact_interval=600.0):
         self.streams = {}
+        # Rooms with changes since the last tick, pushed at most once per tick
+        self.tick_interval = tick_interval
+        self.dirty_rooms = set()
+        self.last_pushed = {}
+        self.ticker_started = False
+        self.app = None
+        self.lock = threading.Lock()
+        # Optional durable event log shared by all workers (see services/analytics_store.py)
+        self.store = store
+        self.snapshot_interval = snapshot_interval
+        self.last_snapshot = time.monotonic()
+        self.unsnapshotted = set()
+        # The ticker only syncs streams with viewers on this worker or used
+        # in the last sync_idle seconds; streams idle for evict_after are
+        # snapshotted and dropped, and rebuilt from the store when next used.
+        # evict_after stays below the store's 2 * rotate_after, so no stream
+        # is still loaded when a segment it has not read is archived
+        self.sync_idle = sync_idle
+        self.evict_after = evict_after
+        self.compact_interval = compact_interval
+        self.last_compact = time.monotonic()
+        self.last_used = {}
+        # Viewers who stop heartbeating are expired by the ticker
+        self.presence = PresenceTracker()
     
+    def _new_stream_state(self):
+        return {
+            'viewers': set(),
+            'active_viewers': set(),
+            'view_durations': {},
+            'join_time_sum': 0.0,  # sum of view_durations start times, in epoch seconds
+            'peak_viewers': 0,
+            'engagement_data': RollingSeries(('viewers', 'active_viewers')),
+            'sales_history': [],
+            'actions': ActionLog(),
+            'device_stats': {'desktop': 0, 'mobile': 0, 'tablet': 0},
+            'retention_segments': {'0-5m': 0, '5-15m': 0, '15-30m': 0, '30m+': 0},
+            'total_sessions': 0,
+            'revenue_data': {'hourly': [], 'total': 0},
+            'orders_count': 0,
+            'conversion_rate': 0,
+            'avg_session_duration': 0
+        }
+
     def get_stream_analytics(self, stream_id):
+        self.last_used[stream_id] = time.monotonic()
         if stream_id not in self.streams:
-            self.streams[stream_id] = {
-                'viewers': set(),
-                'active_viewers': set(),
-                'view_durations': {},
-                'peak_viewers': 0,
-                'engagement_data': [],
-                'sales_history': [],
-                'viewer_actions': [],
-                'heatmap_data': {},
-                'device_stats': {'desktop': 0, 'mobile': 0, 'tablet': 0},
-                'retention_segments': {'0-5m': 0, '5-15m': 0, '15-30m': 0, '30m+': 0},
-                'revenue_data': {'hourly': [], 'total': 0},
-                'conversion_rate': 0,
-                'avg_session_duration': 0
-            }
+            if self.store is None:
+                self.streams.setdefault(stream_id, self._new_stream_state())
+            else:
+                # Rebuild from the last snapshot plus everything logged since
+                with self.store.lock:
+                    if stream_id not in self.streams:
+                        state, events = self.store.load(stream_id)
+                        self.streams[stream_id] = self._new_stream_state()
+                        if state:
+                            self.restore_state(stream_id, state)
+                        for event in events:
+                            self.apply_event(stream_id, event)
         return self.streams[stream_id]
 
-    def update_viewer_metrics(self, stream_id, user_id, action_type, timestamp=None):
+    def record(self, stream_id, event):
+        self.get_stream_analytics(stream_id)
+        if self.store is None:
+            self.apply_event(stream_id, event)
+        else:
+            with self.store.lock:
+                self.store.append(stream_id, event)
+                self.apply_event(stream_id, event)
+            self.unsnapshotted.add(stream_id)
+        self.schedule_update(stream_id)
+
+    def sync(self, stream_id):
+        # Apply events other workers logged for this stream since the last sync
+        if self.store is None:
+            return
+        with self.store.lock:
+            if stream_id not in self.streams:
+                # Loading replays everything logged so far
+                self.get_stream_analytics(stream_id)
+                return
+            events = self.store.read_new(stream_id)
+            for event in events:
+                self.apply_event(stream_id, event)
+        if events:
+            self.unsnapshotted.add(stream_id)
+            self.schedule_update(stream_id)
+
+    def apply_event(self, stream_id, event):
         analytics = self.get_stream_analytics(stream_id)
-        timestamp = timestamp or datetime.utcnow()
+        timestamp = datetime.utcfromtimestamp(event['t'])
+        user_id = event.get('user')
+        action_type = event['type']
 
         if action_type == 'join':
             analytics['viewers'].add(user_id)
             analytics['active_viewers'].add(user_id)
+            previous = analytics['view_durations'].get(user_id)
+            if previous is not None:
+                analytics['join_time_sum'] -= previous.timestamp()
             analytics['view_durations'][user_id] = timestamp
+            analytics['join_time_sum'] += timestamp.timestamp()
             analytics['peak_viewers'] = max(analytics['peak_viewers'], len(analytics['viewers']))
+            if event.get('device') in analytics['device_stats']:
+                analytics['device_stats'][event['device']] += 1
         elif action_type == 'leave':
             if user_id in analytics['viewers']:
                 analytics['viewers'].remove(user_id)
                 analytics['active_viewers'].discard(user_id)
                 if user_id in analytics['view_durations']:
-                    duration = (timestamp - analytics['view_durations'].pop(user_id)).total_seconds()
+                    joined_at = analytics['view_durations'].pop(user_id)
+                    analytics['join_time_sum'] -= joined_at.timestamp()
+                    left_at = datetime.utcfromtimestamp(event['seen']) if 'seen' in event else timestamp
+                    duration = (left_at - joined_at).total_seconds()
                     self.update_retention_data(stream_id, duration)
+        elif action_type == 'active':
+            if user_id in analytics['viewers']:
+                analytics['active_viewers'].add(user_id)
+        elif action_type == 'inactive':
+            analytics['active_viewers'].discard(user_id)
+        elif action_type == 'sale':
+            self.apply_sale(stream_id, event['amount'], timestamp)
+            return
+        elif action_type == 'action':
+            # Logs written before actions were validated may hold bad ones
+            if valid_action(event.get('action'), event.get('product')):
+                analytics['actions'].append(event['t'], event['action'], event.get('product'))
+            return
 
-        # Update engagement data
-        analytics['engagement_data'].append({
-            'timestamp': timestamp,
-            'viewers': len(analytics['viewers']),
-            'active_viewers': len(analytics['active_viewers'])
+        self.record_engagement(stream_id, timestamp)
+
+    def update_viewer_metrics(self, stream_id, user_id, action_type, timestamp=None, device=None, last_seen=None):
+        # Events are logged at the current time so every log stays in time
+        # order; an expired viewer's leave carries their last heartbeat
+        # (epoch seconds) in `seen`, which ends their session instead
+        timestamp = timestamp or datetime.utcnow()
+        event = {'t': timestamp.replace(tzinfo=timezone.utc).timestamp(), 'type': action_type, 'user': user_id}
+        if device:
+            event['device'] = device
+        if last_seen is not None:
+            event['seen'] = last_seen
+        self.record(stream_id, event)
+
+    def update_viewer_activity(self, stream_id, user_id, active):
+        self.record(stream_id, {
+            't': datetime.now(timezone.utc).timestamp(),
+            'type': 'active' if active else 'inactive',
+            'user': user_id
+        })
+
+    def record_action(self, stream_id, user_id, action, product_id=None, **details):
+        # Viewer actions feed the engagement heatmap, see services/heatmap.py;
+        # details (e.g. the poll and option of a vote) are only kept in the
+        # log. Raises ValueError before logging anything the heatmap can't hold
+        if not valid_action(action, product_id):
+            raise ValueError(f'Invalid action {action!r} on product {product_id!r}')
+        self.record(stream_id, {
+            't': datetime.now(timezone.utc).timestamp(),
+            'type': 'action',
+            'user': user_id,
+            'action': action,
+            'product': product_id,
+            **details
         })
 
-        # Keep only last hour of engagement data
-        cutoff = timestamp - timedelta(hours=1)
-        analytics['engagement_data'] = [
-            data for data in analytics['engagement_data']
-            if data['timestamp'] > cutoff
-        ]
+    def stream_product(self, stream_id, product_id):
+        # Whether the product is one of the stream's seller's; both ids come
+        # from clients, so out of range ones never reach the database
+        try:
+            room, stream_id, product_id = str(stream_id), int(stream_id), int(product_id)
+        except (TypeError, ValueError):
+            return False
+        if str(stream_id) != room or not (0 < stream_id <= MAX_PRODUCT_ID and 0 < product_id <= MAX_PRODUCT_ID):
+            return False
+        return db.session.query(Product.id)\
+            .join(StreamSession, StreamSession.seller_id == Product.seller_id)\
+            .filter(Product.id == product_id, StreamSession.id == stream_id)\
+            .first() is not None
 
-        return self.calculate_metrics(stream_id)
+    def export_state(self, stream_id):
+        analytics = self.get_stream_analytics(stream_id)
+        return {
+            'viewers': list(analytics['viewers']),
+            'active_viewers': list(analytics['active_viewers']),
+            'view_durations': {
+                str(user_id): joined_at.replace(tzinfo=timezone.utc).timestamp()
+                for user_id, joined_at in analytics['view_durations'].items()
+            },
+            'peak_viewers': analytics['peak_viewers'],
+            'device_stats': analytics['device_stats'],
+            'retention_segments': analytics['retention_segments'],
+            'total_sessions': analytics['total_sessions'],
+            'revenue_data': {
+                'hourly': [dict(x) for x in analytics['revenue_data']['hourly']],
+                'total': analytics['revenue_data']['total']
+            },
+            'orders_count': analytics['orders_count'],
+            'actions': analytics['actions'].export()
+        }
+
+    def restore_state(self, stream_id, state):
+        analytics = self.get_stream_analytics(stream_id)
+        analytics['viewers'] = set(state['viewers'])
+        analytics['active_viewers'] = set(state['active_viewers'])
+        analytics['view_durations'] = {
+            int(user_id): datetime.utcfromtimestamp(ts)
+            for user_id, ts in state['view_durations'].items()
+        }
+        analytics['join_time_sum'] = sum(t.timestamp() for t in analytics['view_durations'].values())
+        analytics['peak_viewers'] = state['peak_viewers']
+        analytics['device_stats'] = state['device_stats']
+        analytics['retention_segments'] = state['retention_segments']
+        analytics['total_sessions'] = state['total_sessions']
+        analytics['revenue_data'] = {
+            'hourly': [dict(x) for x in state['revenue_data']['hourly']],
+            'total': state['revenue_data']['total']
+        }
+        analytics['orders_count'] = state.get('orders_count', 0)
+        if 'actions' in state:
+            analytics['actions'].restore(state['actions'])
+
+    def snapshot(self, stream_id):
+        with self.store.lock:
+            self.sync(stream_id)
+            self.store.snapshot(stream_id, self.export_state(stream_id))
+        self.unsnapshotted.discard(stream_id)
+
+    def record_engagement(self, stream_id, timestamp=None):
+        # One slot per second over the last hour, older samples fall off the ring
+        analytics = self.get_stream_analytics(stream_id)
+        analytics['engagement_data'].append(
+            timestamp or datetime.utcnow(),
+            viewers=len(analytics['viewers']),
+            active_viewers=len(analytics['active_viewers'])
+        )
 
     def update_retention_data(self, stream_id, duration):
         analytics = self.get_stream_analytics(stream_id)
@@ -77,33 +270,34 @@ class AnalyticsManager:
             analytics['retention_segments']['15-30m'] += 1
         else:
             analytics['retention_segments']['30m+'] += 1
+        analytics['total_sessions'] += 1
 
     def update_sales_data(self, stream_id, order):
+        self.record(stream_id, {
+            't': datetime.now(timezone.utc).timestamp(),
+            'type': 'sale',
+            'amount': order.total_amount
+        })
+
+    def apply_sale(self, stream_id, amount, timestamp):
         analytics = self.get_stream_analytics(stream_id)
-        timestamp = datetime.utcnow()
         
         # Update hourly revenue data
-        hour_key = timestamp.replace(minute=0, second=0, microsecond=0)
+        hour_key = timestamp.replace(minute=0, second=0, microsecond=0).isoformat()
         hour_data = next((x for x in analytics['revenue_data']['hourly'] if x['hour'] == hour_key), None)
         
         if hour_data:
-            hour_data['revenue'] += order.total_amount
+            hour_data['revenue'] += amount
             hour_data['orders'] += 1
         else:
             analytics['revenue_data']['hourly'].append({
                 'hour': hour_key,
-                'revenue': order.total_amount,
+                'revenue': amount,
                 'orders': 1
             })
         
-        analytics['revenue_data']['total'] += order.total_amount
-        
-        # Update conversion rate
-        total_viewers = len(analytics['viewers'])
-        if total_viewers > 0:
-            analytics['conversion_rate'] = (
-                len(Order.query.filter_by(stream_id=stream_id).all()) / total_viewers * 100
-            )
+        analytics['revenue_data']['total'] += amount
+        analytics['orders_count'] += 1
 
     def calculate_metrics(self, stream_id):
         analytics = self.get_stream_analytics(stream_id)
@@ -113,83 +307,216 @@ class AnalyticsManager:
         # Calculate engagement rate
         engagement_rate = (active_viewers / total_viewers * 100) if total_viewers > 0 else 0
         
-        # Calculate average session duration
-        current_time = datetime.utcnow()
-        durations = [
-            (current_time - start_time).total_seconds()
-            for start_time in analytics['view_durations'].values()
-        ]
-        avg_duration = sum(durations) / len(durations) if durations else 0
+        # Conversion from the running order counter, no order scan
+        analytics['conversion_rate'] = (
+            analytics['orders_count'] / total_viewers * 100
+        ) if total_viewers > 0 else 0
+        
+        # Average of (now - joined_at) is now minus the mean join time
+        watching = len(analytics['view_durations'])
+        avg_duration = (
+            datetime.utcnow().timestamp() - analytics['join_time_sum'] / watching
+        ) if watching else 0
         analytics['avg_session_duration'] = avg_duration
         
         # Calculate retention rate for each segment
-        total_sessions = sum(analytics['retention_segments'].values())
+        total_sessions = analytics['total_sessions']
         retention_rates = {
             segment: (count / total_sessions * 100) if total_sessions > 0 else 0
             for segment, count in analytics['retention_segments'].items()
         }
         
+        engagement = analytics['engagement_data']
+        
         return {
             'viewers': total_viewers,
             'active_viewers': active_viewers,
             'engagement_rate': engagement_rate,
             'avg_session_duration': avg_duration,
             'peak_viewers': analytics['peak_viewers'],
+            'hour_peak_viewers': engagement.peak('viewers'),
+            'hour_avg_active_viewers': engagement.mean('active_viewers'),
             'retention_rates': retention_rates,
             'device_stats': analytics['device_stats'],
             'revenue_data': analytics['revenue_data'],
+            'orders_count': analytics['orders_count'],
             'conversion_rate': analytics['conversion_rate']
         }
 
-analytics_manager = AnalyticsManager()
+    def schedule_update(self, stream_id):
+        with self.lock:
+            self.dirty_rooms.add(stream_id)
+            start = not self.ticker_started
+            self.ticker_started = True
+        if start:
+            self.app = current_app._get_current_object()
+            socketio.start_background_task(self._tick)
+
+    def _tick(self):
+        # Every step and every room is guarded on its own: one bad stream
+        # must not stop pushes, presence expiry or log sync for the others
+        while True:
+            socketio.sleep(self.tick_interval)
+            try:
+                expired = self.presence.advance()
+            except Exception:
+                self.app.logger.exception('Failed to expire viewers')
+                expired = []
+            for room, user_id, last_seen in expired:
+                try:
+                    self.update_viewer_metrics(room, user_id, 'leave', last_seen=last_seen)
+                except Exception:
+                    self.app.logger.exception('Failed to expire viewer %s in stream %s', user_id, room)
+            if self.store is not None:
+                self._sync_and_snapshot()
+            with self.lock:
+                rooms, self.dirty_rooms = self.dirty_rooms, set()
+            for room in rooms:
+                try:
+                    self._push(room)
+                except Exception:
+                    self.app.logger.exception('Failed to push analytics for stream %s', room)
+
+    def _push(self, room):
+        metrics = self.calculate_metrics(room)
+        # Watch time drifts on its own, only push when something else changed
+        signature = json.dumps(
+            {k: v for k, v in metrics.items() if k != 'avg_session_duration'},
+            sort_keys=True, default=str
+        )
+        if self.last_pushed.get(room) == signature:
+            return
+        self.last_pushed[room] = signature
+        socketio.emit('analytics_update', metrics, to=room)
+
+    def _sync_and_snapshot(self):
+        now = time.monotonic()
+        live = self.presence.rooms()
+        for stream_id in list(self.streams):
+            if stream_id not in live and self.last_used.get(stream_id, 0) < now - self.sync_idle:
+                continue
+            try:
+                self.sync(stream_id)
+            except Exception:
+                self.app.logger.exception('Failed to sync analytics for stream %s', stream_id)
+        if time.monotonic() - self.last_snapshot >= self.snapshot_interval:
+            self.last_snapshot = time.monotonic()
+            for stream_id in list(self.unsnapshotted):
+                try:
+                    self.snapshot(stream_id)
+                except Exception:
+                    self.app.logger.exception('Failed to snapshot analytics for stream %s', stream_id)
+            for stream_id in list(self.streams):
+                if stream_id not in live and self.last_used.get(stream_id, 0) < now - self.evict_after:
+                    try:
+                        self.evict(stream_id)
+                    except Exception:
+                        self.app.logger.exception('Failed to evict analytics for stream %s', stream_id)
+        if time.monotonic() - self.last_compact >= self.compact_interval:
+            self.last_compact = time.monotonic()
+            try:
+                self.store.compact()
+            except Exception:
+                self.app.logger.exception('Failed to compact the analytics log')
+
+    def evict(self, stream_id):
+        # Snapshot first, so nothing is lost when the stream is loaded again
+        with self.store.lock:
+            if stream_id in self.unsnapshotted:
+                self.snapshot(stream_id)
+            self.streams.pop(stream_id, None)
+            self.store.forget(stream_id)
+        self.last_used.pop(stream_id, None)
+        self.last_pushed.pop(stream_id, None)
+
+analytics_manager = AnalyticsManager(
+    store=AnalyticsStore(log_directory(),
+                         retention_days=float(os.environ.get("ANALYTICS_LOG_RETENTION_DAYS", 30)))
+)
+
+def stream_room(data):
+    # The room of an existing stream, or None; rooms name directories in the
+    # analytics log, so anything else must never reach analytics_manager
+    stream_id = chat_broadcaster.stream_id(data.get('room'))
+    return None if stream_id is None else str(stream_id)
 
 @socketio.on('join_stream')
 def on_join_stream(data):
-    room = str(data.get('room'))
+    room = stream_room(data)
     if room and session.get('user_id'):
         join_room(room)
         
-        # Update analytics
-        metrics = analytics_manager.update_viewer_metrics(
-            room, session['user_id'], 'join'
-        )
-        
         # Track device type
         user_agent = request.headers.get('User-Agent', '').lower()
-        analytics = analytics_manager.get_stream_analytics(room)
         if 'mobile' in user_agent:
-            analytics['device_stats']['mobile'] += 1
+            device = 'mobile'
         elif 'tablet' in user_agent:
-            analytics['device_stats']['tablet'] += 1
+            device = 'tablet'
         else:
-            analytics['device_stats']['desktop'] += 1
+            device = 'desktop'
         
-        socketio.emit('analytics_update', metrics, to=room)
+        # Update analytics, the ticker pushes analytics_update to the room
+        analytics_manager.presence.touch(room, session['user_id'], request.sid)
+        analytics_manager.update_viewer_metrics(room, session['user_id'], 'join', device=device)
 
 @socketio.on('leave_stream')
 def on_leave_stream(data):
-    room = str(data.get('room'))
+    room = stream_room(data)
     if room and session.get('user_id'):
-        metrics = analytics_manager.update_viewer_metrics(
-            room, session['user_id'], 'leave'
-        )
-        socketio.emit('analytics_update', metrics, to=room)
+        analytics_manager.presence.remove(room, session['user_id'])
+        analytics_manager.update_viewer_metrics(room, session['user_id'], 'leave')
         leave_room(room)
 
 @socketio.on('viewer_activity')
 def on_viewer_activity(data):
-    room = str(data.get('room'))
+    room = stream_room(data)
+    if room and session.get('user_id'):
+        analytics_manager.presence.touch(room, session['user_id'], request.sid)
+        analytics_manager.update_viewer_activity(room, session['user_id'], bool(data.get('active')))
+
+@socketio.on('viewer_heartbeat')
+def on_viewer_heartbeat(data):
+    room = stream_room(data)
     if room and session.get('user_id'):
-        analytics = analytics_manager.get_stream_analytics(room)
         user_id = session['user_id']
-        
-        if data.get('active'):
-            analytics['active_viewers'].add(user_id)
-        else:
-            analytics['active_viewers'].discard(user_id)
-        
-        metrics = analytics_manager.calculate_metrics(room)
-        socketio.emit('analytics_update', metrics, to=room)
+        # A heartbeat from an untracked viewer (e.g. after a restart) rejoins them
+        if analytics_manager.presence.touch(room, user_id, request.sid):
+            if user_id not in analytics_manager.get_stream_analytics(room)['viewers']:
+                analytics_manager.update_viewer_metrics(room, user_id, 'join')
+
+@socketio.on('viewer_active')
+def on_viewer_active(data):
+    room = stream_room(data)
+    if room and session.get('user_id'):
+        analytics_manager.presence.touch(room, session['user_id'], request.sid)
+        analytics_manager.update_viewer_activity(room, session['user_id'], True)
+
+@socketio.on('viewer_inactive')
+def on_viewer_inactive(data):
+    room = stream_room(data)
+    if room and session.get('user_id'):
+        analytics_manager.presence.touch(room, session['user_id'], request.sid)
+        analytics_manager.update_viewer_activity(room, session['user_id'], False)
+
+@socketio.on('viewer_action')
+def on_viewer_action(data):
+    # Only product views come from the client, chat, orders and wishlist
+    # saves are recorded by their own handlers
+    room = stream_room(data)
+    action = data.get('action')
+    if room and session.get('user_id') and action == 'view':
+        product_id = data.get('product_id')
+        if not analytics_manager.stream_product(room, product_id):
+            return
+        analytics_manager.presence.touch(room, session['user_id'], request.sid)
+        analytics_manager.record_action(room, session['user_id'], action, int(product_id))
+
+@socketio.on('disconnect')
+def on_disconnect(reason=None):
+    # Closing the tab never sends leave_stream, so leave every room this
+    # connection was the viewer's last one in
+    for room, user_id, last_seen in analytics_manager.presence.disconnect(request.sid):
+        analytics_manager.update_viewer_metrics(room, user_id, 'leave')
 
 @analytics_bp.route('/analytics/dashboard/<int:stream_id>')
 def stream_dashboard(stream_id):
@@ -200,22 +527,67 @@ def stream_dashboard(stream_id):
     if stream.seller_id != session['user_id']:
         return redirect(url_for('stream.list'))
     
+    # Pick up events other workers logged for this stream before reading it
+    analytics_manager.sync(str(stream_id))
     analytics = analytics_manager.get_stream_analytics(str(stream_id))
     metrics = analytics_manager.calculate_metrics(str(stream_id))
     
-    # Get historical data
-    historical_data = db.session.query(
-        func.date_trunc('hour', Order.created_at).label('hour'),
-        func.sum(Order.total_amount).label('revenue'),
-        func.count(Order.id).label('orders')
-    ).filter(
-        Order.stream_id == stream_id
-    ).group_by('hour').order_by('hour').all()
+    # Hourly and per-product sales come pre-aggregated from the rollup
+    historical_data = [
+        {'hour': hour.isoformat(), 'revenue': round(revenue or 0, 2), 'orders': orders or 0}
+        for hour, revenue, orders in sales_rollup.hourly(stream_id)
+    ]
+    product_sales = sales_rollup.by_product(stream_id)
+    products = Product.query.filter_by(seller_id=stream.seller_id).order_by(Product.name).all()
+    forecast = forecasting.forecast(stream.seller_id)
     
-    return render_template('analytics/dashboard.html',
+    return render_template('analytics/stream.html',
                          stream=stream,
+                         analytics=analytics,
                          metrics=metrics,
-                         historical_data=historical_data)
+                         historical_data=historical_data,
+                         product_sales=product_sales,
+                         products=products,
+                         forecast=forecast)
+
+@analytics_bp.route('/api/analytics/forecast')
+def get_forecast():
+    if not session.get('is_seller'):
+        return jsonify({'error': 'Unauthorized'}), 403
+    
+    forecast = forecasting.forecast(session['user_id'])
+    if forecast is None:
+        return jsonify({'status': 'pending'}), 202
+    return jsonify({
+        'generated_at': forecast['generated_at'].isoformat(),
+        'history_hours': forecast['history_hours'],
+        'next_24h': forecast['next_24h'],
+        'next_hours': [dict(hour, hour=hour['hour'].isoformat()) for hour in forecast['next_hours']],
+        'next_days': [dict(day, day=day['day'].isoformat()) for day in forecast['next_days']]
+    })
+
+@analytics_bp.route('/api/analytics/export/<int:stream_id>')
+def export_events(stream_id):
+    if not session.get('is_seller'):
+        return jsonify({'error': 'Unauthorized'}), 403
+    
+    stream = StreamSession.query.get_or_404(stream_id)
+    if stream.seller_id != session['user_id']:
+        return jsonify({'error': 'Unauthorized'}), 403
+    
+    format = request.args.get('format', 'csv')
+    if format not in ('csv', 'parquet'):
+        return jsonify({'error': 'Format must be csv or parquet'}), 400
+    if format == 'parquet' and importlib.util.find_spec('pyarrow') is None:
+        return jsonify({'error': 'Parquet export needs pyarrow installed'}), 501
+    
+    # Streamed a chunk at a time, the history is never held in memory
+    chunks = export_chunks(stream_id, analytics_manager.store.directory, format)
+    return Response(
+        stream_with_context(chunks),
+        mimetype='text/csv' if format == 'csv' else 'application/vnd.apache.parquet',
+        headers={'Content-Disposition': f'attachment; filename=stream-{stream_id}-events.{format}'}
+    )
 
 @analytics_bp.route('/api/analytics/heatmap/<int:stream_id>')
 def get_heatmap_data(stream_id):
@@ -226,8 +598,11 @@ def get_heatmap_data(stream_id):
     if stream.seller_id != session['user_id']:
         return jsonify({'error': 'Unauthorized'}), 403
     
+    # Columnar counts per time bucket; pass the previous response's `end`
+    # as ?since= to only fetch the buckets that may have changed
+    analytics_manager.sync(str(stream_id))
     analytics = analytics_manager.get_stream_analytics(str(stream_id))
-    return jsonify(analytics['heatmap_data'])
+    return jsonify(analytics['actions'].heatmap(since=request.args.get('since', 0, type=int)))
 
 @analytics_bp.route('/api/analytics/retention/<int:stream_id>')
 def get_retention_data(stream_id):
@@ -238,5 +613,19 @@ def get_retention_data(stream_id):
     if stream.seller_id != session['user_id']:
         return jsonify({'error': 'Unauthorized'}), 403
     
+    analytics_manager.sync(str(stream_id))
     analytics = analytics_manager.get_stream_analytics(str(stream_id))
     return jsonify(analytics['retention_segments'])
+
+@analytics_bp.route('/api/analytics/engagement/<int:stream_id>')
+def get_engagement_data(stream_id):
+    if not session.get('is_seller'):
+        return jsonify({'error': 'Unauthorized'}), 403
+        
+    stream = StreamSession.query.get_or_404(stream_id)
+    if stream.seller_id != session['user_id']:
+        return jsonify({'error': 'Unauthorized'}), 403
+    
+    analytics = analytics_manager.get_stream_analytics(str(stream_id))
+    step = request.args.get('step', 60, type=int)
+    return jsonify(analytics['engagement_data'].to_chart_series(step=step))
@@ -38,6 +38,7 @@ def login():
         if user and user.check_password(password):
             session['user_id'] = user.id
             session['is_seller'] = user.is_seller
+            session['username'] = user.username
             return redirect(url_for('products.list'))
             
         flash('Invalid username or password')
@@ -0,0 +1,23 @@
+from flask import Blueprint, abort, current_app, jsonify, request
+
+from models import follow_graph
+from services.profiler import query_profiler
+
+debug_bp = Blueprint('debug', __name__)
+
+@debug_bp.before_request
+def debug_only():
+    # Exposes handler names, SQL and cache internals, so only served in
+    # debug mode or when DEBUG_ENDPOINTS is set
+    if not (current_app.debug or current_app.config.get('DEBUG_ENDPOINTS')):
+        abort(404)
+
+@debug_bp.route('/api/debug/queries', methods=['GET', 'DELETE'])
+def query_stats():
+    if request.method == 'DELETE':
+        query_profiler.reset()
+    return jsonify(query_profiler.stats())
+
+@debug_bp.route('/api/debug/follow-cache')
+def follow_cache_stats():
+    return jsonify(follow_graph.stats())
@@ -1,6 +1,11 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, session
+from flask import Blueprint, render_template, request, redirect, url_for, flash, session, jsonify
+from sqlalchemy.orm import joinedload
 from app import db
-from models import Order, Product
+from models import Order, Product, StreamSession
+from routes.analytics import analytics_manager
+from services.inventory import inventory
+from services.flash_sales import flash_sales
+from services.sales_rollup import sales_rollup
 
 orders_bp = Blueprint('orders', __name__)
 
@@ -10,7 +15,8 @@ def list():
         flash('Please login to view orders')
         return redirect(url_for('auth.login'))
         
-    orders = Order.query.filter_by(user_id=session['user_id']).all()
+    orders = Order.query.options(joinedload(Order.product))\
+        .filter_by(user_id=session['user_id']).all()
     return render_template('orders/list.html', orders=orders)
 
 @orders_bp.route('/orders/create/<int:product_id>', methods=['POST'])
@@ -20,23 +26,77 @@ def create(product_id):
         return redirect(url_for('auth.login'))
         
     product = Product.query.get_or_404(product_id)
-    quantity = int(request.form.get('quantity', 1))
+    quantity = request.form.get('quantity', 1, type=int)
+    stream_id = request.form.get('stream_id', type=int)
+    reservation_id = request.form.get('reservation_id', type=int)
     
-    if quantity > product.stock:
-        flash('Not enough stock available')
-        return redirect(url_for('products.list'))
+    # Only a live stream of the product's seller is credited with the order
+    if stream_id:
+        stream = StreamSession.query.get(stream_id)
+        if stream is None or stream.status != 'active' or stream.seller_id != product.seller_id:
+            stream_id = None
+    
+    # Stock is taken by a conditional decrement, either now or earlier
+    # through a held reservation that this order confirms
+    if reservation_id:
+        confirmed = inventory.confirm(reservation_id, session['user_id'])
+        if confirmed is None or confirmed.product_id != product_id:
+            db.session.rollback()
+            flash('Your reservation has expired')
+            return redirect(url_for('products.list'))
+        quantity = confirmed.quantity
+    else:
+        reservation = inventory.reserve(product_id, session['user_id'], quantity)
+        if reservation is None:
+            db.session.rollback()
+            flash('Not enough stock available')
+            return redirect(url_for('products.list'))
+        reservation.status = 'committed'
         
     order = Order(
         user_id=session['user_id'],
         product_id=product_id,
+        stream_id=stream_id,
         quantity=quantity,
-        total_amount=product.price * quantity
+        total_amount=flash_sales.checkout_price(product) * quantity
     )
     
-    product.stock -= quantity
-    
     db.session.add(order)
+    sales_rollup.record(order, product.seller_id)
     db.session.commit()
     
+    if stream_id:
+        analytics_manager.update_sales_data(str(stream_id), order)
+        analytics_manager.record_action(str(stream_id), session['user_id'], 'order', product_id)
+        flash('Order placed successfully')
+        return redirect(url_for('stream.room', stream_id=stream_id))
+    
     flash('Order placed successfully')
     return redirect(url_for('orders.list'))
+
+@orders_bp.route('/orders/reserve/<int:product_id>', methods=['POST'])
+def reserve(product_id):
+    if not session.get('user_id'):
+        return jsonify({'error': 'Please login to reserve products'}), 401
+    
+    quantity = request.form.get('quantity', 1, type=int)
+    reservation = inventory.reserve(product_id, session['user_id'], quantity)
+    if reservation is None:
+        db.session.rollback()
+        return jsonify({'error': 'Not enough stock available'}), 409
+    db.session.commit()
+    
+    return jsonify({
+        'reservation_id': reservation.id,
+        'quantity': reservation.quantity,
+        'expires_at': reservation.expires_at.isoformat()
+    })
+
+@orders_bp.route('/orders/reservations/<int:reservation_id>/release', methods=['POST'])
+def release(reservation_id):
+    if not session.get('user_id'):
+        return jsonify({'error': 'Please login'}), 401
+    
+    released = inventory.release(reservation_id, session['user_id'])
+    db.session.commit()
+    return jsonify({'released': released})
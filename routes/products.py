@@ -1,19 +1,60 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, session
+from flask import Blueprint, render_template, request, redirect, url_for, flash, session, abort
 from app import db
-from models import Product, User, StreamSession
+from models import Product, User, StreamSession, ActivityFeed, follow_graph
+from services.timeline import timeline
+from services.inventory import inventory
+from services.flash_sales import flash_sales
+from datetime import datetime
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import joinedload
 
 products_bp = Blueprint('products', __name__)
 
+CATALOGUE_PAGE_SIZE = 24
+
 @products_bp.route('/')
 @products_bp.route('/products')
 def list():
-    products = Product.query.all()
-    active_streams = StreamSession.query.filter_by(status='active').all()
-    current_user = User.query.get(session.get('user_id')) if session.get('user_id') else None
+    # Keyset pagination on (created_at, id): ?after=<iso time>|<id> from the
+    # previous page, so every page is one index range scan
+    query = Product.query.options(joinedload(Product.seller))
+    after = request.args.get('after')
+    if after:
+        created_at, _, product_id = after.partition('|')
+        try:
+            created_at = datetime.fromisoformat(created_at)
+            product_id = int(product_id or 0)
+        except ValueError:
+            abort(400, 'Invalid cursor')
+        query = query.filter(or_(
+            Product.created_at < created_at,
+            and_(Product.created_at == created_at, Product.id < product_id)
+        ))
+    products = query.order_by(Product.created_at.desc(), Product.id.desc())\
+        .limit(CATALOGUE_PAGE_SIZE + 1).all()
+    
+    next_cursor = None
+    if len(products) > CATALOGUE_PAGE_SIZE:
+        products = products[:CATALOGUE_PAGE_SIZE]
+        next_cursor = f'{products[-1].created_at.isoformat()}|{products[-1].id}'
+    
+    active_streams = StreamSession.query.options(joinedload(StreamSession.seller))\
+        .filter_by(status='active').all()
+    
+    # Resolve "am I following?" for every card from one cached set
+    followed_ids = follow_graph.followed_ids(session['user_id']) if session.get('user_id') else set()
+    
+    # Sharded products keep their stock in sub-counters, sum those in one query
+    sharded_ids = [product.id for product in products if product.stock_shards]
+    stock_levels = inventory.available(sharded_ids) if sharded_ids else {}
+    
     return render_template('products/list.html', 
                          products=products, 
                          active_streams=active_streams,
-                         current_user=current_user)
+                         followed_ids=followed_ids,
+                         stock_levels=stock_levels,
+                         sale_prices=flash_sales.prices(products),
+                         next_cursor=next_cursor)
 
 @products_bp.route('/products/manage')
 def manage():
@@ -21,7 +62,28 @@ def manage():
         flash('Only sellers can manage products')
         return redirect(url_for('products.list'))
     products = Product.query.filter_by(seller_id=session['user_id']).all()
-    return render_template('products/manage.html', products=products)
+    sharded_ids = [product.id for product in products if product.stock_shards]
+    stock_levels = inventory.available(sharded_ids) if sharded_ids else {}
+    return render_template('products/manage.html', products=products, stock_levels=stock_levels)
+
+@products_bp.route('/products/<int:product_id>/stock-shards', methods=['POST'])
+def shard_stock(product_id):
+    product = Product.query.get_or_404(product_id)
+    if product.seller_id != session.get('user_id'):
+        flash('Only the seller can change stock settings')
+        return redirect(url_for('products.list'))
+    
+    # Split stock of a hot product (e.g. ahead of a flash drop) into
+    # sub-counters, or 0 to merge it back into a single counter
+    shards = request.form.get('shards', 0, type=int)
+    if shards > 1:
+        inventory.shard(product_id, shards)
+    else:
+        inventory.unshard(product_id)
+    db.session.commit()
+    
+    flash('Stock settings updated')
+    return redirect(url_for('products.manage'))
 
 @products_bp.route('/products/create', methods=['GET', 'POST'])
 def create():
@@ -40,7 +102,16 @@ def create():
         )
         
         db.session.add(product)
+        db.session.flush()
+        
+        activity = ActivityFeed(
+            user_id=session['user_id'],
+            activity_type='new_product',
+            target_id=product.id
+        )
+        db.session.add(activity)
         db.session.commit()
+        timeline.publish(activity.id, session['user_id'])
         
         flash('Product created successfully')
         return redirect(url_for('products.manage'))
@@ -1,7 +1,10 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash, session, jsonify
-from app import db
-from models import User, Badge, FlashSale, Product, GroupBuying, GroupBuyingParticipant, Wishlist
+from app import db, socketio
+from models import User, Badge, FlashSale, Product, StreamSession, GroupBuying, GroupBuyingParticipant, Wishlist
 from datetime import datetime, timedelta
+from services.flash_sales import flash_sales, discounted_price
+from services.group_buys import group_buys, ALREADY_JOINED, CLOSED
+from routes.analytics import analytics_manager
 
 rewards_bp = Blueprint('rewards', __name__)
 
@@ -47,6 +50,11 @@ def manage_wishlist():
         wishlist_item = Wishlist(user_id=session['user_id'], product_id=product_id)
         db.session.add(wishlist_item)
         db.session.commit()
+        # Saved from a stream room, counts towards that stream's heatmap
+        stream_id = request.form.get('stream_id', type=int)
+        product_id = request.form.get('product_id', type=int)
+        if stream_id and analytics_manager.stream_product(stream_id, product_id):
+            analytics_manager.record_action(str(stream_id), session['user_id'], 'wishlist', product_id)
         return jsonify({'success': True})
         
     elif request.method == 'DELETE':
@@ -70,23 +78,25 @@ def create_group_buying(product_id):
     min_buyers = int(request.form.get('min_buyers'))
     expires_at = datetime.utcnow() + timedelta(days=7)  # 7 days expiry
     
+    # The creator is the first participant, both rows go in one transaction
     group_buy = GroupBuying(
         product_id=product_id,
         target_price=target_price,
         min_buyers=min_buyers,
+        current_buyers=1,
         expires_at=expires_at
     )
-    
     db.session.add(group_buy)
-    db.session.commit()
+    db.session.flush()
     
-    # Add creator as first participant
     participant = GroupBuyingParticipant(
         group_buying_id=group_buy.id,
         user_id=session['user_id']
     )
     db.session.add(participant)
     db.session.commit()
+    # Expired and completed in the background, not on requests
+    group_buys.start()
     
     flash('Group buying created successfully')
     return redirect(url_for('products.list'))
@@ -97,42 +107,15 @@ def join_group_buying(group_id):
         flash('Please login to join group buying')
         return redirect(url_for('auth.login'))
         
-    group_buy = GroupBuying.query.get_or_404(group_id)
+    GroupBuying.query.get_or_404(group_id)
     
-    if group_buy.status != 'active':
+    result = group_buys.join(group_id, session['user_id'])
+    if result == CLOSED:
         flash('This group buying is no longer active')
-        return redirect(url_for('products.list'))
-        
-    if datetime.utcnow() > group_buy.expires_at:
-        group_buy.status = 'expired'
-        db.session.commit()
-        flash('This group buying has expired')
-        return redirect(url_for('products.list'))
-    
-    # Check if user already joined
-    existing = GroupBuyingParticipant.query.filter_by(
-        group_buying_id=group_id,
-        user_id=session['user_id']
-    ).first()
-    
-    if existing:
+    elif result == ALREADY_JOINED:
         flash('You have already joined this group buying')
-        return redirect(url_for('products.list'))
-    
-    participant = GroupBuyingParticipant(
-        group_buying_id=group_id,
-        user_id=session['user_id']
-    )
-    db.session.add(participant)
-    group_buy.current_buyers += 1
-    
-    # Check if target reached
-    if group_buy.current_buyers >= group_buy.min_buyers:
-        group_buy.status = 'completed'
-        # Here we would typically trigger the group purchase process
-        
-    db.session.commit()
-    flash('Successfully joined group buying')
+    else:
+        flash('Successfully joined group buying')
     return redirect(url_for('products.list'))
 
 @rewards_bp.route('/flash-sale/create', methods=['POST'])
@@ -140,10 +123,22 @@ def create_flash_sale():
     if not session.get('is_seller'):
         return jsonify({'error': 'Seller access required'}), 403
         
-    stream_id = request.form.get('stream_id')
-    product_id = request.form.get('product_id')
-    discount = int(request.form.get('discount'))
-    duration = int(request.form.get('duration', 30))  # Default 30 minutes
+    stream_id = request.form.get('stream_id', type=int)
+    product_id = request.form.get('product_id', type=int)
+    discount = request.form.get('discount', type=int)
+    duration = request.form.get('duration', 30, type=int)  # Default 30 minutes
+    
+    if discount is None or not 0 <= discount <= 100:
+        return jsonify({'error': 'Discount must be between 0 and 100'}), 400
+    if duration is None or duration <= 0:
+        return jsonify({'error': 'Duration must be positive'}), 400
+    # Sellers can only discount their own products in their own streams
+    product = Product.query.get(product_id) if product_id else None
+    stream = StreamSession.query.get(stream_id) if stream_id else None
+    if product is None or stream is None:
+        return jsonify({'error': 'Product or stream not found'}), 404
+    if product.seller_id != session.get('user_id') or stream.seller_id != session.get('user_id'):
+        return jsonify({'error': 'Seller access required'}), 403
     
     start_time = datetime.utcnow()
     end_time = start_time + timedelta(minutes=duration)
@@ -158,6 +153,15 @@ def create_flash_sale():
     
     db.session.add(flash_sale)
     db.session.commit()
+    flash_sales.add(flash_sale)
+    
+    socketio.emit('flash_sale_started', {
+        'flash_sale_id': flash_sale.id,
+        'product_id': product.id,
+        'discount_percentage': discount,
+        'price': discounted_price(product.price, discount),
+        'end_time': end_time.isoformat()
+    }, to=str(flash_sale.stream_id))
     
     return jsonify({
         'success': True,
@@ -1,6 +1,7 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, session, jsonify
+from flask import Blueprint, render_template, request, redirect, url_for, flash, session
 from app import db
-from models import User, ActivityFeed, StreamSession, Product
+from models import User, ActivityFeed, StreamSession, Product, follow_graph
+from services.timeline import timeline
 
 social_bp = Blueprint('social', __name__)
 
@@ -16,7 +17,10 @@ def follow(user_id):
         return redirect(url_for('products.list'))
     
     current_user = User.query.get(session['user_id'])
-    current_user.follow(user_to_follow)
+    if not current_user.follow(user_to_follow):
+        db.session.rollback()
+        flash(f'You are already following {user_to_follow.username}')
+        return redirect(url_for('social.seller_profile', user_id=user_id))
     
     # Record in activity feed
     activity = ActivityFeed(
@@ -26,6 +30,9 @@ def follow(user_id):
     )
     db.session.add(activity)
     db.session.commit()
+    follow_graph.add(current_user.id, user_to_follow.id)
+    timeline.follow(current_user.id, user_to_follow.id)
+    timeline.publish(activity.id, current_user.id)
     
     flash(f'You are now following {user_to_follow.username}')
     return redirect(url_for('social.seller_profile', user_id=user_id))
@@ -38,8 +45,11 @@ def unfollow(user_id):
     
     user_to_unfollow = User.query.get_or_404(user_id)
     current_user = User.query.get(session['user_id'])
-    current_user.unfollow(user_to_unfollow)
+    removed = current_user.unfollow(user_to_unfollow)
     db.session.commit()
+    follow_graph.remove(current_user.id, user_to_unfollow.id)
+    if removed:
+        timeline.unfollow(current_user.id, user_to_unfollow.id)
     
     flash(f'You have unfollowed {user_to_unfollow.username}')
     return redirect(url_for('social.seller_profile', user_id=user_id))
@@ -56,14 +66,14 @@ def seller_profile(user_id):
     
     is_following = False
     if session.get('user_id'):
-        current_user = User.query.get(session['user_id'])
-        is_following = current_user.is_following(seller)
+        is_following = follow_graph.is_following(session['user_id'], seller.id)
     
     return render_template('social/seller_profile.html',
                          seller=seller,
                          products=products,
                          active_streams=active_streams,
-                         is_following=is_following)
+                         is_following=is_following,
+                         follower_count=seller.follower_count or 0)
 
 @social_bp.route('/feed')
 def activity_feed():
@@ -71,32 +81,26 @@ def activity_feed():
         flash('Please login to view your feed')
         return redirect(url_for('auth.login'))
     
-    current_user = User.query.get(session['user_id'])
-    followed_sellers = current_user.followed.all()
-    seller_ids = [seller.id for seller in followed_sellers]
-    
-    # Get activities from followed sellers
-    activities = ActivityFeed.query\
-        .filter(ActivityFeed.user_id.in_(seller_ids))\
-        .order_by(ActivityFeed.created_at.desc())\
-        .limit(50)\
-        .all()
+    # One range read on the user's timeline for activities; streams (live
+    # and scheduled) and products come from the followed sellers directly,
+    # so they show up whether or not an activity announced them
+    activities = timeline.read(session['user_id'])
+    seller_ids = list(follow_graph.followed_ids(session['user_id']))
     
-    # Get active streams from followed sellers
     active_streams = StreamSession.query\
         .filter(StreamSession.seller_id.in_(seller_ids))\
         .filter_by(status='active')\
         .order_by(StreamSession.created_at.desc())\
-        .all()
+        .all() if seller_ids else []
     
-    # Get latest products from followed sellers
     latest_products = Product.query\
         .filter(Product.seller_id.in_(seller_ids))\
         .order_by(Product.created_at.desc())\
         .limit(12)\
-        .all()
+        .all() if seller_ids else []
     
     return render_template('social/feed.html',
                          activities=activities,
                          active_streams=active_streams,
                          latest_products=latest_products)
+
@@ -1,12 +1,23 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, session
+from flask import Blueprint, render_template, request, redirect, url_for, flash, session, jsonify
 from app import db, socketio
 from flask_socketio import join_room, emit
 from models import StreamSession, Product, User, Question, Poll, ActivityFeed
 from datetime import datetime
-from sqlalchemy import desc
+from services.chat import chat_broadcaster, get_session_username, load_history, cursor_for
+from services.polls import poll_tally
+from services.questions import question_board
+from services.timeline import timeline
+from services.flash_sales import flash_sales
+from sqlalchemy import update
+from sqlalchemy.orm import joinedload
+from routes.analytics import analytics_manager
+from services.loyalty import loyalty
 
 stream_bp = Blueprint('stream', __name__)
 
+# Points given to every viewer still watching when a stream ends
+WATCH_REWARD_POINTS = 10
+
 @stream_bp.route('/stream/create', methods=['GET', 'POST'])
 def create():
     if not session.get('is_seller'):
@@ -32,6 +43,7 @@ def create():
         )
         
         db.session.add(stream)
+        db.session.flush()
         
         # Create activity feed entry for new stream
         activity = ActivityFeed(
@@ -50,6 +62,7 @@ def create():
                 pass
                 
         db.session.commit()
+        timeline.publish(activity.id, session['user_id'])
         
         if scheduled_datetime:
             flash(f'Stream scheduled for {scheduled_for}')
@@ -69,10 +82,14 @@ def room(stream_id):
         flash('This stream has not started yet')
         return redirect(url_for('products.list'))
     
-    # Get questions sorted by votes_count and timestamp
-    questions = Question.query.filter_by(stream_id=stream_id)\
-        .order_by(desc(Question.votes_count), desc(Question.created_at))\
-        .all()
+    # Top questions come from the in-memory leaderboard, ranked by votes and time
+    question_ids = question_board.top(stream_id)
+    questions_by_id = {
+        question.id: question
+        for question in Question.query.options(joinedload(Question.user))
+            .filter(Question.id.in_(question_ids)).all()
+    } if question_ids else {}
+    questions = [questions_by_id[question_id] for question_id in question_ids if question_id in questions_by_id]
     
     # Get active polls
     polls = Poll.query.filter_by(stream_id=stream_id, status='active').all()
@@ -81,24 +98,46 @@ def room(stream_id):
                          stream=stream, 
                          products=products, 
                          questions=questions,
-                         polls=polls)
+                         polls=polls,
+                         sale_prices=flash_sales.prices(products))
+
+@stream_bp.route('/stream/<int:stream_id>/chat')
+def chat_history(stream_id):
+    StreamSession.query.get_or_404(stream_id)
+    limit = min(request.args.get('limit', 50, type=int), 200)
+    try:
+        messages, next_cursor = load_history(stream_id, before=request.args.get('before'), limit=limit)
+    except ValueError:
+        return jsonify({'error': 'Invalid cursor'}), 400
+    return jsonify({'messages': messages, 'next_cursor': next_cursor})
 
 @socketio.on('join_room')
 def on_join(data):
     room = data['room']
     join_room(room)
+    
+    # Replay recent chat to the joining client only
+    if chat_broadcaster.stream_id(room) is None:
+        return
+    messages = chat_broadcaster.recent(room)
+    emit('chat_history', {
+        'messages': messages,
+        'next_cursor': cursor_for(messages[0]) if messages else None
+    })
 
 @socketio.on('chat_message')
 def on_chat_message(data):
     if not session.get('user_id'):
         return
         
-    user = User.query.get(session['user_id'])
-    if user:
-        emit('chat_message', {
-            'username': user.username,
-            'message': data['message']
-        }, room=data['room'])
+    username = get_session_username()
+    if not isinstance(data.get('message'), str):
+        return
+    if username and chat_broadcaster.publish(data['room'], {
+        'username': username,
+        'message': data['message']
+    }, user_id=session['user_id']):
+        analytics_manager.record_action(str(data['room']), session['user_id'], 'chat')
 
 @socketio.on('submit_question')
 def on_submit_question(data):
@@ -115,6 +154,7 @@ def on_submit_question(data):
         
         db.session.add(question)
         db.session.commit()
+        question_board.add(question)
         
         stream = StreamSession.query.get(question.stream_id)
         emit('new_question', {
@@ -150,13 +190,15 @@ def on_vote_question(data):
         
     question = Question.query.get(int(data['question_id']))
     if question:
-        question.votes_count += 1
-        db.session.commit()
+        result = question_board.vote(question, session['user_id'])
+        if result is None:
+            return
         
-        emit('question_voted', {
-            'question_id': question.id,
-            'votes': question.votes_count
-        }, room=data['room'])
+        votes, rank = result
+        payload = {'question_id': question.id, 'votes': votes}
+        if rank is not None:
+            payload['rank'] = rank
+        emit('question_voted', payload, room=data['room'])
 
 @socketio.on('create_poll')
 def on_create_poll(data):
@@ -183,33 +225,56 @@ def on_create_poll(data):
 def on_vote_poll(data):
     if not session.get('user_id'):
         return
-        
-    poll = Poll.query.get(int(data['poll_id']))
-    if poll and poll.status == 'active':
-        option = data['option']
-        if option in poll.options:
-            if not poll.votes:
-                poll.votes = {}
-            poll.votes[option] = poll.votes.get(option, 0) + 1
-            db.session.commit()
-            
-            total_votes = sum(poll.votes.values())
-            emit('poll_updated', {
-                'poll_id': poll.id,
-                'votes': poll.votes,
-                'total_votes': total_votes
-            }, room=data['room'])
+    
+    # Counted in memory, poll_updated is pushed by the tally engine at a
+    # bounded rate and the Poll row is written behind
+    poll_id = int(data['poll_id'])
+    if poll_tally.vote(poll_id, session['user_id'], data['option']):
+        # Recorded in the poll's own stream, never a client-supplied room
+        tally = poll_tally.get(poll_id)
+        if tally is not None:
+            analytics_manager.record_action(tally['room'], session['user_id'], 'vote',
+                                            poll=poll_id, option=data['option'])
 
 @socketio.on('close_poll')
 def on_close_poll(data):
     if not session.get('user_id') or not session.get('is_seller'):
         return
         
+    # Writes the closed status together with the last pending votes
+    poll_tally.close(int(data['poll_id']))
     poll = Poll.query.get(int(data['poll_id']))
     if poll:
-        poll.status = 'closed'
-        db.session.commit()
-        
         emit('poll_closed', {
             'poll_id': poll.id
         }, room=data['room'])
+
+@socketio.on('stream_ended')
+def on_stream_ended(data):
+    if not session.get('user_id') or not session.get('is_seller'):
+        return
+    
+    # Only the first end of an active stream counts, so viewers are
+    # rewarded once even if the seller's client sends it again
+    stream_id = int(data['room'])
+    ended = db.session.execute(
+        update(StreamSession)
+        .where(StreamSession.id == stream_id,
+               StreamSession.seller_id == session['user_id'],
+               StreamSession.status == 'active')
+        .values(status='ended')
+        .returning(StreamSession.id)
+    ).first()
+    if ended is None:
+        db.session.rollback()
+        return
+    
+    room = str(stream_id)
+    analytics_manager.sync(room)
+    viewers = analytics_manager.get_stream_analytics(room)['viewers'] - {session['user_id']}
+    loyalty.award_many(viewers, WATCH_REWARD_POINTS, 'stream_watch', reference_id=stream_id)
+    db.session.commit()
+    poll_tally.drop_stream(room)
+    question_board.drop(stream_id)
+    
+    emit('stream_ended', {'stream_id': stream_id}, room=room, include_self=False)
@@ -0,0 +1,192 @@
+import gzip
+import heapq
+import json
+import os
+import shutil
+import socket
+import threading
+import time
+
+APP_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def log_directory():
+    # ANALYTICS_LOG_DIR, with relative paths taken from the app root rather
+    # than from wherever the worker was started
+    return os.path.join(APP_ROOT, os.environ.get('ANALYTICS_LOG_DIR', 'analytics_log'))
+
+
+class AnalyticsStore:
+    """Append-only event log plus compact snapshots for stream analytics.
+
+    Each worker appends to its own log segments per stream
+    (`<directory>/<stream_id>/<worker_id>-<n>.log`, one JSON event per line),
+    so writers never interleave. Readers remember a byte offset per segment:
+    rebuilding a stream loads `snapshot.json` and replays only the bytes
+    written after the offsets it recorded, and `read_new` tails the other
+    workers' segments so every process converges on the same merged state.
+
+    A writer never appends to a segment that is older than `rotate_after`
+    seconds or larger than `segment_bytes`, it opens a new one. Segments
+    untouched for twice that are sealed whoever wrote them, and `compact()`
+    moves sealed segments the snapshot covers to `archive/` gzipped, where
+    only exports read them. Streams with no live segments are deleted after
+    `retention_days`.
+    """
+
+    def __init__(self, directory, worker_id=None, segment_bytes=16 * 1024 * 1024,
+                 rotate_after=600.0, retention_days=30.0):
+        self.directory = directory
+        self.worker_id = worker_id or f'{socket.gethostname()}-{os.getpid()}'
+        self.segment_bytes = segment_bytes
+        self.rotate_after = rotate_after
+        self.retention_days = retention_days
+        self.offsets = {}
+        self.handles = {}
+        self.lock = threading.RLock()
+
+    def _stream_dir(self, stream_id):
+        # Stream ids name directories, anything but an integer id is refused
+        try:
+            valid = not isinstance(stream_id, bool) and str(int(stream_id)) == str(stream_id)
+        except (TypeError, ValueError):
+            valid = False
+        if not valid:
+            raise ValueError(f'Invalid stream id {stream_id!r}')
+        path = os.path.join(self.directory, str(stream_id))
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def append(self, stream_id, event):
+        line = json.dumps(event, separators=(',', ':')) + '\n'
+        now = time.time()
+        with self.lock:
+            segment = self.handles.get(stream_id)
+            if segment is not None and (now - segment['written'] >= self.rotate_after
+                                        or segment['handle'].tell() >= self.segment_bytes):
+                segment['handle'].close()
+                segment = None
+            if segment is None:
+                name = f'{self.worker_id}-{time.time_ns()}.log'
+                path = os.path.join(self._stream_dir(stream_id), name)
+                segment = self.handles[stream_id] = {
+                    'name': name, 'handle': open(path, 'a', encoding='utf-8')
+                }
+            handle = segment['handle']
+            handle.write(line)
+            handle.flush()
+            segment['written'] = now
+            # Our own events are applied directly, never replayed from the log
+            self.offsets.setdefault(stream_id, {})[segment['name']] = handle.tell()
+
+    def load(self, stream_id):
+        # Returns (snapshot state or None, events logged after the snapshot)
+        with self.lock:
+            path = os.path.join(self._stream_dir(stream_id), 'snapshot.json')
+            state = None
+            self.offsets[stream_id] = {}
+            if os.path.exists(path):
+                with open(path, encoding='utf-8') as f:
+                    snapshot = json.load(f)
+                state = snapshot['state']
+                self.offsets[stream_id] = dict(snapshot['offsets'])
+            return state, self.read_new(stream_id)
+
+    def read_new(self, stream_id):
+        with self.lock:
+            stream_dir = self._stream_dir(stream_id)
+            offsets = self.offsets.setdefault(stream_id, {})
+            names = [name for name in os.listdir(stream_dir) if name.endswith('.log')]
+            # Segments archived since are covered by the snapshot already
+            for name in set(offsets) - set(names):
+                del offsets[name]
+            batches = []
+            for name in names:
+                offset = offsets.get(name, 0)
+                try:
+                    with open(os.path.join(stream_dir, name), 'rb') as f:
+                        f.seek(offset)
+                        data = f.read()
+                except FileNotFoundError:
+                    continue
+                # Only consume complete lines, a peer may be mid-write
+                end = data.rfind(b'\n') + 1
+                if not end:
+                    continue
+                offsets[name] = offset + end
+                batches.append([json.loads(line) for line in data[:end].splitlines()])
+            return list(heapq.merge(*batches, key=lambda event: event['t']))
+
+    def snapshot(self, stream_id, state):
+        with self.lock:
+            offsets = dict(self.offsets.get(stream_id, {}))
+            path = os.path.join(self._stream_dir(stream_id), 'snapshot.json')
+            tmp_path = f'{path}.{self.worker_id}.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'state': state, 'offsets': offsets}, f, separators=(',', ':'))
+            os.replace(tmp_path, path)
+
+    def forget(self, stream_id):
+        # Closes our segment and drops the offsets of an evicted stream
+        with self.lock:
+            segment = self.handles.pop(stream_id, None)
+            if segment is not None:
+                segment['handle'].close()
+            self.offsets.pop(stream_id, None)
+
+    def compact(self, now=None):
+        # Archives sealed segments covered by the snapshot and deletes
+        # streams past retention; returns the number of segments archived
+        now = now or time.time()
+        archived = 0
+        if not os.path.isdir(self.directory):
+            return archived
+        for stream in os.listdir(self.directory):
+            stream_dir = os.path.join(self.directory, stream)
+            if not os.path.isdir(stream_dir):
+                continue
+            names = [name for name in os.listdir(stream_dir) if name.endswith('.log')]
+            sealed = [name for name in names
+                      if os.path.getmtime(os.path.join(stream_dir, name)) < now - 2 * self.rotate_after]
+            if sealed:
+                covered = self._snapshot_offsets(stream_dir)
+                for name in sealed:
+                    path = os.path.join(stream_dir, name)
+                    if covered.get(name, -1) >= os.path.getsize(path):
+                        self._archive(stream_dir, name)
+                        archived += 1
+                        names.remove(name)
+            if not names and self._last_modified(stream_dir) < now - self.retention_days * 86400:
+                shutil.rmtree(stream_dir, ignore_errors=True)
+        return archived
+
+    def _snapshot_offsets(self, stream_dir):
+        try:
+            with open(os.path.join(stream_dir, 'snapshot.json'), encoding='utf-8') as f:
+                return json.load(f)['offsets']
+        except FileNotFoundError:
+            return {}
+
+    def _archive(self, stream_dir, name):
+        # Several workers may archive the same segment, the copies are equal
+        archive_dir = os.path.join(stream_dir, 'archive')
+        os.makedirs(archive_dir, exist_ok=True)
+        target = os.path.join(archive_dir, f'{name}.gz')
+        tmp_path = f'{target}.{self.worker_id}.tmp'
+        try:
+            with open(os.path.join(stream_dir, name), 'rb') as source, gzip.open(tmp_path, 'wb') as out:
+                shutil.copyfileobj(source, out)
+        except FileNotFoundError:
+            return
+        os.replace(tmp_path, target)
+        try:
+            os.remove(os.path.join(stream_dir, name))
+        except FileNotFoundError:
+            pass
+
+    def _last_modified(self, stream_dir):
+        paths = [os.path.join(stream_dir, name) for name in os.listdir(stream_dir)]
+        archive_dir = os.path.join(stream_dir, 'archive')
+        if os.path.isdir(archive_dir):
+            paths += [os.path.join(archive_dir, name) for name in os.listdir(archive_dir)]
+        return max((os.path.getmtime(path) for path in paths), default=0)
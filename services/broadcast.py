@@ -0,0 +1,252 @@
+import json
+import os
+import selectors
+import socket
+import struct
+import threading
+import time
+from urllib.parse import urlparse
+
+import socketio
+
+# Frames on the broker socket are a 4-byte big-endian length followed by a
+# JSON payload. The first frame on every connection is a hello of
+# [mode, channel] where mode is 'pub' or 'sub'. The socket is only open to
+# its owner (0600) from the moment it is bound, and nothing read from it is
+# ever unpickled.
+HEADER = struct.Struct('!I')
+LOCAL_SCHEMES = ('local',)
+
+
+def encode_frame(payload):
+    return HEADER.pack(len(payload)) + payload
+
+
+def read_frames(sock):
+    buffer = b''
+    while True:
+        chunk = sock.recv(65536)
+        if not chunk:
+            return
+        buffer += chunk
+        while len(buffer) >= HEADER.size:
+            (length,) = HEADER.unpack_from(buffer)
+            if len(buffer) < HEADER.size + length:
+                break
+            yield buffer[HEADER.size:HEADER.size + length]
+            buffer = buffer[HEADER.size + length:]
+
+
+def connect(path, mode, channel):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(path)
+    sock.sendall(encode_frame(json.dumps([mode, channel]).encode()))
+    return sock
+
+
+class BroadcastBroker:
+    """Dependency-free fan-out relay over a Unix socket.
+
+    Every frame published on a channel is copied to all subscribers of that
+    channel. It plays the role Redis pub/sub plays in production, for a single
+    box or for tests. A subscriber that falls more than `max_outbox` bytes
+    behind is disconnected rather than buffered without bound.
+    """
+
+    def __init__(self, path, max_outbox=16 * 1024 * 1024):
+        self.path = path
+        self.max_outbox = max_outbox
+        self.selector = selectors.DefaultSelector()
+        self.clients = {}
+        self.subscribers = {}
+        self.server = None
+        self.running = False
+
+    def bind(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        # The socket file is created by bind(), so the umask decides who can
+        # connect until chmod; keep it owner-only for that window too
+        umask = os.umask(0o077)
+        try:
+            self.server.bind(self.path)
+        finally:
+            os.umask(umask)
+        os.chmod(self.path, 0o600)
+        self.server.listen(128)
+        self.server.setblocking(False)
+        self.selector.register(self.server, selectors.EVENT_READ)
+
+    def serve_forever(self):
+        if self.server is None:
+            self.bind()
+        server = self.server
+        self.running = True
+        try:
+            while self.running:
+                for key, mask in self.selector.select(timeout=0.5):
+                    if key.fileobj is server:
+                        self._accept(server)
+                        continue
+                    if mask & selectors.EVENT_READ:
+                        self._read(key.fileobj)
+                    if mask & selectors.EVENT_WRITE and key.fileobj in self.clients:
+                        self._flush(key.fileobj)
+        finally:
+            for sock in list(self.clients):
+                self._drop(sock)
+            self.selector.unregister(server)
+            server.close()
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+
+    def start(self):
+        # Bind before returning so clients can connect straight away
+        self.bind()
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        self.running = False
+
+    def _accept(self, server):
+        sock, _ = server.accept()
+        sock.setblocking(False)
+        self.clients[sock] = {'channel': None, 'mode': None, 'inbox': b'', 'outbox': bytearray()}
+        self.selector.register(sock, selectors.EVENT_READ)
+
+    def _read(self, sock):
+        client = self.clients[sock]
+        try:
+            chunk = sock.recv(65536)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            chunk = b''
+        if not chunk:
+            self._drop(sock)
+            return
+
+        buffer = client['inbox'] + chunk
+        offset = 0
+        while len(buffer) - offset >= HEADER.size:
+            (length,) = HEADER.unpack_from(buffer, offset)
+            end = offset + HEADER.size + length
+            if len(buffer) < end:
+                break
+            if client['channel'] is None:
+                try:
+                    mode, channel = json.loads(buffer[offset + HEADER.size:end])
+                except (TypeError, ValueError):
+                    mode = channel = None
+                if mode not in ('pub', 'sub') or not isinstance(channel, str):
+                    self._drop(sock)
+                    return
+                client['mode'], client['channel'] = mode, channel
+                if client['mode'] == 'sub':
+                    self.subscribers.setdefault(client['channel'], set()).add(sock)
+            else:
+                # Relay the raw frame, the broker never decodes payloads
+                frame = buffer[offset:end]
+                for subscriber in list(self.subscribers.get(client['channel'], ())):
+                    if subscriber in self.clients:
+                        self._send(subscriber, frame)
+            offset = end
+        client['inbox'] = buffer[offset:]
+
+    def _send(self, sock, frame):
+        client = self.clients[sock]
+        pending = bool(client['outbox'])
+        if len(client['outbox']) + len(frame) > self.max_outbox:
+            # Too slow to keep up, it resubscribes and misses what it dropped
+            self._drop(sock)
+            return
+        client['outbox'] += frame
+        if not pending:
+            self._flush(sock)
+
+    def _flush(self, sock):
+        client = self.clients[sock]
+        try:
+            sent = sock.send(client['outbox'])
+        except (BlockingIOError, InterruptedError):
+            sent = 0
+        except OSError:
+            self._drop(sock)
+            return
+        del client['outbox'][:sent]
+        events = selectors.EVENT_READ | (selectors.EVENT_WRITE if client['outbox'] else 0)
+        self.selector.modify(sock, events)
+
+    def _drop(self, sock):
+        client = self.clients.pop(sock, None)
+        if client and client['mode'] == 'sub':
+            self.subscribers.get(client['channel'], set()).discard(sock)
+        try:
+            self.selector.unregister(sock)
+        except (KeyError, ValueError):
+            pass
+        sock.close()
+
+
+class LocalBrokerManager(socketio.PubSubManager):
+    """Socket.IO client manager that fans out through a BroadcastBroker."""
+
+    name = 'local'
+
+    def __init__(self, url, channel='flask-socketio', write_only=False,
+                 logger=None, json=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger,
+                         json=json)
+        self.path = urlparse(url).path
+        self.publisher = None
+        self.lock = threading.Lock()
+
+    def _publish(self, data):
+        payload = self.json.dumps(data)
+        frame = encode_frame(payload.encode() if isinstance(payload, str) else payload)
+        with self.lock:
+            for retry in (False, True):
+                try:
+                    if self.publisher is None:
+                        self.publisher = connect(self.path, 'pub', self.channel)
+                    self.publisher.sendall(frame)
+                    return
+                except OSError:
+                    if self.publisher is not None:
+                        self.publisher.close()
+                    self.publisher = None
+                    if retry:
+                        raise
+
+    def _listen(self):
+        while True:
+            sock = connect(self.path, 'sub', self.channel)
+            try:
+                # Decoded with self.json by PubSubManager._thread
+                yield from read_frames(sock)
+            finally:
+                sock.close()
+            # The broker disconnects subscribers that fall too far behind
+            self._get_logger().warning('Broadcast subscription closed, resubscribing')
+            time.sleep(1)
+
+
+def broadcast_options(url):
+    # Keyword arguments for socketio.init_app(). Local broker URLs get our own
+    # manager, anything else (redis://, amqp://, kafka://) goes to Flask-SocketIO
+    if not url:
+        return {}
+    if urlparse(url).scheme in LOCAL_SCHEMES:
+        return {'client_manager': LocalBrokerManager(url)}
+    return {'message_queue': url}
+
+
+def run_broker(url):
+    BroadcastBroker(urlparse(url).path).serve_forever()
+
+
+if __name__ == '__main__':
+    run_broker(os.environ.get('SOCKETIO_MESSAGE_QUEUE', 'local:///tmp/liveshop-broadcast.sock'))
@@ -0,0 +1,236 @@
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+from flask import current_app, session
+from sqlalchemy import and_, insert, or_
+from sqlalchemy.exc import DataError, IntegrityError
+
+from app import db, socketio
+from models import ChatMessage, StreamSession, User
+
+
+class ChatBroadcaster:
+    """Coalesces chat messages per room into batched chat_message frames.
+
+    Messages are buffered per room and flushed every `interval` seconds, or
+    straight away once a room has `max_batch` messages waiting, so a busy room
+    costs one packet per viewer per flush instead of one per message.
+
+    Each room also keeps a ring of its last `history_size` messages for replay
+    on join, and messages are persisted write-behind: rows are bulk-inserted
+    every `write_interval` seconds by a task of their own, so neither the
+    broadcast path nor the flush loop waits on the database. Only rooms that
+    are existing streams are accepted; a batch that violates a constraint is
+    split until the offending rows are isolated, and a batch that fails for
+    any other reason is retried, keeping at most `max_pending` rows.
+    """
+
+    def __init__(self, interval=0.05, max_batch=50, history_size=100,
+                 write_interval=1.0, max_write_batch=1000, max_pending=20000):
+        self.interval = interval
+        self.max_batch = max_batch
+        self.history_size = history_size
+        self.write_interval = write_interval
+        self.max_write_batch = max_write_batch
+        self.max_pending = max_pending
+        self.streams = set()
+        self.buffers = {}
+        self.history = {}
+        self.seeded = set()
+        self.pending_writes = []
+        self.last_write = time.monotonic()
+        self.lock = threading.Lock()
+        self.app = None
+
+    def stream_id(self, room):
+        # The stream id of a chat room, or None when the room is not an
+        # existing stream; known streams are remembered
+        try:
+            stream_id = int(room)
+        except (TypeError, ValueError):
+            return None
+        if str(stream_id) != str(room):
+            return None
+        if stream_id not in self.streams:
+            if StreamSession.query.get(stream_id) is None:
+                return None
+            self.streams.add(stream_id)
+        return stream_id
+
+    def publish(self, room, message, user_id=None):
+        # Returns False, buffering nothing, for a room that is not a stream
+        stream_id = self.stream_id(room)
+        if stream_id is None:
+            return False
+        room = str(stream_id)
+        created_at = datetime.utcnow()
+        message['time'] = created_at.isoformat()
+        with self.lock:
+            buffer = self.buffers.setdefault(room, [])
+            buffer.append(message)
+            full = len(buffer) >= self.max_batch
+            ring = self.history.get(room)
+            if ring is None:
+                ring = self.history[room] = deque(maxlen=self.history_size)
+            ring.append(message)
+            if user_id is not None:
+                self.pending_writes.append({
+                    'stream_id': stream_id,
+                    'user_id': user_id,
+                    'message': message['message'],
+                    'created_at': created_at
+                })
+            start = self.app is None
+            if start:
+                self.app = current_app._get_current_object()
+        if start:
+            socketio.start_background_task(self._run)
+            socketio.start_background_task(self._write_loop)
+        if full:
+            self.flush(room)
+        return True
+
+    def recent(self, room):
+        # The first replay of a room tops the ring up from the database with
+        # messages older than anything this process has seen
+        if room not in self.seeded:
+            with self.lock:
+                ring = list(self.history.get(room, ()))
+            missing = self.history_size - len(ring)
+            if missing > 0:
+                query = db.session.query(ChatMessage, User.username)\
+                    .join(User, User.id == ChatMessage.user_id)\
+                    .filter(ChatMessage.stream_id == int(room))
+                if ring:
+                    query = query.filter(ChatMessage.created_at < datetime.fromisoformat(ring[0]['time']))
+                rows = query.order_by(ChatMessage.created_at.desc(), ChatMessage.id.desc())\
+                    .limit(missing).all()
+                older = [serialize_message(row, username) for row, username in reversed(rows)]
+                with self.lock:
+                    current = self.history.get(room, ())
+                    self.history[room] = deque(older + list(current), maxlen=self.history_size)
+            self.seeded.add(room)
+        with self.lock:
+            return list(self.history.get(room, ()))
+
+    def write_pending(self):
+        with self.lock:
+            rows, self.pending_writes = self.pending_writes, []
+        if not rows:
+            return
+        try:
+            self._insert(rows)
+        except Exception:
+            # The database is unavailable, keep the rows for the next round
+            db.session.rollback()
+            current_app.logger.exception('Failed to persist %d chat messages, will retry', len(rows))
+            with self.lock:
+                self.pending_writes[:0] = rows
+                dropped = len(self.pending_writes) - self.max_pending
+                if dropped > 0:
+                    del self.pending_writes[:dropped]
+            if dropped > 0:
+                current_app.logger.error('Dropped the %d oldest unsaved chat messages', dropped)
+
+    def _insert(self, rows):
+        # Splits a batch that violates a constraint until the bad rows are
+        # isolated, so one bad row never costs the rest of the batch
+        try:
+            db.session.execute(insert(ChatMessage), rows)
+            db.session.commit()
+        except (DataError, IntegrityError):
+            db.session.rollback()
+            if len(rows) == 1:
+                current_app.logger.warning('Dropped chat message for stream %s: %s',
+                                           rows[0]['stream_id'], rows[0]['message'][:50])
+                return
+            middle = len(rows) // 2
+            self._insert(rows[:middle])
+            self._insert(rows[middle:])
+
+    def flush(self, room):
+        with self.lock:
+            messages = self.buffers.pop(room, None)
+        if messages:
+            socketio.emit('chat_message', {'messages': messages}, to=room)
+
+    def flush_all(self):
+        with self.lock:
+            rooms = list(self.buffers)
+        for room in rooms:
+            self.flush(room)
+
+    def _run(self):
+        while True:
+            socketio.sleep(self.interval)
+            try:
+                self.flush_all()
+            except Exception:
+                self.app.logger.exception('Failed to flush chat broadcasts')
+
+    def _write_loop(self):
+        while True:
+            socketio.sleep(self.interval)
+            if (len(self.pending_writes) >= self.max_write_batch
+                    or time.monotonic() - self.last_write >= self.write_interval):
+                self.last_write = time.monotonic()
+                with self.app.app_context():
+                    try:
+                        self.write_pending()
+                    except Exception:
+                        current_app.logger.exception('Chat write-behind failed')
+
+
+def serialize_message(row, username):
+    return {
+        'id': row.id,
+        'username': username,
+        'message': row.message,
+        'time': row.created_at.isoformat()
+    }
+
+
+def cursor_for(message):
+    if message.get('id'):
+        return f"{message['time']}|{message['id']}"
+    return message['time']
+
+
+def load_history(stream_id, before=None, limit=50):
+    # Keyset pagination on (created_at, id), newest first from the cursor.
+    # The cursor is "<iso time>" or "<iso time>|<id>" and never needs an
+    # OFFSET; a malformed cursor raises ValueError.
+    query = db.session.query(ChatMessage, User.username)\
+        .join(User, User.id == ChatMessage.user_id)\
+        .filter(ChatMessage.stream_id == stream_id)
+    if before:
+        created_at, _, message_id = before.partition('|')
+        created_at = datetime.fromisoformat(created_at)
+        if message_id:
+            query = query.filter(or_(
+                ChatMessage.created_at < created_at,
+                and_(ChatMessage.created_at == created_at, ChatMessage.id < int(message_id))
+            ))
+        else:
+            query = query.filter(ChatMessage.created_at < created_at)
+    rows = query.order_by(ChatMessage.created_at.desc(), ChatMessage.id.desc()).limit(limit).all()
+
+    messages = [serialize_message(row, username) for row, username in reversed(rows)]
+    next_cursor = cursor_for(messages[0]) if len(rows) == limit else None
+    return messages, next_cursor
+
+
+def get_session_username():
+    # Usernames are cached on the session at login, older sessions fall back
+    # to one lookup that is then kept for the rest of the connection
+    username = session.get('username')
+    if username is None and session.get('user_id'):
+        user = User.query.get(session['user_id'])
+        if user:
+            username = session['username'] = user.username
+    return username
+
+
+chat_broadcaster = ChatBroadcaster()
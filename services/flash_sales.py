@@ -0,0 +1,164 @@
+import bisect
+import heapq
+import threading
+import time
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import func, update
+
+from app import db, socketio
+from models import FlashSale
+
+
+class FlashSaleIndex:
+    """In-memory interval index of running flash sales, keyed by product.
+
+    Each product keeps its sales sorted by start time, so resolving the
+    effective price is a bisect plus a look at the few sales that have
+    started. A heap ordered by end time drives the scheduler, which evicts
+    sales as they end; every worker evicts, but only the one whose
+    conditional update marks the sale ended pushes `flash_sale_ended` to
+    the stream's room.
+    The index is loaded from the database on first use and reloaded every
+    `refresh_interval` seconds to pick up sales created by other workers,
+    so it only prices what is displayed; checkout_price() reads the sales
+    table in the order's transaction.
+    """
+
+    def __init__(self, tick=1.0, refresh_interval=30.0):
+        self.tick = tick
+        self.refresh_interval = refresh_interval
+        self.by_product = {}
+        self.ends = []
+        self.last_refresh = None
+        self.lock = threading.Lock()
+        self.app = None
+
+    def _insert(self, sale):
+        # Entries are (start_time, end_time, id, discount_percentage, stream_id)
+        entry = (sale.start_time, sale.end_time, sale.id, sale.discount_percentage, sale.stream_id)
+        entries = self.by_product.setdefault(sale.product_id, [])
+        if entry not in entries:
+            bisect.insort(entries, entry)
+            heapq.heappush(self.ends, (sale.end_time, sale.id, sale.product_id))
+
+    def add(self, sale):
+        self._ensure_loaded()
+        with self.lock:
+            self._insert(sale)
+
+    def refresh(self):
+        sales = FlashSale.query.filter(FlashSale.end_time > datetime.utcnow()).all()
+        with self.lock:
+            self.by_product = {}
+            self.ends = []
+            for sale in sales:
+                self._insert(sale)
+            self.last_refresh = time.monotonic()
+
+    def _ensure_loaded(self):
+        if self.last_refresh is None:
+            self.refresh()
+        with self.lock:
+            start = self.app is None
+            if start:
+                self.app = current_app._get_current_object()
+        if start:
+            socketio.start_background_task(self._run)
+
+    def active_sale(self, product_id, now=None):
+        # Returns (id, discount_percentage, end_time) of the best running sale
+        self._ensure_loaded()
+        now = now or datetime.utcnow()
+        with self.lock:
+            entries = self.by_product.get(product_id)
+            if not entries:
+                return None
+            started = bisect.bisect_right(entries, (now, datetime.max))
+            best = None
+            for _, end_time, sale_id, discount, _ in entries[:started]:
+                if end_time > now and (best is None or discount > best[1]):
+                    best = (sale_id, discount, end_time)
+            return best
+
+    def checkout_price(self, product, now=None):
+        # Orders are priced from the database: a sale another worker started
+        # or ended only reaches this index on the next refresh
+        now = now or datetime.utcnow()
+        discount = db.session.query(func.max(FlashSale.discount_percentage)).filter(
+            FlashSale.product_id == product.id,
+            FlashSale.start_time <= now,
+            FlashSale.end_time > now
+        ).scalar()
+        if discount is None:
+            return product.price
+        return discounted_price(product.price, discount)
+
+    def prices(self, products, now=None):
+        # {product_id: discounted price} for the products on sale right now
+        prices = {}
+        for product in products:
+            sale = self.active_sale(product.id, now)
+            if sale is not None:
+                prices[product.id] = discounted_price(product.price, sale[1])
+        return prices
+
+    def expire(self, now=None):
+        # Evict every sale whose end_time has passed, returns the evicted
+        # entries; the caller commits
+        now = now or datetime.utcnow()
+        ended = []
+        with self.lock:
+            while self.ends and self.ends[0][0] <= now:
+                _, sale_id, product_id = heapq.heappop(self.ends)
+                entries = self.by_product.get(product_id, [])
+                for entry in entries:
+                    if entry[2] == sale_id:
+                        entries.remove(entry)
+                        ended.append((product_id, entry))
+                        break
+                if not entries:
+                    self.by_product.pop(product_id, None)
+        if not ended:
+            return ended
+        announce = set(db.session.execute(
+            update(FlashSale)
+            .where(FlashSale.id.in_([entry[2] for _, entry in ended]),
+                   FlashSale.ended.is_(False))
+            .values(ended=True)
+            .returning(FlashSale.id)
+        ).scalars())
+        for product_id, (_, end_time, sale_id, _, stream_id) in ended:
+            if sale_id not in announce:
+                continue
+            socketio.emit('flash_sale_ended', {
+                'flash_sale_id': sale_id,
+                'product_id': product_id,
+                'end_time': end_time.isoformat()
+            }, to=str(stream_id))
+        return ended
+
+    def _run(self):
+        while True:
+            socketio.sleep(self.tick)
+            with self.app.app_context():
+                try:
+                    self.expire()
+                    db.session.commit()
+                except Exception:
+                    db.session.rollback()
+                    current_app.logger.exception('Failed to expire flash sales')
+                if time.monotonic() - self.last_refresh >= self.refresh_interval:
+                    try:
+                        self.refresh()
+                    except Exception:
+                        db.session.rollback()
+                        current_app.logger.exception('Failed to reload flash sales')
+
+
+def discounted_price(price, discount_percentage):
+    return round(price * (100 - discount_percentage) / 100, 2)
+
+
+flash_sales = FlashSaleIndex()
@@ -0,0 +1,79 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class FollowGraphCache:
+    """LRU cache of follower and followed id sets per user.
+
+    Sets are loaded on first use with one query, and follow/unfollow update
+    cached sets write-through, so "is following" and follower counts are set
+    lookups. Entries older than `ttl` seconds are reloaded so that writes made
+    by other workers show up eventually.
+    """
+
+    def __init__(self, load_followed, load_followers, capacity=10000, ttl=60):
+        self.loaders = {'followed': load_followed, 'followers': load_followers}
+        self.capacity = capacity
+        self.ttl = ttl
+        self.entries = {'followed': OrderedDict(), 'followers': OrderedDict()}
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def _get(self, kind, user_id):
+        entries = self.entries[kind]
+        with self.lock:
+            entry = entries.get(user_id)
+            if entry is not None and time.monotonic() - entry[0] < self.ttl:
+                entries.move_to_end(user_id)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        ids = set(self.loaders[kind](user_id))
+        with self.lock:
+            entries[user_id] = (time.monotonic(), ids)
+            entries.move_to_end(user_id)
+            while len(entries) > self.capacity:
+                entries.popitem(last=False)
+        return ids
+
+    def followed_ids(self, user_id):
+        return self._get('followed', user_id)
+
+    def follower_ids(self, user_id):
+        return self._get('followers', user_id)
+
+    def is_following(self, follower_id, followed_id):
+        return followed_id in self.followed_ids(follower_id)
+
+    def add(self, follower_id, followed_id):
+        # Only sets already cached are touched, others load fresh when needed
+        with self.lock:
+            entry = self.entries['followed'].get(follower_id)
+            if entry:
+                entry[1].add(followed_id)
+            entry = self.entries['followers'].get(followed_id)
+            if entry:
+                entry[1].add(follower_id)
+
+    def remove(self, follower_id, followed_id):
+        with self.lock:
+            entry = self.entries['followed'].get(follower_id)
+            if entry:
+                entry[1].discard(followed_id)
+            entry = self.entries['followers'].get(followed_id)
+            if entry:
+                entry[1].discard(follower_id)
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0,
+                'followed_sets': len(self.entries['followed']),
+                'follower_sets': len(self.entries['followers'])
+            }
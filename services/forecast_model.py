@@ -0,0 +1,71 @@
+# Revenue and order-volume model for the forecasting service. Only NumPy
+# here: these functions run in the forecast process pool, which should not
+# have to import the app to use them.
+import numpy as np
+
+TREND_HOURS = 24 * 28  # the trend coefficient is per four weeks
+FEATURES = 2 + 24 + 7  # intercept, trend, hour of day, day of week
+RIDGE = 1.0
+
+
+def epoch_hours(moments):
+    # datetimes -> int64 hours since 1970-01-01
+    return np.array(moments, dtype='datetime64[h]').astype(np.int64)
+
+
+def design(hours, origin):
+    # One row of features per epoch hour, built without a Python loop
+    hours = np.asarray(hours, dtype=np.int64)
+    rows = np.arange(len(hours))
+    features = np.zeros((len(hours), FEATURES))
+    features[:, 0] = 1.0
+    features[:, 1] = (hours - origin) / TREND_HOURS
+    features[rows, 2 + hours % 24] = 1.0
+    features[rows, 26 + (hours // 24 + 3) % 7] = 1.0  # 1970-01-01 was a Thursday
+    return features
+
+
+def new_state(origin):
+    # Normal equations of a ridge regression on (revenue, orders), so new
+    # hours are folded in without revisiting old ones
+    return {
+        'origin': origin,
+        'through': origin - 1,
+        'xtx': np.zeros((FEATURES, FEATURES)),
+        'xty': np.zeros((FEATURES, 2)),
+        'hours': 0,
+    }
+
+
+def fit(state, hours, totals, through, days=7):
+    """Fold the hours after state['through'] up to `through` into the model.
+
+    `hours` are the epoch hours in that span that had sales, with their
+    (revenue, orders) in `totals`; every other hour counts as zero. Returns
+    the new state and the predictions for the rest of the current day plus
+    the next `days` full days as {'hours', 'hourly', 'days', 'daily'}.
+    """
+    span = np.arange(state['through'] + 1, through + 1)
+    observed = np.zeros((len(span), 2))
+    if len(hours):
+        observed[np.asarray(hours, dtype=np.int64) - span[0]] = np.asarray(totals, dtype=float)
+    features = design(span, state['origin'])
+    state = {
+        'origin': state['origin'],
+        'through': through,
+        'xtx': state['xtx'] + features.T @ features,
+        'xty': state['xty'] + features.T @ observed,
+        'hours': state['hours'] + len(span),
+    }
+    coef = np.linalg.solve(state['xtx'] + RIDGE * np.eye(FEATURES), state['xty'])
+
+    first_day = (through + 1) // 24 + 1
+    future = np.arange(through + 1, (first_day + days) * 24)
+    predicted = np.clip(design(future, state['origin']) @ coef, 0.0, None)
+    daily = predicted[-days * 24:].reshape(days, 24, 2).sum(axis=1)
+    return state, {
+        'hours': future[:24].tolist(),
+        'hourly': predicted[:24].tolist(),
+        'days': list(range(first_day, first_day + days)),
+        'daily': daily.tolist(),
+    }
@@ -0,0 +1,178 @@
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from functools import partial
+
+from flask import current_app
+from sqlalchemy import func, select
+
+from app import db, socketio
+from models import SalesRollup
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def empty_forecast():
+    return {
+        'generated_at': datetime.utcnow(),
+        'history_hours': 0,
+        'next_hours': [],
+        'next_days': [],
+        'next_24h': {'revenue': 0.0, 'orders': 0},
+    }
+
+
+class ForecastService:
+    """Per-seller revenue and order forecasts, fitted off the request path.
+
+    Reading a forecast is a dict lookup: a seller's first request schedules
+    a fit and gets None until it lands, or an empty forecast straight away
+    if the seller has no sales yet. Fits run in a process pool on the
+    seller's hourly totals from the sales rollup. Each seller's model keeps
+    its normal equations, so a refit only folds in the hours completed since
+    the last one. Sellers asked about in the last `idle_after` seconds are
+    refitted every `refresh_interval` seconds. NumPy is only imported with
+    the first fit. Pool processes are spawned, not forked, since the app
+    process is threaded.
+
+    The pool and the cache are per process: with WORKERS=n every app worker
+    runs its own pool of `workers` processes and fits the sellers it is
+    asked about itself, so a seller served by several workers is fitted by
+    each of them and their forecasts may differ by up to `refresh_interval`.
+    """
+
+    def __init__(self, workers=2, refresh_interval=900.0, idle_after=86400.0):
+        self.workers = workers
+        self.refresh_interval = refresh_interval
+        self.idle_after = idle_after
+        self.forecasts = {}
+        self.states = {}
+        self.pending = set()
+        self.requested = {}
+        self.lock = threading.Lock()
+        self.pool = None
+        self.app = None
+
+    def forecast(self, seller_id):
+        # The cached forecast, or None while the first fit is running
+        with self.lock:
+            self.requested[seller_id] = time.monotonic()
+            cached = self.forecasts.get(seller_id)
+        if cached is None:
+            self.refresh(seller_id)
+            with self.lock:
+                cached = self.forecasts.get(seller_id)
+        self._start()
+        return cached
+
+    def refresh(self, seller_id, now=None):
+        # Schedules a refit with the hours completed since the last one;
+        # returns whether a fit was submitted
+        from services.forecast_model import epoch_hours, fit, new_state
+        with self.lock:
+            if seller_id in self.pending:
+                return False
+            self.pending.add(seller_id)
+            state = self.states.get(seller_id)
+        try:
+            current_hour = (now or datetime.utcnow()).replace(minute=0, second=0, microsecond=0)
+            through = int(epoch_hours([current_hour])[0]) - 1
+            if state is not None and state['through'] >= through:
+                self._done(seller_id)
+                return False
+
+            query = select(SalesRollup.hour,
+                           func.sum(SalesRollup.revenue),
+                           func.sum(SalesRollup.orders))\
+                .where(SalesRollup.seller_id == seller_id, SalesRollup.hour < current_hour)\
+                .group_by(SalesRollup.hour).order_by(SalesRollup.hour)
+            if state is not None:
+                query = query.where(SalesRollup.hour > EPOCH + timedelta(hours=state['through']))
+            rows = db.session.execute(query).all()
+            if state is None:
+                if not rows:
+                    # Nothing to fit yet, refreshes pick up the first sales
+                    with self.lock:
+                        self.forecasts[seller_id] = empty_forecast()
+                    self._done(seller_id)
+                    return False
+                state = new_state(int(epoch_hours([rows[0][0]])[0]))
+
+            hours = epoch_hours([row[0] for row in rows])
+            totals = [(row[1] or 0.0, row[2] or 0) for row in rows]
+            future = self._pool().submit(fit, state, hours, totals, through)
+        except Exception:
+            self._done(seller_id)
+            raise
+        future.add_done_callback(partial(self._fitted, seller_id))
+        return True
+
+    def _fitted(self, seller_id, future):
+        try:
+            state, predicted = future.result()
+        except Exception:
+            if self.app is not None:
+                self.app.logger.exception('Forecast fit failed for seller %s', seller_id)
+            self._done(seller_id)
+            return
+        forecast = {
+            'generated_at': datetime.utcnow(),
+            'history_hours': state['hours'],
+            'next_hours': [
+                {'hour': EPOCH + timedelta(hours=hour), 'revenue': revenue, 'orders': orders}
+                for hour, (revenue, orders) in zip(predicted['hours'], predicted['hourly'])
+            ],
+            'next_days': [
+                {'day': (EPOCH + timedelta(days=day)).date(), 'revenue': revenue, 'orders': orders}
+                for day, (revenue, orders) in zip(predicted['days'], predicted['daily'])
+            ],
+        }
+        forecast['next_24h'] = {
+            'revenue': sum(hour['revenue'] for hour in forecast['next_hours']),
+            'orders': sum(hour['orders'] for hour in forecast['next_hours']),
+        }
+        with self.lock:
+            self.states[seller_id] = state
+            self.forecasts[seller_id] = forecast
+            self.pending.discard(seller_id)
+
+    def _done(self, seller_id):
+        with self.lock:
+            self.pending.discard(seller_id)
+
+    def _pool(self):
+        with self.lock:
+            if self.pool is None:
+                self.pool = ProcessPoolExecutor(max_workers=self.workers,
+                                                mp_context=multiprocessing.get_context('spawn'))
+            return self.pool
+
+    def _start(self):
+        with self.lock:
+            start = self.app is None
+            if start:
+                self.app = current_app._get_current_object()
+        if start:
+            socketio.start_background_task(self._run)
+
+    def _run(self):
+        while True:
+            socketio.sleep(self.refresh_interval)
+            cutoff = time.monotonic() - self.idle_after
+            with self.lock:
+                sellers = [seller for seller, seen in self.requested.items() if seen >= cutoff]
+                for seller in [seller for seller, seen in self.requested.items() if seen < cutoff]:
+                    del self.requested[seller]
+                    self.forecasts.pop(seller, None)
+                    self.states.pop(seller, None)
+            with self.app.app_context():
+                for seller_id in sellers:
+                    try:
+                        self.refresh(seller_id)
+                    except Exception:
+                        current_app.logger.exception('Failed to refresh forecast for seller %s', seller_id)
+
+
+forecasting = ForecastService()
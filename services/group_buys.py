@@ -0,0 +1,128 @@
+import threading
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import insert, update
+from sqlalchemy.exc import IntegrityError
+
+from app import db, socketio
+from models import GroupBuying, GroupBuyingParticipant, Message, Product
+
+JOINED = 'joined'
+ALREADY_JOINED = 'already_joined'
+CLOSED = 'closed'
+
+
+class GroupBuySweeper:
+    """Atomic group-buy joins plus a batched background sweeper.
+
+    A join is a conditional increment that only succeeds while the group is
+    active, unexpired and below its target, followed by the participant
+    insert; the unique (group_buying_id, user_id) constraint rejects repeat
+    joins and rolls the increment back with it. Every `interval` seconds the
+    sweeper completes full groups and expires stale ones with one UPDATE
+    each, then messages every participant of the groups it closed. A worker
+    starts its sweeper the first time it creates or joins a group buy.
+    """
+
+    def __init__(self, interval=30.0):
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.app = None
+
+    def join(self, group_id, user_id):
+        # Returns JOINED, ALREADY_JOINED or CLOSED; commits or rolls back
+        self.start()
+        joined = db.session.execute(
+            update(GroupBuying)
+            .where(GroupBuying.id == group_id,
+                   GroupBuying.status == 'active',
+                   GroupBuying.expires_at > datetime.utcnow(),
+                   GroupBuying.current_buyers < GroupBuying.min_buyers)
+            .values(current_buyers=GroupBuying.current_buyers + 1)
+            .returning(GroupBuying.id)
+        ).first()
+        if joined is None:
+            db.session.rollback()
+            return CLOSED
+        try:
+            db.session.add(GroupBuyingParticipant(group_buying_id=group_id, user_id=user_id))
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            return ALREADY_JOINED
+        return JOINED
+
+    def sweep(self, now=None):
+        # Returns {'completed': [ids], 'expired': [ids]}
+        now = now or datetime.utcnow()
+        completed = db.session.execute(
+            update(GroupBuying)
+            .where(GroupBuying.status == 'active',
+                   GroupBuying.current_buyers >= GroupBuying.min_buyers)
+            .values(status='completed')
+            .returning(GroupBuying.id)
+        ).scalars().all()
+        expired = db.session.execute(
+            update(GroupBuying)
+            .where(GroupBuying.status == 'active',
+                   GroupBuying.expires_at <= now)
+            .values(status='expired')
+            .returning(GroupBuying.id)
+        ).scalars().all()
+        if completed or expired:
+            self._notify(completed, expired, now)
+        return {'completed': completed, 'expired': expired}
+
+    def _notify(self, completed, expired, now):
+        # One query for every participant of the closed groups, one bulk insert
+        outcome = dict.fromkeys(completed, 'completed')
+        outcome.update(dict.fromkeys(expired, 'expired'))
+        rows = db.session.query(
+                GroupBuyingParticipant.user_id,
+                GroupBuying.id,
+                GroupBuying.target_price,
+                Product.name,
+                Product.seller_id)\
+            .join(GroupBuying, GroupBuying.id == GroupBuyingParticipant.group_buying_id)\
+            .join(Product, Product.id == GroupBuying.product_id)\
+            .filter(GroupBuying.id.in_(outcome))\
+            .all()
+        messages = []
+        for user_id, group_id, target_price, product_name, seller_id in rows:
+            if outcome[group_id] == 'completed':
+                content = f'The group buy for {product_name} reached its target. Your price is ${target_price:.2f}.'
+            else:
+                content = f'The group buy for {product_name} expired before reaching its target.'
+            messages.append({
+                'sender_id': seller_id,
+                'receiver_id': user_id,
+                'content': content,
+                'created_at': now
+            })
+        if messages:
+            db.session.execute(insert(Message), messages)
+
+    def start(self):
+        if self.app is not None:
+            return
+        with self.lock:
+            start = self.app is None
+            if start:
+                self.app = current_app._get_current_object()
+        if start:
+            socketio.start_background_task(self._run)
+
+    def _run(self):
+        while True:
+            with self.app.app_context():
+                try:
+                    self.sweep()
+                    db.session.commit()
+                except Exception:
+                    db.session.rollback()
+                    current_app.logger.exception('Failed to sweep group buys')
+            socketio.sleep(self.interval)
+
+
+group_buys = GroupBuySweeper()
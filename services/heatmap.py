@@ -0,0 +1,170 @@
+import base64
+import threading
+
+# Action codes stored in the action column
+ACTIONS = ('view', 'wishlist', 'order', 'chat', 'vote')
+ACTION_CODES = {action: code for code, action in enumerate(ACTIONS)}
+# Product ids are stored as int32; OTHER_PRODUCT collects the products past
+# the `max_products` most active ones in a heatmap
+MAX_PRODUCT_ID = 2 ** 31 - 1
+OTHER_PRODUCT = -1
+
+
+class _LazyNumPy:
+    # Stands in for the numpy module until first used, then replaces itself
+    def __getattr__(self, name):
+        global np
+        import numpy
+        np = numpy
+        return getattr(numpy, name)
+
+
+np = _LazyNumPy()
+
+
+def valid_action(action, product_id=None):
+    return action in ACTION_CODES and (
+        product_id is None or (type(product_id) is int and 0 < product_id <= MAX_PRODUCT_ID)
+    )
+
+
+class ActionLog:
+    """Viewer actions of one stream, kept as typed NumPy columns.
+
+    Each action is a uint32 offset in seconds from the stream's first
+    action, a uint8 action code and an int32 product id (0 for actions on no
+    product): 9 bytes, in arrays that double up to `capacity` rows and then
+    wrap, overwriting the oldest actions. The heatmap counts actions per
+    `bucket_seconds` time bucket and (product, action) column with one
+    np.histogram2d over the live rows, cached until the next append; only
+    the `max_products` most active products get columns of their own. The
+    columns, and NumPy with them, are only allocated by the first action.
+    """
+
+    def __init__(self, capacity=50000, bucket_seconds=60, initial=256, max_products=100):
+        self.capacity = capacity
+        self.bucket_seconds = bucket_seconds
+        self.max_products = max_products
+        self.initial = min(initial, capacity)
+        self.offsets = self.actions = self.products = None
+        self.origin = None
+        self.count = 0  # actions appended so far, including overwritten ones
+        self.cached = None
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def append(self, timestamp, action, product_id=None):
+        if not valid_action(action, product_id):
+            raise ValueError(f'Invalid action {action!r} on product {product_id!r}')
+        with self.lock:
+            if self.offsets is None:
+                self.offsets = np.zeros(self.initial, dtype=np.uint32)
+                self.actions = np.zeros(self.initial, dtype=np.uint8)
+                self.products = np.zeros(self.initial, dtype=np.int32)
+            if self.origin is None:
+                self.origin = int(timestamp)
+            if self.count == len(self.offsets) and self.count < self.capacity:
+                size = min(self.count * 2, self.capacity)
+                self.offsets = np.resize(self.offsets, size)
+                self.actions = np.resize(self.actions, size)
+                self.products = np.resize(self.products, size)
+            position = self.count % self.capacity
+            self.offsets[position] = max(0, int(timestamp) - self.origin)
+            self.actions[position] = ACTION_CODES[action]
+            self.products[position] = product_id or 0
+            self.count += 1
+
+    def heatmap(self, since=0):
+        """Counts per time bucket and (product, action) column, column-major.
+
+        Only buckets from `since` on are returned, so a live dashboard can
+        poll with the `end` of its previous response and merge the result.
+        The last bucket is usually still filling and comes back again.
+        Product id -1 (OTHER_PRODUCT) sums the products past the
+        `max_products` most active ones in those buckets.
+        """
+        with self.lock:
+            if self.cached is not None and self.cached[0] == (self.count, since):
+                return self.cached[1]
+            live = len(self)
+            if live:
+                buckets = self.offsets[:live] // self.bucket_seconds
+                products = self.products[:live].astype(np.int64)
+                actions = self.actions[:live]
+            version = self.count
+
+        heatmap = {
+            'version': version,
+            'origin': self.origin,
+            'bucket_seconds': self.bucket_seconds,
+            'start': int(since),
+            'end': int(since),
+            'actions': [],
+            'product_ids': [],
+            'counts': [],
+        }
+        if live:
+            recent = buckets >= since
+            live = recent.any()
+        if live:
+            buckets, products, actions = buckets[recent], products[recent], actions[recent]
+            ids, totals = np.unique(products[products != 0], return_counts=True)
+            if len(ids) > self.max_products:
+                top = ids[np.argpartition(totals, -self.max_products)[-self.max_products:]]
+                products[(products != 0) & ~np.isin(products, top)] = OTHER_PRODUCT
+            keys = products * len(ACTIONS) + actions
+            columns, column_index = np.unique(keys, return_inverse=True)
+            start, end = int(buckets.min()), int(buckets.max())
+            counts, _, _ = np.histogram2d(
+                buckets, column_index,
+                bins=[np.arange(start, end + 2), np.arange(len(columns) + 1)]
+            )
+            heatmap.update({
+                'start': start,
+                'end': end,
+                'actions': [ACTIONS[code] for code in (columns % len(ACTIONS)).tolist()],
+                'product_ids': [product or None for product in (columns // len(ACTIONS)).tolist()],
+                'counts': counts.T.astype(np.int64).tolist(),
+            })
+        with self.lock:
+            self.cached = ((version, since), heatmap)
+        return heatmap
+
+    def export(self):
+        # JSON-safe copy of the live rows, oldest first, for snapshots
+        with self.lock:
+            live = len(self)
+            if not live:
+                return {'origin': self.origin, 'offsets': '', 'actions': '', 'products': ''}
+            oldest = self.count % self.capacity if self.count > self.capacity else 0
+            return {
+                'origin': self.origin,
+                **{
+                    name: base64.b64encode(np.roll(column[:live], -oldest).tobytes()).decode()
+                    for name, column in (('offsets', self.offsets), ('actions', self.actions),
+                                         ('products', self.products))
+                }
+            }
+
+    def restore(self, state):
+        if not state['offsets']:
+            with self.lock:
+                self.origin = state['origin']
+                self.count = 0
+                self.offsets = self.actions = self.products = None
+                self.cached = None
+            return
+        columns = {
+            name: np.frombuffer(base64.b64decode(state[name]), dtype=dtype)[-self.capacity:]
+            for name, dtype in (('offsets', np.uint32), ('actions', np.uint8), ('products', np.int32))
+        }
+        with self.lock:
+            self.origin = state['origin']
+            self.count = len(columns['offsets'])
+            # Copies at their exact size, the next append grows them again
+            self.offsets = np.array(columns['offsets'])
+            self.actions = np.array(columns['actions'])
+            self.products = np.array(columns['products'])
+            self.cached = None
@@ -0,0 +1,221 @@
+import random
+import threading
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import func, select, update
+
+from app import db, socketio
+from models import Product, ProductStockShard, StockReservation
+
+
+class InventoryService:
+    """Oversell-proof stock reservations.
+
+    Stock is only ever taken with a conditional decrement
+    (`UPDATE ... SET stock = stock - :q WHERE stock >= :q RETURNING`), so
+    concurrent checkouts can never drive it negative. A reservation holds the
+    stock for `hold_seconds`; confirming it turns it into a sale, and held
+    reservations that run out are swept back into stock.
+
+    Hot products can be split into `ProductStockShard` sub-counters. A
+    checkout then decrements one shard picked at random, so concurrent buyers
+    lock different rows instead of queueing on the product row.
+    """
+
+    def __init__(self, hold_seconds=600, sweep_interval=5.0):
+        self.hold_seconds = hold_seconds
+        self.sweep_interval = sweep_interval
+        self.lock = threading.Lock()
+        self.app = None
+
+    def _take(self, product_id, quantity):
+        # Returns (taken, shard)
+        remaining = db.session.execute(
+            update(Product)
+            .where(Product.id == product_id,
+                   Product.stock >= quantity,
+                   func.coalesce(Product.stock_shards, 0) == 0)
+            .values(stock=Product.stock - quantity)
+            .returning(Product.stock)
+        ).first()
+        if remaining is not None:
+            return True, None
+
+        shards = db.session.scalar(select(Product.stock_shards).where(Product.id == product_id))
+        if not shards:
+            return False, None
+
+        start = random.randrange(shards)
+        for offset in range(shards):
+            shard = (start + offset) % shards
+            remaining = db.session.execute(
+                update(ProductStockShard)
+                .where(ProductStockShard.product_id == product_id,
+                       ProductStockShard.shard == shard,
+                       ProductStockShard.stock >= quantity)
+                .values(stock=ProductStockShard.stock - quantity)
+                .returning(ProductStockShard.stock)
+            ).first()
+            if remaining is not None:
+                return True, shard
+
+        # No single shard is big enough: lock them all in order and drain
+        rows = ProductStockShard.query\
+            .filter_by(product_id=product_id)\
+            .order_by(ProductStockShard.shard)\
+            .with_for_update()\
+            .all()
+        if sum(row.stock for row in rows) < quantity:
+            return False, None
+        needed = quantity
+        for row in rows:
+            taken = min(row.stock, needed)
+            row.stock -= taken
+            needed -= taken
+            if not needed:
+                break
+        return True, None
+
+    def _restock(self, product_id, quantity, shard=None):
+        shards = db.session.scalar(select(Product.stock_shards).where(Product.id == product_id))
+        if shards:
+            shard = shard if shard is not None and shard < shards else random.randrange(shards)
+            db.session.execute(
+                update(ProductStockShard)
+                .where(ProductStockShard.product_id == product_id, ProductStockShard.shard == shard)
+                .values(stock=ProductStockShard.stock + quantity)
+            )
+        else:
+            db.session.execute(
+                update(Product)
+                .where(Product.id == product_id)
+                .values(stock=Product.stock + quantity)
+            )
+
+    def reserve(self, product_id, user_id, quantity, hold_seconds=None):
+        # Returns a held StockReservation, or None when stock ran out.
+        # The caller commits.
+        if quantity < 1:
+            return None
+        taken, shard = self._take(product_id, quantity)
+        if not taken:
+            return None
+        if hold_seconds is None:
+            hold_seconds = self.hold_seconds
+        reservation = StockReservation(
+            product_id=product_id,
+            user_id=user_id,
+            quantity=quantity,
+            shard=shard,
+            status='held',
+            expires_at=datetime.utcnow() + timedelta(seconds=hold_seconds)
+        )
+        db.session.add(reservation)
+        db.session.flush()
+        self._start_sweeper()
+        return reservation
+
+    def confirm(self, reservation_id, user_id):
+        # Held -> committed, only if it is the buyer's and has not expired
+        row = db.session.execute(
+            update(StockReservation)
+            .where(StockReservation.id == reservation_id,
+                   StockReservation.user_id == user_id,
+                   StockReservation.status == 'held',
+                   StockReservation.expires_at > datetime.utcnow())
+            .values(status='committed')
+            .returning(StockReservation.product_id, StockReservation.quantity)
+        ).first()
+        return row
+
+    def release(self, reservation_id, user_id=None):
+        conditions = [StockReservation.id == reservation_id, StockReservation.status == 'held']
+        if user_id is not None:
+            conditions.append(StockReservation.user_id == user_id)
+        row = db.session.execute(
+            update(StockReservation)
+            .where(*conditions)
+            .values(status='released')
+            .returning(StockReservation.product_id, StockReservation.quantity, StockReservation.shard)
+        ).first()
+        if row is None:
+            return False
+        self._restock(*row)
+        return True
+
+    def expire_stale(self, now=None):
+        # Flip every overdue hold to expired and give its stock back; the
+        # status check in the UPDATE makes each hold return stock only once
+        rows = db.session.execute(
+            update(StockReservation)
+            .where(StockReservation.status == 'held',
+                   StockReservation.expires_at <= (now or datetime.utcnow()))
+            .values(status='expired')
+            .returning(StockReservation.product_id, StockReservation.quantity, StockReservation.shard)
+        ).all()
+        returned = {}
+        for product_id, quantity, shard in rows:
+            key = (product_id, shard)
+            returned[key] = returned.get(key, 0) + quantity
+        for (product_id, shard), quantity in returned.items():
+            self._restock(product_id, quantity, shard)
+        return len(rows)
+
+    def available(self, product_ids):
+        # {product_id: sellable stock}, shard totals included
+        shard_totals = select(ProductStockShard.product_id, func.sum(ProductStockShard.stock).label('stock'))\
+            .where(ProductStockShard.product_id.in_(product_ids))\
+            .group_by(ProductStockShard.product_id)\
+            .subquery()
+        rows = db.session.execute(
+            select(Product.id, Product.stock + func.coalesce(shard_totals.c.stock, 0))
+            .outerjoin(shard_totals, shard_totals.c.product_id == Product.id)
+            .where(Product.id.in_(product_ids))
+        )
+        return {product_id: stock for product_id, stock in rows}
+
+    def shard(self, product_id, shards):
+        # Spread the product's stock evenly over `shards` sub-counters
+        self.unshard(product_id)
+        product = Product.query.filter_by(id=product_id).with_for_update().one()
+        total = product.stock or 0
+        for index in range(shards):
+            db.session.add(ProductStockShard(
+                product_id=product_id,
+                shard=index,
+                stock=total // shards + (1 if index < total % shards else 0)
+            ))
+        product.stock = 0
+        product.stock_shards = shards
+
+    def unshard(self, product_id):
+        product = Product.query.filter_by(id=product_id).with_for_update().one()
+        rows = ProductStockShard.query.filter_by(product_id=product_id).with_for_update().all()
+        product.stock = (product.stock or 0) + sum(row.stock for row in rows)
+        product.stock_shards = 0
+        for row in rows:
+            db.session.delete(row)
+        db.session.flush()
+
+    def _start_sweeper(self):
+        with self.lock:
+            start = self.app is None
+            if start:
+                self.app = current_app._get_current_object()
+        if start:
+            socketio.start_background_task(self._run)
+
+    def _run(self):
+        while True:
+            socketio.sleep(self.sweep_interval)
+            with self.app.app_context():
+                try:
+                    self.expire_stale()
+                    db.session.commit()
+                except Exception:
+                    db.session.rollback()
+                    current_app.logger.exception('Failed to expire stock reservations')
+
+
+inventory = InventoryService()
@@ -0,0 +1,83 @@
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import insert, update
+
+from app import db
+from models import Badge, BadgeRule, PointsLedgerEntry, User
+
+
+class LoyaltyLedger:
+    """Loyalty points as an append-only ledger plus rule-driven badges.
+
+    Every award appends PointsLedgerEntry rows and bumps the cached
+    User.loyalty_points balance with one UPDATE ... RETURNING. Badge rules
+    come from the badge_rule table, seeded with the defaults when it is
+    created and cached for `rules_ttl` seconds; the awarded users' earned
+    badges are loaded in one query and checked against every rule in memory.
+    Awards to many users at once, e.g. every viewer of a stream, are three
+    statements in the caller's transaction however many users there are.
+    """
+
+    def __init__(self, rules_ttl=300.0):
+        self.rules_ttl = rules_ttl
+        self.cached_rules = None
+        self.rules_loaded = None
+        self.lock = threading.Lock()
+
+    def rules(self):
+        # [(name, description, min_points)] of the active rules
+        with self.lock:
+            if self.cached_rules is not None and time.monotonic() - self.rules_loaded < self.rules_ttl:
+                return self.cached_rules
+        rows = BadgeRule.query.filter_by(active=True).order_by(BadgeRule.min_points).all()
+        rules = [(rule.name, rule.description, rule.min_points) for rule in rows]
+        with self.lock:
+            self.cached_rules = rules
+            self.rules_loaded = time.monotonic()
+        return rules
+
+    def award(self, user, points, reason, reference_id=None):
+        # Returns the badges the user newly earned; the caller commits
+        return self.award_many([user.id], points, reason, reference_id).get(user.id, [])
+
+    def award_many(self, user_ids, points, reason, reference_id=None):
+        # Returns {user_id: [new Badge, ...]}; the caller commits
+        user_ids = sorted(set(user_ids))
+        if not user_ids:
+            return {}
+        now = datetime.utcnow()
+        db.session.execute(insert(PointsLedgerEntry), [
+            {'user_id': user_id, 'points': points, 'reason': reason,
+             'reference_id': reference_id, 'created_at': now}
+            for user_id in user_ids
+        ])
+        balances = dict(db.session.execute(
+            update(User)
+            .where(User.id.in_(user_ids))
+            .values(loyalty_points=User.loyalty_points + points)
+            .returning(User.id, User.loyalty_points)
+        ).all())
+        return self.evaluate(balances)
+
+    def evaluate(self, balances):
+        # Award every rule a balance now meets that its user does not hold yet
+        rules = self.rules()
+        if not rules or not balances:
+            return {}
+        earned = set(db.session.query(Badge.user_id, Badge.name)
+                     .filter(Badge.user_id.in_(balances),
+                             Badge.name.in_([name for name, _, _ in rules])))
+        new_badges = {}
+        for user_id, balance in balances.items():
+            for name, description, min_points in rules:
+                if (balance or 0) >= min_points and (user_id, name) not in earned:
+                    badge = Badge(user_id=user_id, name=name, description=description)
+                    new_badges.setdefault(user_id, []).append(badge)
+        if new_badges:
+            db.session.add_all([badge for badges in new_badges.values() for badge in badges])
+        return new_badges
+
+
+loyalty = LoyaltyLedger()
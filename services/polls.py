@@ -0,0 +1,209 @@
+import threading
+import time
+
+from flask import current_app
+
+from app import db, socketio
+from models import Poll
+
+
+class PollTallyEngine:
+    """In-memory poll counters with periodic write-behind to the Poll row.
+
+    Votes only touch a per-poll counter and voter map under a lock. A
+    background task pushes at most one poll_updated per poll every
+    `push_interval` seconds and merges the pending voters into the database
+    every `flush_interval` seconds, so a poll costs a handful of writes no
+    matter how many viewers vote. The stored voter map is authoritative:
+    every worker's counts are rebuilt from it on flush. Tallies are dropped
+    when their poll closes, when its stream ends or after `idle_after`
+    seconds without a vote, and reloaded from the row if needed again.
+    """
+
+    def __init__(self, push_interval=0.5, flush_interval=2.0, idle_after=900.0):
+        self.push_interval = push_interval
+        self.flush_interval = flush_interval
+        self.idle_after = idle_after
+        self.tallies = {}
+        self.lock = threading.Lock()
+        self.app = None
+        self.last_flush = time.monotonic()
+
+    def _load(self, poll_id):
+        poll = Poll.query.get(poll_id)
+        if poll is None:
+            return None
+        return {
+            'room': str(poll.stream_id),
+            'options': list(poll.options),
+            'status': poll.status,
+            'votes': dict(poll.votes or {}),
+            'voters': {int(k): v for k, v in (poll.voters or {}).items()},
+            'pending_voters': {},
+            'changed': False,
+            'used': time.monotonic(),
+        }
+
+    def get(self, poll_id):
+        tally = self.tallies.get(poll_id)
+        if tally is None:
+            loaded = self._load(poll_id)
+            if loaded is None:
+                return None
+            with self.lock:
+                tally = self.tallies.setdefault(poll_id, loaded)
+        return tally
+
+    def vote(self, poll_id, user_id, option):
+        self._ensure_started()
+        tally = self.get(poll_id)
+        if tally is None:
+            return False
+        with self.lock:
+            if tally['status'] != 'active' or option not in tally['options']:
+                return False
+            if user_id in tally['voters']:
+                return False
+            tally['votes'][option] = tally['votes'].get(option, 0) + 1
+            tally['voters'][user_id] = option
+            tally['pending_voters'][user_id] = option
+            tally['changed'] = True
+            tally['used'] = time.monotonic()
+        return True
+
+    def snapshot(self, poll_id):
+        tally = self.tallies.get(poll_id)
+        if tally is None:
+            return None
+        with self.lock:
+            votes = dict(tally['votes'])
+        return {
+            'poll_id': poll_id,
+            'votes': votes,
+            'total_votes': sum(votes.values()),
+            'timestamp': int(time.time() * 1000)
+        }
+
+    def flush(self, poll_id, close=False):
+        tally = self.tallies.get(poll_id)
+        pending = {}
+        if tally is not None:
+            with self.lock:
+                pending, tally['pending_voters'] = tally['pending_voters'], {}
+        if not pending and not close:
+            return
+
+        # Merge under a row lock against the stored voters, so a user who
+        # already voted through another worker is not counted twice
+        try:
+            poll = Poll.query.filter_by(id=poll_id).with_for_update().first()
+            if poll is None:
+                db.session.rollback()
+                with self.lock:
+                    self.tallies.pop(poll_id, None)
+                return
+            votes = dict(poll.votes or {})
+            voters = dict(poll.voters or {})
+            if poll.status == 'active':
+                for user_id, option in pending.items():
+                    if str(user_id) not in voters and option in poll.options:
+                        voters[str(user_id)] = option
+                        votes[option] = votes.get(option, 0) + 1
+            if close:
+                poll.status = 'closed'
+            status = poll.status
+            poll.votes = votes
+            poll.voters = voters
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            if tally is not None:
+                with self.lock:
+                    for user_id, option in pending.items():
+                        tally['pending_voters'].setdefault(user_id, option)
+            raise
+
+        if tally is None:
+            return
+        with self.lock:
+            counted = tally['votes']
+            tally['status'] = status
+            tally['votes'] = dict(votes)
+            tally['voters'] = {int(k): v for k, v in voters.items()}
+            for user_id, option in list(tally['pending_voters'].items()):
+                if str(user_id) in voters:
+                    del tally['pending_voters'][user_id]
+                    continue
+                tally['votes'][option] = tally['votes'].get(option, 0) + 1
+                tally['voters'][user_id] = option
+            if tally['votes'] != counted:
+                tally['changed'] = True
+
+    def close(self, poll_id):
+        # Stops local voting, then writes the last votes and the closed
+        # status in one transaction; a vote arriving after the tally is
+        # dropped reloads the poll as closed
+        tally = self.tallies.get(poll_id)
+        if tally is not None:
+            with self.lock:
+                tally['status'] = 'closed'
+        try:
+            self.flush(poll_id, close=True)
+        finally:
+            with self.lock:
+                self.tallies.pop(poll_id, None)
+
+    def drop_stream(self, room):
+        # Writes the pending votes of an ended stream's polls, then forgets them
+        with self.lock:
+            poll_ids = [poll_id for poll_id, tally in self.tallies.items() if tally['room'] == room]
+        for poll_id in poll_ids:
+            try:
+                self.flush(poll_id)
+            finally:
+                with self.lock:
+                    self.tallies.pop(poll_id, None)
+
+    def _evict_idle(self):
+        now = time.monotonic()
+        with self.lock:
+            for poll_id, tally in list(self.tallies.items()):
+                if now - tally['used'] >= self.idle_after and not tally['pending_voters'] and not tally['changed']:
+                    del self.tallies[poll_id]
+
+    def _ensure_started(self):
+        with self.lock:
+            if self.app is not None:
+                return
+            self.app = current_app._get_current_object()
+        socketio.start_background_task(self._run)
+
+    def _run(self):
+        while True:
+            socketio.sleep(self.push_interval)
+            try:
+                self._push()
+            except Exception:
+                self.app.logger.exception('Poll tally push failed')
+
+            if time.monotonic() - self.last_flush >= self.flush_interval:
+                self.last_flush = time.monotonic()
+                with self.app.app_context():
+                    for poll_id in list(self.tallies):
+                        try:
+                            self.flush(poll_id)
+                        except Exception:
+                            current_app.logger.exception('Poll tally flush failed for %s', poll_id)
+                self._evict_idle()
+
+    def _push(self):
+        with self.lock:
+            changed = [(poll_id, tally['room']) for poll_id, tally in self.tallies.items() if tally['changed']]
+            for poll_id, room in changed:
+                self.tallies[poll_id]['changed'] = False
+        for poll_id, room in changed:
+            snapshot = self.snapshot(poll_id)
+            if snapshot:
+                socketio.emit('poll_updated', snapshot, to=room)
+
+poll_tally = PollTallyEngine()
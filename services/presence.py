@@ -0,0 +1,102 @@
+import threading
+import time
+
+
+class PresenceTracker:
+    """Last-seen tracking per (room, user) with a hashed timing wheel.
+
+    A viewer is scheduled into the wheel slot of its deadline once. Heartbeats
+    only move the deadline forward; when the old slot comes round the entry is
+    re-filed under its new deadline, or expired if it has passed. Touching and
+    expiring are O(1) amortised however many viewers are connected.
+    """
+
+    def __init__(self, timeout=90, tick=1.0, slots=128):
+        self.timeout = timeout
+        self.tick = tick
+        self.slots = slots
+        self.wheel = [set() for _ in range(slots)]
+        self.entries = {}
+        self.sid_keys = {}
+        self.room_viewers = {}
+        self.current = int(time.monotonic() // tick)
+        self.lock = threading.Lock()
+
+    def _schedule(self, key, deadline):
+        self.wheel[deadline % self.slots].add(key)
+
+    def touch(self, room, user_id, sid=None):
+        # Returns True when the viewer was not being tracked yet
+        key = (room, user_id)
+        deadline = int((time.monotonic() + self.timeout) // self.tick)
+        with self.lock:
+            entry = self.entries.get(key)
+            is_new = entry is None
+            if is_new:
+                entry = self.entries[key] = {'sids': set()}
+                self.room_viewers[room] = self.room_viewers.get(room, 0) + 1
+                self._schedule(key, deadline)
+            entry['deadline'] = deadline
+            entry['last_seen'] = time.time()
+            if sid:
+                entry['sids'].add(sid)
+                self.sid_keys.setdefault(sid, set()).add(key)
+        return is_new
+
+    def _drop(self, key):
+        entry = self.entries.pop(key)
+        self.room_viewers[key[0]] -= 1
+        if not self.room_viewers[key[0]]:
+            del self.room_viewers[key[0]]
+        for sid in entry['sids']:
+            keys = self.sid_keys.get(sid)
+            if keys:
+                keys.discard(key)
+                if not keys:
+                    del self.sid_keys[sid]
+        return entry
+
+    def rooms(self):
+        # Rooms with at least one viewer tracked by this worker
+        with self.lock:
+            return set(self.room_viewers)
+
+    def remove(self, room, user_id):
+        # Stale wheel slots are skipped when they come round
+        with self.lock:
+            if (room, user_id) in self.entries:
+                self._drop((room, user_id))
+
+    def disconnect(self, sid):
+        # Returns (room, user_id, last_seen) for viewers left with no connection
+        gone = []
+        with self.lock:
+            for key in self.sid_keys.pop(sid, ()):
+                entry = self.entries.get(key)
+                if entry is None:
+                    continue
+                entry['sids'].discard(sid)
+                if not entry['sids']:
+                    self._drop(key)
+                    gone.append((*key, entry['last_seen']))
+        return gone
+
+    def advance(self, now=None):
+        # Returns (room, user_id, last_seen) for every viewer that timed out
+        target = int((now if now is not None else time.monotonic()) // self.tick)
+        expired = []
+        with self.lock:
+            while self.current < target:
+                self.current += 1
+                index = self.current % self.slots
+                bucket, self.wheel[index] = self.wheel[index], set()
+                for key in bucket:
+                    entry = self.entries.get(key)
+                    if entry is None:
+                        continue
+                    if entry['deadline'] <= self.current:
+                        self._drop(key)
+                        expired.append((*key, entry['last_seen']))
+                    else:
+                        self._schedule(key, entry['deadline'])
+        return expired
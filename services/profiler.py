@@ -0,0 +1,177 @@
+import json
+import re
+import threading
+import time
+from collections import Counter, OrderedDict, deque
+
+from flask import appcontext_pushed, current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Statement shapes ignore literal values and how many items an IN list holds
+PLACEHOLDER = re.compile(r"%\(\w+\)s|%s|\?|'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+PLACEHOLDER_LIST = re.compile(r'\?(?:\s*,\s*\?)+')
+
+
+def statement_shape(statement):
+    return PLACEHOLDER_LIST.sub('?', PLACEHOLDER.sub('?', ' '.join(statement.split())))
+
+
+class QueryProfile:
+    def __init__(self, started):
+        self.started = started
+        self.queries = 0
+        self.db_time = 0.0
+        self.shapes = Counter()
+        self.query_started = None
+
+
+class QueryProfiler:
+    """Query count, database time and repeated statement shapes per handler.
+
+    Every HTTP request and Socket.IO event is one profile, collected from
+    SQLAlchemy cursor events and closed when its request context tears
+    down. A handler is flagged when it runs more than `max_queries`
+    statements, spends more than `max_db_ms` in the database, or repeats one
+    statement shape `repeat_threshold` times or more, which is how an N+1
+    loop looks from here. Flagged profiles are logged as one JSON line at
+    WARNING, the others only when `log_all` is set. Per-handler totals,
+    keyed by route rule or Socket.IO event so the set stays bounded, and the
+    last `history` flagged profiles are kept for the debug endpoint.
+    """
+
+    def __init__(self, max_queries=30, max_db_ms=200.0, repeat_threshold=5, history=200, log_all=False):
+        self.max_queries = max_queries
+        self.max_db_ms = max_db_ms
+        self.repeat_threshold = repeat_threshold
+        self.log_all = log_all
+        self.handlers = OrderedDict()
+        self.flagged = deque(maxlen=history)
+        self.lock = threading.Lock()
+        self.listening = False
+
+    def init_app(self, app, log_all=None):
+        if log_all is not None:
+            self.log_all = log_all
+        with self.lock:
+            if not self.listening:
+                event.listen(Engine, 'before_cursor_execute', self._before_execute)
+                event.listen(Engine, 'after_cursor_execute', self._after_execute)
+                self.listening = True
+        appcontext_pushed.connect(self._context_pushed, app, weak=False)
+        app.teardown_request(self._finish)
+
+    def _context_pushed(self, app, **kwargs):
+        g.profile_started = time.perf_counter()
+
+    def _profile(self):
+        # Only request contexts (HTTP and Socket.IO) are profiled, not the
+        # app contexts background tasks push
+        if not has_request_context():
+            return None
+        profile = g.get('query_profile')
+        if profile is None:
+            profile = g.query_profile = QueryProfile(g.get('profile_started', time.perf_counter()))
+        return profile
+
+    def _before_execute(self, conn, cursor, statement, parameters, context, executemany):
+        profile = self._profile()
+        if profile is not None:
+            profile.query_started = time.perf_counter()
+
+    def _after_execute(self, conn, cursor, statement, parameters, context, executemany):
+        profile = self._profile()
+        if profile is not None and profile.query_started is not None:
+            profile.db_time += time.perf_counter() - profile.query_started
+            profile.query_started = None
+            profile.queries += 1
+            profile.shapes[statement_shape(statement)] += 1
+
+    def _finish(self, exc):
+        profile = g.pop('query_profile', None)
+        if profile is None:
+            return
+        socket_event = getattr(request, 'event', None)
+        if socket_event is not None:
+            # Only events with a registered handler get a request context
+            handler = f"socket {request.namespace} {socket_event['message']}"
+        elif request.url_rule is not None:
+            handler = f'{request.method} {request.url_rule.rule}'
+        else:
+            # 404s and 405s, whatever path or method the client sent
+            handler = '<unmatched>'
+        report = {
+            'handler': handler,
+            'queries': profile.queries,
+            'db_ms': round(profile.db_time * 1000, 2),
+            'total_ms': round((time.perf_counter() - profile.started) * 1000, 2),
+            'repeated': [
+                {'statement': shape, 'count': count}
+                for shape, count in profile.shapes.most_common()
+                if count >= self.repeat_threshold
+            ],
+        }
+        reasons = []
+        if profile.queries > self.max_queries:
+            reasons.append('queries')
+        if report['db_ms'] > self.max_db_ms:
+            reasons.append('db_time')
+        if report['repeated']:
+            reasons.append('repeated_statement')
+        report['flagged'] = reasons
+        self._record(report)
+
+        if reasons:
+            current_app.logger.warning(json.dumps({'event': 'query_profile', **report}))
+        elif self.log_all:
+            current_app.logger.info(json.dumps({'event': 'query_profile', **report}))
+
+    def _record(self, report):
+        with self.lock:
+            totals = self.handlers.get(report['handler'])
+            if totals is None:
+                totals = self.handlers[report['handler']] = {
+                    'calls': 0, 'queries': 0, 'db_ms': 0.0, 'max_queries': 0, 'max_db_ms': 0.0, 'flagged': 0
+                }
+            totals['calls'] += 1
+            totals['queries'] += report['queries']
+            totals['db_ms'] += report['db_ms']
+            totals['max_queries'] = max(totals['max_queries'], report['queries'])
+            totals['max_db_ms'] = max(totals['max_db_ms'], report['db_ms'])
+            if report['flagged']:
+                totals['flagged'] += 1
+                self.flagged.append(report)
+
+    def stats(self):
+        with self.lock:
+            handlers = [
+                {
+                    'handler': handler,
+                    'calls': totals['calls'],
+                    'avg_queries': round(totals['queries'] / totals['calls'], 2),
+                    'avg_db_ms': round(totals['db_ms'] / totals['calls'], 2),
+                    'max_queries': totals['max_queries'],
+                    'max_db_ms': totals['max_db_ms'],
+                    'flagged': totals['flagged'],
+                }
+                for handler, totals in self.handlers.items()
+            ]
+            flagged = list(self.flagged)
+        handlers.sort(key=lambda totals: totals['avg_queries'], reverse=True)
+        return {
+            'thresholds': {
+                'max_queries': self.max_queries,
+                'max_db_ms': self.max_db_ms,
+                'repeat_threshold': self.repeat_threshold,
+            },
+            'handlers': handlers,
+            'flagged': flagged[::-1],
+        }
+
+    def reset(self):
+        with self.lock:
+            self.handlers.clear()
+            self.flagged.clear()
+
+
+query_profiler = QueryProfiler()
@@ -0,0 +1,135 @@
+import heapq
+import threading
+import time
+from bisect import bisect_left, insort
+
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from models import Question, QuestionVote
+
+
+class QuestionLeaderboard:
+    """Per-stream question ranking kept in memory.
+
+    Each stream maps every question to a (-votes, -created_at, id) key and
+    keeps only the best `top_size` keys sorted. A vote only ever moves a
+    question up, so it costs at most one move inside that short list however
+    many questions the stream has; longer rankings are taken from all keys
+    when they are read. Votes are deduplicated by the unique (question_id,
+    user_id) row in question_vote and counted with an atomic UPDATE, so the
+    database stays authoritative when several workers share a stream. A
+    stream's board is dropped when the stream ends or after `idle_after`
+    seconds unused, and reloaded if it is needed again.
+    """
+
+    def __init__(self, top_size=50, idle_after=900.0):
+        self.top_size = top_size
+        self.idle_after = idle_after
+        self.streams = {}
+        self.last_used = {}
+        self.last_sweep = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _load(self, stream_id):
+        board = {'keys': {}, 'top': [], 'voted': set()}
+        rows = db.session.query(Question.id, Question.votes_count, Question.created_at)\
+            .filter(Question.stream_id == stream_id).all()
+        for question_id, votes, created_at in rows:
+            board['keys'][question_id] = (-(votes or 0), -created_at.timestamp(), question_id)
+        board['top'] = heapq.nsmallest(self.top_size, board['keys'].values())
+
+        if rows:
+            board['voted'] = set(db.session.query(QuestionVote.question_id, QuestionVote.user_id)
+                .join(Question, Question.id == QuestionVote.question_id)
+                .filter(Question.stream_id == stream_id).all())
+        return board
+
+    def get(self, stream_id):
+        now = time.monotonic()
+        self.last_used[stream_id] = now
+        if now - self.last_sweep >= self.idle_after:
+            self._evict_idle(now)
+        board = self.streams.get(stream_id)
+        if board is None:
+            loaded = self._load(stream_id)
+            with self.lock:
+                board = self.streams.setdefault(stream_id, loaded)
+        return board
+
+    def _evict_idle(self, now):
+        with self.lock:
+            self.last_sweep = now
+            for stream_id, used in list(self.last_used.items()):
+                if now - used >= self.idle_after:
+                    self.streams.pop(stream_id, None)
+                    del self.last_used[stream_id]
+
+    def drop(self, stream_id):
+        # Forgets an ended stream's board
+        with self.lock:
+            self.streams.pop(stream_id, None)
+            self.last_used.pop(stream_id, None)
+
+    def _place(self, board, question_id, votes, created_at):
+        # Returns the question's rank, or None when it is outside the top
+        key = (-votes, -created_at.timestamp(), question_id)
+        old = board['keys'].get(question_id)
+        board['keys'][question_id] = key
+        top = board['top']
+        if old is not None:
+            index = bisect_left(top, old)
+            if index < len(top) and top[index] == old:
+                del top[index]
+        if len(top) < self.top_size or key < top[-1]:
+            insort(top, key)
+            if len(top) > self.top_size:
+                top.pop()
+            return bisect_left(top, key)
+        return None
+
+    def add(self, question):
+        board = self.get(question.stream_id)
+        with self.lock:
+            self._place(board, question.id, question.votes_count or 0, question.created_at)
+
+    def top(self, stream_id, limit=50):
+        board = self.get(stream_id)
+        with self.lock:
+            if limit <= self.top_size:
+                return [key[2] for key in board['top'][:limit]]
+            keys = list(board['keys'].values())
+        return [key[2] for key in heapq.nsmallest(limit, keys)]
+
+    def vote(self, question, user_id):
+        # Returns (votes, rank), or None when the user has already voted;
+        # rank is None for a question still outside the top
+        question_id, created_at = question.id, question.created_at
+        board = self.get(question.stream_id)
+        with self.lock:
+            if (question_id, user_id) in board['voted']:
+                return None
+
+        try:
+            db.session.add(QuestionVote(question_id=question_id, user_id=user_id))
+            votes = db.session.execute(
+                update(Question)
+                .where(Question.id == question_id)
+                .values(votes_count=Question.votes_count + 1)
+                .returning(Question.votes_count)
+            ).scalar_one()
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            with self.lock:
+                board['voted'].add((question_id, user_id))
+            return None
+
+        with self.lock:
+            board['voted'].add((question_id, user_id))
+            rank = self._place(board, question_id, votes, created_at)
+        return votes, rank
+
+
+question_board = QuestionLeaderboard()
@@ -0,0 +1,160 @@
+import argparse
+import sys
+from datetime import datetime
+
+from sqlalchemy import DateTime, delete, func, insert, select, type_coerce, update
+from sqlalchemy.dialects import postgresql, sqlite
+
+from app import db
+from models import Order, Product, SalesRollup
+
+KEY = ('seller_id', 'stream_id', 'product_id', 'hour')
+TOTALS = ('orders', 'quantity', 'revenue')
+
+
+def dialect_of(executor):
+    # A Connection knows its dialect, a Session knows it through its bind
+    return getattr(executor, 'dialect', None) or executor.get_bind().dialect
+
+
+def hour_bucket(dialect, column):
+    # Must match how the dialect stores a Python datetime truncated to the hour
+    if dialect.name == 'sqlite':
+        return type_coerce(func.strftime('%Y-%m-%d %H:00:00.000000', column), DateTime)
+    return func.date_trunc('hour', column)
+
+
+def truncate_hour(moment):
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+
+class SalesRollupService:
+    """Hourly sales per (seller, stream, product), maintained incrementally.
+
+    Placing an order adds it to its hour's row with one upsert in the order's
+    own transaction, so the seller dashboard reads a few pre-aggregated rows
+    instead of grouping the raw order table on every view. `rebuild`
+    recomputes hours from the raw orders (backfill, or after a bulk import)
+    and `check` reports every hour where the two disagree.
+    """
+
+    def record(self, order, seller_id):
+        # Call before the order's transaction commits
+        if order.created_at is None:
+            order.created_at = datetime.utcnow()
+        values = {
+            'seller_id': seller_id,
+            'stream_id': order.stream_id or 0,
+            'product_id': order.product_id,
+            'hour': truncate_hour(order.created_at),
+            'orders': 1,
+            'quantity': order.quantity,
+            'revenue': order.total_amount,
+        }
+        dialect = dialect_of(db.session)
+        if dialect.name in ('postgresql', 'sqlite'):
+            dialect_insert = postgresql.insert if dialect.name == 'postgresql' else sqlite.insert
+            statement = dialect_insert(SalesRollup).values(**values)
+            db.session.execute(statement.on_conflict_do_update(
+                index_elements=list(KEY),
+                set_={name: getattr(SalesRollup, name) + getattr(statement.excluded, name) for name in TOTALS}
+            ))
+            return
+        updated = db.session.execute(
+            update(SalesRollup)
+            .where(*[getattr(SalesRollup, name) == values[name] for name in KEY])
+            .values(**{name: getattr(SalesRollup, name) + values[name] for name in TOTALS})
+        ).rowcount
+        if not updated:
+            db.session.execute(insert(SalesRollup).values(**values))
+
+    def aggregate(self, dialect, since=None):
+        # The rollup rows computed from the raw orders, same columns as SalesRollup
+        hour = hour_bucket(dialect, Order.created_at)
+        stream_id = func.coalesce(Order.stream_id, 0)
+        query = select(Product.seller_id, stream_id, Order.product_id, hour,
+                       func.count(Order.id), func.sum(Order.quantity), func.sum(Order.total_amount))\
+            .join(Product, Product.id == Order.product_id)\
+            .where(Order.created_at.is_not(None))\
+            .group_by(Product.seller_id, stream_id, Order.product_id, hour)
+        if since is not None:
+            query = query.where(Order.created_at >= truncate_hour(since))
+        return query
+
+    def rebuild(self, since=None, executor=None):
+        # Replaces every rollup row from `since` (all of them by default);
+        # the caller commits. Returns the number of rows written
+        executor = executor or db.session
+        dialect = dialect_of(executor)
+        clear = delete(SalesRollup)
+        if since is not None:
+            clear = clear.where(SalesRollup.hour >= truncate_hour(since))
+        executor.execute(clear)
+        return executor.execute(
+            insert(SalesRollup).from_select(KEY + TOTALS, self.aggregate(dialect, since))
+        ).rowcount
+
+    def check(self, since=None):
+        # [(key, expected totals, rollup totals)] for every hour that disagrees
+        expected = {tuple(row[:4]): tuple(row[4:])
+                    for row in db.session.execute(self.aggregate(dialect_of(db.session), since))}
+        query = select(*[getattr(SalesRollup, name) for name in KEY + TOTALS])
+        if since is not None:
+            query = query.where(SalesRollup.hour >= truncate_hour(since))
+        actual = {tuple(row[:4]): tuple(row[4:]) for row in db.session.execute(query)}
+
+        mismatches = []
+        for key in sorted(expected.keys() | actual.keys()):
+            want = expected.get(key, (0, 0, 0.0))
+            have = actual.get(key, (0, 0, 0.0))
+            if want[:2] != have[:2] or abs((want[2] or 0) - (have[2] or 0)) > 0.005:
+                mismatches.append((key, want, have))
+        return mismatches
+
+    def hourly(self, stream_id):
+        # [(hour, revenue, orders)] of a stream, oldest first
+        return db.session.query(
+            SalesRollup.hour,
+            func.sum(SalesRollup.revenue).label('revenue'),
+            func.sum(SalesRollup.orders).label('orders')
+        ).filter(
+            SalesRollup.stream_id == stream_id
+        ).group_by(SalesRollup.hour).order_by(SalesRollup.hour).all()
+
+    def by_product(self, stream_id):
+        # {product_id: (orders, quantity, revenue)} of a stream
+        rows = db.session.query(
+            SalesRollup.product_id,
+            func.sum(SalesRollup.orders),
+            func.sum(SalesRollup.quantity),
+            func.sum(SalesRollup.revenue)
+        ).filter(
+            SalesRollup.stream_id == stream_id
+        ).group_by(SalesRollup.product_id).all()
+        return {product_id: (orders, quantity, revenue) for product_id, orders, quantity, revenue in rows}
+
+
+sales_rollup = SalesRollupService()
+
+
+if __name__ == '__main__':
+    from app import create_app
+
+    parser = argparse.ArgumentParser(description='Rebuild or verify the hourly sales rollup')
+    parser.add_argument('command', choices=['rebuild', 'check'])
+    parser.add_argument('--since', type=datetime.fromisoformat,
+                        help='only hours from this time on, e.g. 2024-05-01T13:00')
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        if args.command == 'rebuild':
+            rows = sales_rollup.rebuild(args.since)
+            db.session.commit()
+            print(f'Rebuilt {rows} rollup rows')
+        else:
+            mismatches = sales_rollup.check(args.since)
+            for key, want, have in mismatches:
+                print(f'MISMATCH {dict(zip(KEY, key))} orders: {want} rollup: {have}')
+            print(f'{len(mismatches)} mismatched hours')
+            sys.exit(1 if mismatches else 0)
@@ -0,0 +1,161 @@
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from flask import current_app
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from sqlalchemy import delete, insert, select, update
+from werkzeug.datastructures import CallbackDict
+
+from app import db, socketio
+from models import UserSession
+
+serializer = TaggedJSONSerializer()
+
+
+class ServerSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None, new=False):
+        def on_update(self):
+            self.modified = True
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+
+
+class DatabaseSessionInterface(SessionInterface):
+    """Server-side sessions kept as one compact row per session.
+
+    The cookie only carries a random session id. Reads go through an
+    in-process LRU cache, so most requests and Socket.IO connects never touch
+    the database; cached entries are trusted for `cache_ttl` seconds, which
+    bounds how long a logout on another worker can go unseen. Expiry slides
+    with use but the row is only rewritten once half its lifetime is gone,
+    and expired rows are deleted in bulk every `sweep_interval` seconds.
+    """
+
+    def __init__(self, lifetime=timedelta(days=31), cache_size=10000, cache_ttl=30.0,
+                 sweep_interval=600.0):
+        self.lifetime = lifetime
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self.sweep_interval = sweep_interval
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.app = None
+
+    def _cached(self, sid):
+        with self.lock:
+            entry = self.cache.get(sid)
+            if entry is None or time.monotonic() - entry[2] >= self.cache_ttl:
+                return None
+            self.cache.move_to_end(sid)
+            return entry
+
+    def _remember(self, sid, payload, expires_at):
+        with self.lock:
+            self.cache[sid] = (payload, expires_at, time.monotonic())
+            self.cache.move_to_end(sid)
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+    def _forget(self, sid):
+        with self.lock:
+            self.cache.pop(sid, None)
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if not sid:
+            return ServerSession(sid=secrets.token_urlsafe(32), new=True)
+
+        entry = self._cached(sid)
+        if entry is None:
+            with db.engine.connect() as conn:
+                row = conn.execute(select(UserSession.data, UserSession.expires_at)
+                                   .where(UserSession.id == sid)).first()
+            if row is not None:
+                entry = tuple(row)
+                self._remember(sid, *entry)
+        if entry is None or entry[1] <= datetime.utcnow():
+            return ServerSession(sid=secrets.token_urlsafe(32), new=True)
+
+        session = ServerSession(serializer.loads(entry[0]), sid=sid)
+        session.expires_at = entry[1]
+        return session
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if not session:
+            if session.modified and not session.new:
+                self._forget(session.sid)
+                with db.engine.begin() as conn:
+                    conn.execute(delete(UserSession).where(UserSession.id == session.sid))
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        now = datetime.utcnow()
+        expires_at = now + self.lifetime
+        # Unchanged sessions are only rewritten to slide their expiry once
+        # half of the lifetime has passed
+        stale = getattr(session, 'expires_at', now) - now < self.lifetime / 2
+        if session.modified or session.new or stale:
+            payload = serializer.dumps(dict(session))
+            self._store(session.sid, payload, expires_at, session.new)
+            self._remember(session.sid, payload, expires_at)
+            self._start_sweeper()
+
+        if session.modified or session.new or stale or self.should_set_cookie(app, session):
+            response.set_cookie(
+                name, session.sid,
+                expires=expires_at,
+                httponly=self.get_cookie_httponly(app),
+                domain=domain,
+                path=path,
+                secure=self.get_cookie_secure(app),
+                samesite=self.get_cookie_samesite(app)
+            )
+
+    def _store(self, sid, payload, expires_at, new):
+        # Session writes commit on their own, outside the request's transaction
+        with db.engine.begin() as conn:
+            if not new:
+                updated = conn.execute(update(UserSession)
+                                       .where(UserSession.id == sid)
+                                       .values(data=payload, expires_at=expires_at)).rowcount
+                if updated:
+                    return
+            # New, or swept since it was read
+            conn.execute(insert(UserSession).values(id=sid, data=payload, expires_at=expires_at))
+
+    def expire(self, now=None):
+        # Bulk-delete every expired session, returns how many were removed
+        now = now or datetime.utcnow()
+        with db.engine.begin() as conn:
+            removed = conn.execute(delete(UserSession).where(UserSession.expires_at <= now)).rowcount
+        with self.lock:
+            for sid in [sid for sid, entry in self.cache.items() if entry[1] <= now]:
+                del self.cache[sid]
+        return removed
+
+    def _start_sweeper(self):
+        with self.lock:
+            start = self.app is None
+            if start:
+                self.app = current_app._get_current_object()
+        if start:
+            socketio.start_background_task(self._run)
+
+    def _run(self):
+        while True:
+            with self.app.app_context():
+                try:
+                    self.expire()
+                except Exception:
+                    current_app.logger.exception('Failed to expire sessions')
+            socketio.sleep(self.sweep_interval)
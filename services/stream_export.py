@@ -0,0 +1,239 @@
+import argparse
+import csv
+import gzip
+import heapq
+import io
+import json
+import os
+import sys
+from datetime import datetime, timezone
+from itertools import islice
+
+from sqlalchemy import select
+
+from app import db
+from models import ChatMessage, Order, Question
+
+COLUMNS = ('time', 'event', 'user_id', 'product_id', 'poll_id', 'quantity', 'amount', 'text')
+
+# Viewer events taken from the analytics log. Chat and orders are logged
+# there too but exported from their tables, which hold the full rows
+LOG_EVENTS = {'join', 'leave', 'active', 'inactive'}
+LOG_ACTIONS = {'view', 'wishlist', 'vote'}
+
+# Every event is logged at the time it is written, but a worker's threads
+# take the timestamp before the log lock, so a segment can be out of order
+# by this much writer skew. Logs written before expired leaves were logged
+# at the current time can be further out; those rows are merged as they are
+REORDER_WINDOW = 2.0
+
+# Spreadsheets evaluate cells starting with these as formulas
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+def epoch(moment):
+    # Naive datetimes are UTC throughout the app
+    return moment.replace(tzinfo=timezone.utc).timestamp()
+
+
+def log_rows(log_directory, stream_id):
+    # One generator per log segment, each in time order; segments
+    # compacted by the analytics store are read from archive/
+    stream_dir = os.path.join(log_directory, str(stream_id))
+    if not os.path.isdir(stream_dir):
+        return []
+    archive_dir = os.path.join(stream_dir, 'archive')
+    archived = sorted(os.listdir(archive_dir)) if os.path.isdir(archive_dir) else []
+    paths = [os.path.join(archive_dir, name) for name in archived if name.endswith('.log.gz')] + \
+        [os.path.join(stream_dir, name) for name in sorted(os.listdir(stream_dir)) if name.endswith('.log')]
+    return [in_time_order(read_log(path)) for path in paths]
+
+
+def in_time_order(rows, window=REORDER_WINDOW):
+    # Sorts rows that are at most `window` seconds out of order, holding
+    # only that window in memory; later rows pass through unsorted
+    pending = []
+    latest = float('-inf')
+    for sequence, row in enumerate(rows):
+        heapq.heappush(pending, (row[0], sequence, row))
+        latest = max(latest, row[0])
+        while pending[0][0] <= latest - window:
+            yield heapq.heappop(pending)[2]
+    while pending:
+        yield heapq.heappop(pending)[2]
+
+
+def read_log(path):
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            if not line.endswith('\n'):
+                break  # a worker is mid-write
+            event = json.loads(line)
+            if event['type'] in LOG_EVENTS:
+                yield (event['t'], event['type'], event.get('user'), None, None, None, None, event.get('device'))
+            elif event['type'] == 'action' and event['action'] in LOG_ACTIONS:
+                yield (event['t'], event['action'], event.get('user'), event.get('product'),
+                       event.get('poll'), None, None, event.get('option'))
+
+
+def table_rows(statement, batch_size, row):
+    # Streams the rows of an ordered query batch_size at a time
+    for record in db.session.execute(statement.execution_options(yield_per=batch_size)):
+        yield row(record)
+
+
+def stream_events(stream_id, log_directory, batch_size=5000):
+    """Every event of a stream, oldest first, as tuples in COLUMNS order.
+
+    The analytics log (viewer joins, leaves, activity, product views,
+    wishlist saves, poll votes) and the chat, question and order tables are
+    each read as a stream and merged lazily, so memory does not grow with
+    the length of the stream.
+    """
+    sources = log_rows(log_directory, stream_id)
+    sources.append(table_rows(
+        select(ChatMessage.created_at, ChatMessage.user_id, ChatMessage.message)
+        .where(ChatMessage.stream_id == stream_id)
+        .order_by(ChatMessage.created_at, ChatMessage.id),
+        batch_size,
+        lambda r: (epoch(r.created_at), 'chat', r.user_id, None, None, None, None, r.message)
+    ))
+    sources.append(table_rows(
+        select(Question.created_at, Question.user_id, Question.question)
+        .where(Question.stream_id == stream_id)
+        .order_by(Question.created_at, Question.id),
+        batch_size,
+        lambda r: (epoch(r.created_at), 'question', r.user_id, None, None, None, None, r.question)
+    ))
+    sources.append(table_rows(
+        select(Order.created_at, Order.user_id, Order.product_id, Order.quantity, Order.total_amount)
+        .where(Order.stream_id == stream_id)
+        .order_by(Order.created_at, Order.id),
+        batch_size,
+        lambda r: (epoch(r.created_at), 'order', r.user_id, r.product_id, None, r.quantity, r.total_amount, None)
+    ))
+    return heapq.merge(*sources, key=lambda row: row[0])
+
+
+def batches(rows, size):
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+
+def csv_cell(value):
+    # Quoted so chat text like =HYPERLINK(...) stays text when opened
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def csv_chunks(rows, rows_per_chunk=5000):
+    # CSV text, one chunk per rows_per_chunk rows
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(COLUMNS)
+    for batch in batches(rows, rows_per_chunk):
+        writer.writerows(
+            (datetime.fromtimestamp(row[0], timezone.utc).isoformat(),) + tuple(csv_cell(value) for value in row[1:])
+            for row in batch
+        )
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+class ChunkSink:
+    # Write-only file for pyarrow that hands back what was written since the
+    # last take(); tell() keeps counting so the footer's offsets stay right
+    closed = False
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def writable(self):
+        return True
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self):
+        data, self.chunks = b''.join(self.chunks), []
+        return data
+
+
+def parquet_chunks(rows, row_group_size=50000):
+    # Parquet bytes, one chunk per row group and a last one with the footer
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([
+        ('time', pa.timestamp('us', tz='UTC')),
+        ('event', pa.string()),
+        ('user_id', pa.int64()),
+        ('product_id', pa.int64()),
+        ('poll_id', pa.int64()),
+        ('quantity', pa.int32()),
+        ('amount', pa.float64()),
+        ('text', pa.string()),
+    ])
+    sink = ChunkSink()
+    writer = pq.ParquetWriter(sink, schema, compression='zstd')
+    try:
+        for batch in batches(rows, row_group_size):
+            columns = list(zip(*batch))
+            columns[0] = [round(t * 1_000_000) for t in columns[0]]
+            writer.write_table(pa.table(
+                [pa.array(values, type=field.type) for values, field in zip(columns, schema)],
+                schema=schema
+            ))
+            yield sink.take()
+    finally:
+        writer.close()
+    yield sink.take()
+
+
+def export_chunks(stream_id, log_directory, format='csv'):
+    rows = stream_events(stream_id, log_directory)
+    if format == 'parquet':
+        return parquet_chunks(rows)
+    return (chunk.encode('utf-8') for chunk in csv_chunks(rows))
+
+
+if __name__ == '__main__':
+    from app import create_app
+    from services.analytics_store import log_directory
+
+    parser = argparse.ArgumentParser(description="Export a stream's full event history")
+    parser.add_argument('stream_id', type=int)
+    parser.add_argument('--format', choices=['csv', 'parquet'], default='csv')
+    parser.add_argument('--output', '-o', default='-', help='file to write, - for stdout')
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        out = sys.stdout.buffer if args.output == '-' else open(args.output, 'wb')
+        try:
+            for chunk in export_chunks(args.stream_id, log_directory(), args.format):
+                out.write(chunk)
+        finally:
+            if out is not sys.stdout.buffer:
+                out.close()
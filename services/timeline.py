@@ -0,0 +1,210 @@
+import heapq
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy import and_, delete, exists, func, insert, literal, select, update
+from sqlalchemy.orm import joinedload
+
+from app import db, socketio
+from models import ActivityFeed, TimelineEntry, User, follow_graph, followers
+
+
+class TimelineService:
+    """Per-follower activity timelines, filled in when activity is written.
+
+    Publishing an activity copies a reference to it into every follower's
+    timeline with one INSERT ... SELECT, so reading a feed is a single range
+    read on (owner_id, created_at). Sellers with more than `mega_threshold`
+    followers are not fanned out; their activity is pulled at read time and
+    merged in. Timelines are trimmed back to `cap` entries in the background,
+    and follow/unfollow backfill or purge a timeline off the request path.
+    """
+
+    def __init__(self, cap=200, mega_threshold=5000, interval=0.5,
+                 trim_interval=10.0, mega_refresh=300.0):
+        self.cap = cap
+        self.mega_threshold = mega_threshold
+        self.interval = interval
+        self.trim_interval = trim_interval
+        self.mega_refresh = mega_refresh
+        self.jobs = []
+        self.trim_authors = set()
+        self.trim_owners = set()
+        self.mega = set()
+        self.mega_loaded = None
+        self.last_trim = time.monotonic()
+        self.lock = threading.Lock()
+        self.app = None
+
+    def mega_authors(self):
+        # Everyone's fan-out and read paths agree on this set, it is
+        # refreshed from the indexed follower counts every `mega_refresh` seconds
+        if self.mega_loaded is None or time.monotonic() - self.mega_loaded >= self.mega_refresh:
+            rows = db.session.query(User.id).filter(User.follower_count > self.mega_threshold)
+            self.mega = {user_id for (user_id,) in rows}
+            self.mega_loaded = time.monotonic()
+        return self.mega
+
+    def _enqueue(self, job):
+        with self.lock:
+            self.jobs.append(job)
+            start = self.app is None
+            if start:
+                self.app = current_app._get_current_object()
+        if start:
+            socketio.start_background_task(self._run)
+
+    def publish(self, activity_id, author_id):
+        if author_id not in self.mega_authors():
+            self._enqueue(('fan_out', activity_id, author_id))
+
+    def follow(self, owner_id, author_id):
+        if author_id not in self.mega_authors():
+            self._enqueue(('backfill', owner_id, author_id))
+
+    def unfollow(self, owner_id, author_id):
+        self._enqueue(('purge', owner_id, author_id))
+
+    def fan_out(self, activity_id, author_id):
+        db.session.execute(insert(TimelineEntry).from_select(
+            ['owner_id', 'activity_id', 'author_id', 'created_at'],
+            select(followers.c.follower_id, ActivityFeed.id, ActivityFeed.user_id, ActivityFeed.created_at)
+                .join(followers, followers.c.followed_id == ActivityFeed.user_id)
+                .where(ActivityFeed.id == activity_id)
+        ))
+        with self.lock:
+            self.trim_authors.add(author_id)
+
+    def backfill(self, owner_id, author_id):
+        recent = select(ActivityFeed.id, ActivityFeed.user_id, ActivityFeed.created_at)\
+            .where(ActivityFeed.user_id == author_id)\
+            .where(~exists().where(and_(TimelineEntry.owner_id == owner_id,
+                                        TimelineEntry.activity_id == ActivityFeed.id)))\
+            .order_by(ActivityFeed.created_at.desc())\
+            .limit(self.cap)\
+            .subquery()
+        db.session.execute(insert(TimelineEntry).from_select(
+            ['owner_id', 'activity_id', 'author_id', 'created_at'],
+            select(literal(owner_id), recent.c.id, recent.c.user_id, recent.c.created_at)
+        ))
+        with self.lock:
+            self.trim_owners.add(owner_id)
+
+    def count_followers(self, executor=None):
+        # Recomputes every user's follower_count from the follower table;
+        # the caller commits
+        executor = executor or db.session
+        executor.execute(update(User).values(follower_count=
+            select(func.count()).where(followers.c.followed_id == User.id).scalar_subquery()
+        ))
+
+    def backfill_all(self, executor=None):
+        # Fills every timeline with the newest `cap` activities of each
+        # followed seller that is fanned out, skipping entries already there;
+        # needs current follower counts. The caller commits
+        executor = executor or db.session
+        ranked = select(
+            ActivityFeed.id, ActivityFeed.user_id, ActivityFeed.created_at,
+            func.row_number().over(
+                partition_by=ActivityFeed.user_id,
+                order_by=(ActivityFeed.created_at.desc(), ActivityFeed.id.desc())
+            ).label('position')
+        ).subquery()
+        return executor.execute(insert(TimelineEntry).from_select(
+            ['owner_id', 'activity_id', 'author_id', 'created_at'],
+            select(followers.c.follower_id, ranked.c.id, ranked.c.user_id, ranked.c.created_at)
+                .join(followers, followers.c.followed_id == ranked.c.user_id)
+                .join(User, User.id == ranked.c.user_id)
+                .where(ranked.c.position <= self.cap)
+                .where(func.coalesce(User.follower_count, 0) <= self.mega_threshold)
+                .where(~exists().where(and_(TimelineEntry.owner_id == followers.c.follower_id,
+                                            TimelineEntry.activity_id == ranked.c.id)))
+        )).rowcount
+
+    def purge(self, owner_id, author_id):
+        db.session.execute(delete(TimelineEntry).where(
+            TimelineEntry.owner_id == owner_id,
+            TimelineEntry.author_id == author_id
+        ))
+
+    def trim(self):
+        # Drop everything past the newest `cap` entries of every timeline
+        # touched since the last trim, in one statement
+        with self.lock:
+            authors, self.trim_authors = self.trim_authors, set()
+            owners, self.trim_owners = self.trim_owners, set()
+        if not authors and not owners:
+            return
+        owner_filter = TimelineEntry.owner_id.in_(owners)
+        if authors:
+            owner_filter = owner_filter | TimelineEntry.owner_id.in_(
+                select(followers.c.follower_id).where(followers.c.followed_id.in_(authors))
+            )
+        ranked = select(
+            TimelineEntry.id,
+            func.row_number().over(
+                partition_by=TimelineEntry.owner_id,
+                order_by=(TimelineEntry.created_at.desc(), TimelineEntry.id.desc())
+            ).label('position')
+        ).where(owner_filter).subquery()
+        db.session.execute(delete(TimelineEntry).where(TimelineEntry.id.in_(
+            select(ranked.c.id).where(ranked.c.position > self.cap)
+        )))
+
+    def read(self, owner_id, limit=50):
+        # Newest first: the owner's timeline range plus activity pulled from
+        # followed mega-sellers, deduplicated by activity id
+        entries = TimelineEntry.query\
+            .options(joinedload(TimelineEntry.activity).joinedload(ActivityFeed.user))\
+            .filter(TimelineEntry.owner_id == owner_id)\
+            .order_by(TimelineEntry.created_at.desc(), TimelineEntry.id.desc())\
+            .limit(limit)\
+            .all()
+        activities = [entry.activity for entry in entries]
+
+        pulled = follow_graph.followed_ids(owner_id) & self.mega_authors()
+        if pulled:
+            recent = ActivityFeed.query\
+                .options(joinedload(ActivityFeed.user))\
+                .filter(ActivityFeed.user_id.in_(pulled))\
+                .order_by(ActivityFeed.created_at.desc())\
+                .limit(limit)\
+                .all()
+            merged = heapq.merge(activities, recent, key=lambda activity: activity.created_at, reverse=True)
+            seen = set()
+            activities = []
+            for activity in merged:
+                if activity.id not in seen:
+                    seen.add(activity.id)
+                    activities.append(activity)
+            activities = activities[:limit]
+        return activities
+
+    def run_pending(self):
+        with self.lock:
+            jobs, self.jobs = self.jobs, []
+        for job in jobs:
+            try:
+                getattr(self, job[0])(*job[1:])
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                current_app.logger.exception('Timeline job %s failed', job[0])
+        if time.monotonic() - self.last_trim >= self.trim_interval:
+            self.last_trim = time.monotonic()
+            try:
+                self.trim()
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                current_app.logger.exception('Failed to trim timelines')
+
+    def _run(self):
+        while True:
+            socketio.sleep(self.interval)
+            with self.app.app_context():
+                self.run_pending()
+
+
+timeline = TimelineService()
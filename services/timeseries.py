@@ -0,0 +1,117 @@
+from array import array
+from collections import deque
+from datetime import datetime, timezone
+
+
+class RollingSeries:
+    """Fixed-size ring buffer of per-second samples for a set of fields.
+
+    One slot per `resolution` seconds over `window` seconds. A sample
+    overwrites the slot for its second, and seconds without samples carry the
+    last value forward. Sums and monotonic max queues are kept alongside the
+    ring, so append, rolling mean and rolling peak are all O(1) amortised.
+    """
+
+    def __init__(self, fields, window=3600, resolution=1):
+        self.fields = tuple(fields)
+        self.resolution = resolution
+        self.size = window // resolution
+        self.slots = {field: array('q', bytes(array('q').itemsize * self.size)) for field in self.fields}
+        self.sums = dict.fromkeys(self.fields, 0)
+        self.peaks = {field: deque() for field in self.fields}
+        self.head = None  # index of the newest slot
+        self.count = 0
+
+    def _slot(self, timestamp):
+        if isinstance(timestamp, datetime):
+            # Naive datetimes are UTC throughout the app (datetime.utcnow)
+            if timestamp.tzinfo is None:
+                timestamp = timestamp.replace(tzinfo=timezone.utc)
+            timestamp = timestamp.timestamp()
+        return int(timestamp // self.resolution)
+
+    def _push(self, slot, values):
+        # Move to a new slot, evicting the oldest one when the ring is full
+        position = slot % self.size
+        for field in self.fields:
+            ring = self.slots[field]
+            if self.count == self.size:
+                self.sums[field] -= ring[position]
+            ring[position] = values[field]
+            self.sums[field] += values[field]
+
+            peaks = self.peaks[field]
+            while peaks and peaks[-1][1] <= values[field]:
+                peaks.pop()
+            peaks.append((slot, values[field]))
+            while peaks[0][0] <= slot - self.size:
+                peaks.popleft()
+        self.count = min(self.count + 1, self.size)
+
+    def append(self, timestamp, **values):
+        slot = self._slot(timestamp)
+        if self.head is None or slot - self.head >= self.size:
+            self.clear()
+        elif slot < self.head:
+            # Late samples are folded into the newest slot
+            slot = self.head
+
+        if self.head is not None and slot > self.head:
+            last = self.latest()
+            for missing in range(self.head + 1, slot):
+                self._push(missing, last)
+            self._push(slot, values)
+        elif self.head == slot:
+            self._overwrite(slot, values)
+        else:
+            self._push(slot, values)
+        self.head = slot
+
+    def _overwrite(self, slot, values):
+        position = slot % self.size
+        for field in self.fields:
+            ring = self.slots[field]
+            self.sums[field] += values[field] - ring[position]
+            ring[position] = values[field]
+
+            # The peak keeps the highest value seen within the slot
+            peaks = self.peaks[field]
+            while peaks and peaks[-1][1] <= values[field]:
+                peaks.pop()
+            if not peaks or peaks[-1][0] != slot:
+                peaks.append((slot, values[field]))
+
+    def clear(self):
+        for field in self.fields:
+            self.sums[field] = 0
+            self.peaks[field].clear()
+        self.head = None
+        self.count = 0
+
+    def latest(self):
+        if self.head is None:
+            return dict.fromkeys(self.fields, 0)
+        position = self.head % self.size
+        return {field: self.slots[field][position] for field in self.fields}
+
+    def mean(self, field):
+        return self.sums[field] / self.count if self.count else 0
+
+    def peak(self, field):
+        peaks = self.peaks[field]
+        return peaks[0][1] if peaks else 0
+
+    def to_chart_series(self, step=60):
+        # Oldest-first samples every `step` seconds, ready for Chart.js
+        series = {'labels': []}
+        series.update({field: [] for field in self.fields})
+        if self.head is None:
+            return series
+        stride = max(1, step // self.resolution)
+        first = self.head - self.count + 1
+        for slot in range(first, self.head + 1, stride):
+            position = slot % self.size
+            series['labels'].append(slot * self.resolution * 1000)
+            for field in self.fields:
+                series[field].append(self.slots[field][position])
+        return series
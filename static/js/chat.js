@@ -8,6 +8,35 @@ function initializeChat() {
     
     if (!chatMessages || !messageForm || !ROOM_ID) return;
 
+    let nextCursor = null;
+
+    function renderMessages(messages) {
+        const fragment = document.createDocumentFragment();
+        messages.forEach(message => {
+            const messageDiv = document.createElement('div');
+            messageDiv.className = 'chat-message';
+            messageDiv.textContent = `${message.username}: ${message.message}`;
+            fragment.appendChild(messageDiv);
+        });
+        return fragment;
+    }
+
+    // Older history is paged from the server by cursor
+    const loadEarlier = document.createElement('button');
+    loadEarlier.type = 'button';
+    loadEarlier.className = 'btn btn-link btn-sm w-100';
+    loadEarlier.textContent = 'Load earlier messages';
+    loadEarlier.style.display = 'none';
+    loadEarlier.addEventListener('click', () => {
+        fetch(`/stream/${ROOM_ID}/chat?before=${encodeURIComponent(nextCursor)}`)
+            .then(response => response.json())
+            .then(data => {
+                loadEarlier.after(renderMessages(data.messages));
+                nextCursor = data.next_cursor;
+                loadEarlier.style.display = nextCursor ? 'block' : 'none';
+            });
+    });
+
     // Send chat message
     messageForm.addEventListener('submit', e => {
         e.preventDefault();
@@ -23,12 +52,17 @@ function initializeChat() {
         }
     });
 
-    // Receive chat message
+    // Recent messages replayed by the server when joining the room
+    socket.on('chat_history', data => {
+        chatMessages.replaceChildren(loadEarlier, renderMessages(data.messages));
+        nextCursor = data.next_cursor;
+        loadEarlier.style.display = nextCursor ? 'block' : 'none';
+        chatMessages.scrollTop = chatMessages.scrollHeight;
+    });
+
+    // Receive chat messages, the server batches them per room
     socket.on('chat_message', data => {
-        const messageDiv = document.createElement('div');
-        messageDiv.className = 'chat-message';
-        messageDiv.textContent = `${data.username}: ${data.message}`;
-        chatMessages.appendChild(messageDiv);
+        chatMessages.appendChild(renderMessages(data.messages || [data]));
         chatMessages.scrollTop = chatMessages.scrollHeight;
     });
 
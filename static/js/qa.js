@@ -132,6 +132,15 @@ function initializeQA() {
         if (questionDiv) {
             const voteCount = questionDiv.querySelector('.vote-count');
             voteCount.textContent = data.votes;
+
+            // Move the question to its new leaderboard position
+            if (data.rank !== undefined) {
+                const container = questionDiv.parentElement;
+                const target = container.children[data.rank] || null;
+                if (target !== questionDiv) {
+                    container.insertBefore(questionDiv, target);
+                }
+            }
         }
     });
 
@@ -32,6 +32,19 @@ function initAnalytics() {
             socket.emit('viewer_activity', { room: ROOM_ID, active: false });
         }
     }, 60000);
+
+    // Product views feed the engagement heatmap, at most one per product a minute
+    const lastViewed = {};
+    document.querySelectorAll('#products .card').forEach((card) => {
+        const product = card.querySelector('[data-product-id]');
+        if (!product) return;
+        const productId = product.dataset.productId;
+        card.addEventListener('mouseenter', () => {
+            if (Date.now() - (lastViewed[productId] || 0) < 60000) return;
+            lastViewed[productId] = Date.now();
+            socket.emit('viewer_action', { room: ROOM_ID, action: 'view', product_id: productId });
+        });
+    });
 }
 
 // Handle analytics updates
@@ -293,4 +293,27 @@ socket.on('engagement_update', data => {
     }
 });
 
+// Flash sale prices on the product cards
+function setProductPrice(productId, salePrice) {
+    const priceElement = document.querySelector(`.product-price[data-product-id="${productId}"]`);
+    if (!priceElement) return;
+    const price = priceElement.dataset.price;
+    if (salePrice === null) {
+        priceElement.textContent = `$${price}`;
+        return;
+    }
+    priceElement.innerHTML = `
+        <del class="text-muted">$${price}</del>
+        <span class="text-danger">$${Number(salePrice).toFixed(2)}</span>
+    `;
+}
+
+socket.on('flash_sale_started', data => {
+    setProductPrice(data.product_id, data.price);
+});
+
+socket.on('flash_sale_ended', data => {
+    setProductPrice(data.product_id, null);
+});
+
 export { startStream, stopStream };